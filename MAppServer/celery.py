@@ -0,0 +1,18 @@
+"""Celery application, for the "celery" broker of the updates of the beliefs (see `assistant.belief_update_queue`).
+
+Workers are started with `celery -A MAppServer.celery worker`.
+"""
+import os
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "MAppServer.settings")
+
+app = Celery("MAppServer")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+
+
+@app.task(name="assistant.run_belief_update_job")
+def run_belief_update_job(user_id: int):
+    # Django is set up by the worker by then
+    from assistant.belief_update_queue import get_belief_update_queue
+    get_belief_update_queue().run_job(user_id)
@@ -171,6 +171,33 @@ ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER = 0.3
 GAMMA = 1.0
 LOG_PRIOR = np.log(softmax(np.arange(N_POSITION)*2))
 SEED_ASSISTANT = 40
+# Epistemic weight of the transitions never observed (pseudo-count of 0).
+# False: as in the original evaluation of the action plans, it is 0 only for the first action plan
+# going through the (action, timestep); the next ones see a pseudo-count of 1,
+# so that the value of an action plan depends on the action plans evaluated before it.
+# True: it is always 0, and the value of an action plan does not depend on the other ones
+# (needed by the prefix tree, the policy table, the deadline and the planners other than the enumeration).
+# Keep False to select the same action plans as the original evaluation:
+# True changes the decisions (the selected action plan changes in about half the cases).
+ORDER_INDEPENDENT_EPISTEMIC_VALUE = False
+# Number of action plan evaluations kept in memory (shared by all the users, 0 to disable)
+DECISION_CACHE_SIZE = 1024
+# Sum the steps of each timestep in the database (PostgreSQL only), instead of reading every activity
+ACTIVITY_BINNING_IN_DATABASE = True
+# Where the beliefs are updated after a request: None (during the request),
+# "local" (pool of threads of the server) or "celery" (workers started with `celery -A MAppServer.celery worker`).
+# With a broker, the response of an update is sent at once and the challenges are only updated after it
+# (they are sent at the next sync). The default is None, so still synchronous, because the simulations
+# (e.g. test/test__client__generative_model.py) read the challenges right after each request:
+# set "local" or "celery" on the server.
+BELIEF_UPDATE_BROKER = None
+# Number of threads of the "local" broker
+BELIEF_UPDATE_N_WORKERS = 2
+# For the "celery" broker: after how long (in seconds) a job still pending is considered lost
+BELIEF_UPDATE_PENDING_TIMEOUT = 600
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0")
+# For the "celery" broker: Redis server where the pending jobs are shared by the server and the workers
+BELIEF_UPDATE_REDIS_URL = os.environ.get("BELIEF_UPDATE_REDIS_URL", "redis://localhost:6379/1")
 # ------------------------------------------------------
 # Parameters for the generative model
 DATA_FOLDER = os.path.dirname(os.path.dirname(__file__)) + "/data"
@@ -184,6 +211,23 @@ SCALE_NUDGE_EFFECT = 50
 # -------------------------------------------
 # Using an heuristic to debug
 HEURISTIC = None
+# How to select the action plan: "enumeration" (all the action plans are evaluated),
+# "branch_and_bound" (same selection, but without evaluating the action plans that cannot be the best),
+# "beam_search" (approximate: the action plans are never enumerated, only the best partial ones
+# are kept at each challenge window, see BEAM_SEARCH_WIDTH),
+# "factorized" (greedy, so approximate: the challenges are planned one after the other,
+# i.e. the beam search with a single partial action plan)
+# or "streaming" (the action plans are generated and evaluated chunk by chunk)
+PLANNER = "enumeration"
+# Number of action plans generated at once by the "streaming" planner
+ACTION_PLAN_CHUNK_SIZE = 4096
+# Where the action plans of each configuration are saved, to be shared by all the processes (None to disable)
+ACTION_PLAN_LIBRARY_DIR = os.path.join(BASE_DIR, "cache", "action_plan_library")
+# Number of partial action plans kept at the start of each challenge window by the "beam_search" planner
+# (exact if at least the number of combinations of strategies of all the challenges but the last one)
+BEAM_SEARCH_WIDTH = 32
+# For the "enumeration" planner: maximum time (in seconds) for evaluating the action plans (None for no limit), e.g. 0.05
+ACTION_PLAN_SELECTION_BUDGET = None
 # For the simulation -----------------------------
 INIT_POS_IDX = np.absolute(POSITION).argmin()  # Something close to 0
 # Formatting parameters -------------------------------------------
@@ -206,3 +250,7 @@ LOG_WARNING_NAN = False
 USE_PROGRESS_BAR = False
 # -----------------------------------------
 assert CHALLENGE_WINDOW % CHALLENGE_DURATION == 0, "Mmmh, that's not really working, is it?"
+assert PLANNER in ("enumeration", "branch_and_bound", "beam_search", "factorized", "streaming"), \
+    f"Planner not recognized: '{PLANNER}'"
+assert ORDER_INDEPENDENT_EPISTEMIC_VALUE or (PLANNER == "enumeration" and ACTION_PLAN_SELECTION_BUDGET is None), \
+    "Only the enumeration can reproduce the epistemic values of the original evaluation"
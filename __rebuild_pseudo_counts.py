@@ -0,0 +1,35 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+from datetime import datetime
+from pytz import timezone
+from tqdm import tqdm
+
+from MAppServer.settings import TIME_ZONE
+from user.models import User
+from assistant.models import PseudoCounts
+from assistant.pseudo_count_store import get_pseudo_counts, verify_pseudo_counts
+
+
+def main(rebuild_all: bool = False):
+    """Check the stored pseudo-counts of every user against a full recomputation,
+    and rebuild the ones that differ (or all of them, if asked for)."""
+    today = datetime.now(tz=timezone(TIME_ZONE)).date()
+    users = User.objects.filter(is_superuser=False)
+    n_invalid = 0
+    for u in tqdm(users):
+        if rebuild_all:
+            PseudoCounts.objects.filter(user=u).delete()
+            get_pseudo_counts(u=u, today=today)
+        elif not verify_pseudo_counts(u=u, today=today, rebuild=True):
+            print(f"Pseudo-counts of user `{u.username}` were out of date: rebuilt.")
+            n_invalid += 1
+    print(f"Done! {n_invalid} user(s) with out of date pseudo-counts.")
+
+
+if __name__ == "__main__":
+    rsp = input("Rebuild the pseudo-counts of ALL THE USERS from scratch (otherwise only check them)? (Y/N)")
+    main(rebuild_all=rsp.lower() in ('y', 'yes'))
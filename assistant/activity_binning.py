@@ -0,0 +1,94 @@
+import numpy as np
+from datetime import datetime
+from django.db import connection
+
+from MAppServer.settings import (
+    TIMESTEP,
+    TIME_ZONE,
+    ACTIVITY_BINNING_IN_DATABASE
+)
+from user.models import User, Activity
+from assistant.user_snapshot import read_activities, records_to_cumulative_steps
+from core.activity import timestep_increments_to_cumulative_steps
+from utils.constants import SECONDS_IN_A_DAY
+
+
+# For each record: its (local) date, the time elapsed since the (local) midnight,
+# and the number of steps until the next record of the same day (0 if the count went back).
+# The steps are then summed by day and by timestep, each record being counted
+# at the first timestep that is not before it (see `core.activity.sum_steps_by_timestep`).
+SUM_STEPS_BY_TIMESTEP_QUERY = """
+WITH records AS (
+    SELECT
+        (a.{dt} AT TIME ZONE %(time_zone)s)::date AS day,
+        EXTRACT(EPOCH FROM a.{dt} - (date_trunc('day', a.{dt} AT TIME ZONE %(time_zone)s) AT TIME ZONE %(time_zone)s)) AS elapsed,
+        GREATEST(LEAD(a.{step_midnight}) OVER day_records - a.{step_midnight}, 0) AS n_steps
+    FROM {table} a
+    WHERE {where}
+    WINDOW day_records AS (PARTITION BY (a.{dt} AT TIME ZONE %(time_zone)s)::date ORDER BY a.{dt}, a.{id})
+)
+SELECT day, CEIL(elapsed * %(n_interval)s / %(seconds_in_a_day)s)::integer AS t_bin, COALESCE(SUM(n_steps), 0)::bigint
+FROM records
+GROUP BY day, t_bin
+ORDER BY day, t_bin
+"""
+
+
+def can_sum_steps_in_database() -> bool:
+    """The query needs the date functions of PostgreSQL, and timesteps evenly spread over the day"""
+    return (
+        ACTIVITY_BINNING_IN_DATABASE
+        and connection.vendor == "postgresql"
+        and np.array_equal(TIMESTEP, np.linspace(0, 1, TIMESTEP.size)))
+
+
+def sum_steps_by_timestep_in_database(
+        u: User,
+        before: datetime = None,
+        after: datetime = None
+) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Same as `core.activity.sum_steps_by_timestep` for the activities of the user
+    before `before` and from `after` (if given), computed by the database"""
+    columns = {field: Activity._meta.get_field(field).column for field in ("dt", "step_midnight", "id")}
+    where = [f"a.{Activity._meta.get_field('user').column} = %(user_id)s"]
+    if before is not None:
+        where.append(f"a.{columns['dt']} < %(before)s")
+    if after is not None:
+        where.append(f"a.{columns['dt']} >= %(after)s")
+    query = SUM_STEPS_BY_TIMESTEP_QUERY.format(
+        table=connection.ops.quote_name(Activity._meta.db_table),
+        where=" AND ".join(where),
+        **columns)
+    params = {
+        "user_id": u.pk,
+        "before": before,
+        "after": after,
+        "time_zone": TIME_ZONE,
+        "n_interval": TIMESTEP.size - 1,
+        "seconds_in_a_day": SECONDS_IN_A_DAY
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    dates = np.asarray([day for day, _, _ in rows], dtype="datetime64[D]")
+    t_bins = np.asarray([t_bin for _, t_bin, _ in rows], dtype=int)
+    n_steps = np.asarray([n for _, _, n in rows], dtype=int)
+    return dates, t_bins, n_steps
+
+
+def read_cumulative_steps(
+        u: User,
+        before: datetime = None,
+        after: datetime = None
+) -> (np.ndarray, np.ndarray):
+    """Cumulative steps at each timestep of each day with activity before `before`
+    and from `after` (if given), with the date of each day.
+
+    The steps are summed in the database when it can, so that only a few numbers per day are read
+    (otherwise, all the activities are read and the steps are summed here).
+    """
+    if not can_sum_steps_in_database():
+        activity_dt, step_counts = read_activities(u=u, before=before, after=after)
+        return records_to_cumulative_steps(activity_dt=activity_dt, step_counts=step_counts)
+    dates, t_bins, n_steps = sum_steps_by_timestep_in_database(u=u, before=before, after=after)
+    return timestep_increments_to_cumulative_steps(dates=dates, t_bins=t_bins, n_steps=n_steps)
@@ -12,3 +12,7 @@ class BaseAdmin(admin.ModelAdmin):
 class ActionPlanAdmin(BaseAdmin):
     list_display = ("get_user", "date", "value")
 
+
+@admin.register(PseudoCounts)
+class PseudoCountsAdmin(BaseAdmin):
+    list_display = ("get_user", "last_date", "n_days")
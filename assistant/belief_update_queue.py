@@ -0,0 +1,338 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from django.db import close_old_connections
+
+from MAppServer.settings import (
+    BELIEF_UPDATE_BROKER,
+    BELIEF_UPDATE_N_WORKERS,
+    BELIEF_UPDATE_PENDING_TIMEOUT,
+    BELIEF_UPDATE_REDIS_URL
+)
+from user.models import User
+from assistant.tasks import update_beliefs_and_challenges
+from utils import logging
+
+
+LOGGER = logging.get(__name__)
+
+
+def run_belief_update(user_id: int, now: str or None):
+    """Job of the workers: update the beliefs of the user (and the challenges accordingly)"""
+    u = User.objects.get(pk=user_id)
+    update_beliefs_and_challenges(u=u, now=now)
+
+
+class BeliefUpdateMetrics:
+    """Number of jobs, and latency (from the first request to the end of the job) of the last ones.
+
+    It can be used from several threads at the same time.
+    """
+    def __init__(self, n_latency: int = 1000):
+        self.n_enqueued = 0
+        self.n_deduplicated = 0
+        self.n_done = 0
+        self.n_failed = 0
+        self._latencies = deque(maxlen=n_latency)
+        self._run_times = deque(maxlen=n_latency)
+        self._lock = threading.Lock()
+
+    def record_enqueued(self, deduplicated: bool):
+        with self._lock:
+            self.n_enqueued += 1
+            self.n_deduplicated += deduplicated
+
+    def record_done(self, latency: float, run_time: float, failed: bool):
+        with self._lock:
+            self.n_done += 1
+            self.n_failed += failed
+            self._latencies.append(latency)
+            self._run_times.append(run_time)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = np.asarray(self._latencies)
+            run_times = np.asarray(self._run_times)
+            return {
+                "enqueued": self.n_enqueued,
+                "deduplicated": self.n_deduplicated,
+                "done": self.n_done,
+                "failed": self.n_failed,
+                "latency_mean": latencies.mean() if latencies.size else None,
+                "latency_max": latencies.max() if latencies.size else None,
+                "run_time_mean": run_times.mean() if run_times.size else None
+            }
+
+
+class LocalPendingJobs:
+    """Jobs of the users (for the workers of this process): at most one running and one waiting per user.
+
+    A request while the job of the user is waiting only updates its `now`.
+    A request while it is running adds a job, started when it is done
+    (the data of the user may have changed since it has read them).
+    """
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def add(self, user_id: int, now: str or None, enqueued_at: float) -> (bool, bool):
+        """Add a job for the user, or only update `now` if there is already one waiting.
+        Returns whether the job is new, and whether it can start now (no job of the user running)."""
+        with self._lock:
+            job = self._jobs.get(user_id)
+            if job is None:
+                self._jobs[user_id] = {"now": now, "enqueued_at": enqueued_at, "running": False, "next": None}
+                return True, True
+            if not job["running"]:
+                job["now"] = now
+                return False, False
+            if job["next"] is None:
+                job["next"] = {"now": now, "enqueued_at": enqueued_at}
+                return True, False
+            job["next"]["now"] = now
+            return False, False
+
+    def start(self, user_id: int) -> dict or None:
+        """Mark the waiting job of the user as running, and return it"""
+        with self._lock:
+            job = self._jobs.get(user_id)
+            if job is None or job["running"]:
+                return None
+            job["running"] = True
+            return {"now": job["now"], "enqueued_at": job["enqueued_at"]}
+
+    def finish(self, user_id: int) -> bool:
+        """Forget the running job of the user.
+        Returns whether another one has been requested meanwhile (and is now waiting to start)."""
+        with self._lock:
+            job = self._jobs.pop(user_id, None)
+            if job is None or job["next"] is None:
+                return False
+            self._jobs[user_id] = {**job["next"], "running": False, "next": None}
+            return True
+
+    def __len__(self):
+        """Number of jobs waiting"""
+        with self._lock:
+            return sum(not job["running"] or job["next"] is not None for job in self._jobs.values())
+
+
+class RedisPendingJobs:
+    """Same as `LocalPendingJobs`, shared by all the processes (web server and workers) through Redis.
+
+    Each operation is a single Redis script, so that a request cannot be lost
+    between the processes. A job is forgotten BELIEF_UPDATE_PENDING_TIMEOUT after its last change,
+    so that a job lost by a worker does not prevent the next ones.
+    """
+    # Users with a job waiting, by time of the first request (to count them)
+    INDEX_KEY = "belief-update-pending"
+
+    # Add the job if there is none, as the next one if it is running, otherwise only update its `now`
+    ADD_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        redis.call('HSET', KEYS[1], 'now', ARGV[1], 'enqueued_at', ARGV[2], 'running', 0)
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+        redis.call('ZADD', KEYS[2], ARGV[2], ARGV[4])
+        return {1, 1}
+    end
+    if redis.call('HGET', KEYS[1], 'running') == '0' then
+        redis.call('HSET', KEYS[1], 'now', ARGV[1])
+        return {0, 0}
+    end
+    redis.call('HSET', KEYS[1], 'next_now', ARGV[1])
+    local is_new = redis.call('HSETNX', KEYS[1], 'next_enqueued_at', ARGV[2])
+    if is_new == 1 then
+        redis.call('ZADD', KEYS[2], ARGV[2], ARGV[4])
+    end
+    return {is_new, 0}
+    """
+
+    START_SCRIPT = """
+    if redis.call('HGET', KEYS[1], 'running') ~= '0' then
+        return nil
+    end
+    redis.call('HSET', KEYS[1], 'running', 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    redis.call('ZREM', KEYS[2], ARGV[2])
+    return redis.call('HMGET', KEYS[1], 'now', 'enqueued_at')
+    """
+
+    # The next job (if any) becomes the one waiting
+    FINISH_SCRIPT = """
+    local next_job = redis.call('HMGET', KEYS[1], 'next_now', 'next_enqueued_at')
+    if not next_job[2] then
+        redis.call('DEL', KEYS[1])
+        return 0
+    end
+    redis.call('DEL', KEYS[1])
+    redis.call('HSET', KEYS[1], 'now', next_job[1], 'enqueued_at', next_job[2], 'running', 0)
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return 1
+    """
+
+    def __init__(self, url: str = BELIEF_UPDATE_REDIS_URL, timeout: int = BELIEF_UPDATE_PENDING_TIMEOUT):
+        # Redis is only needed with the "celery" broker
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.timeout = timeout
+        self._add = self.redis.register_script(self.ADD_SCRIPT)
+        self._start = self.redis.register_script(self.START_SCRIPT)
+        self._finish = self.redis.register_script(self.FINISH_SCRIPT)
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f"belief-update-pending-{user_id}"
+
+    def add(self, user_id: int, now: str or None, enqueued_at: float) -> (bool, bool):
+        is_new, can_start = self._add(
+            keys=[self.key(user_id), self.INDEX_KEY],
+            args=[json.dumps(now), enqueued_at, self.timeout, user_id])
+        return bool(is_new), bool(can_start)
+
+    def start(self, user_id: int) -> dict or None:
+        job = self._start(keys=[self.key(user_id), self.INDEX_KEY], args=[self.timeout, user_id])
+        if job is None:
+            return None
+        now, enqueued_at = job
+        return {"now": json.loads(now), "enqueued_at": float(enqueued_at)}
+
+    def finish(self, user_id: int) -> bool:
+        return bool(self._finish(keys=[self.key(user_id)], args=[self.timeout]))
+
+    def __len__(self):
+        # The jobs forgotten after the timeout are not waiting anymore
+        with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(self.INDEX_KEY, "-inf", time.time() - self.timeout)
+            pipe.zcard(self.INDEX_KEY)
+            _, n_pending = pipe.execute()
+        return n_pending
+
+
+class LocalBroker:
+    """Runs the jobs in a pool of threads of this process"""
+    def __init__(self, n_workers: int = BELIEF_UPDATE_N_WORKERS):
+        self.n_workers = n_workers
+        self.pending = LocalPendingJobs()
+        self._queue = queue.Queue()
+
+    def start(self, handle):
+        for _ in range(self.n_workers):
+            threading.Thread(target=self._work, args=(handle, ), daemon=True).start()
+
+    def _work(self, handle):
+        while True:
+            user_id = self._queue.get()
+            try:
+                close_old_connections()
+                handle(user_id)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def publish(self, user_id: int):
+        self._queue.put(user_id)
+
+    def queue_depth(self) -> int:
+        return len(self.pending)
+
+    def join(self):
+        """Wait until all the jobs are done"""
+        self._queue.join()
+
+
+class CeleryBroker:
+    """Sends the jobs to the Celery workers (see `MAppServer.celery`)"""
+    def __init__(self):
+        self.pending = RedisPendingJobs()
+
+    def start(self, handle):
+        # The workers call `run_job` of their own queue
+        pass
+
+    def publish(self, user_id: int):
+        # Celery is only needed with this broker
+        from MAppServer.celery import run_belief_update_job
+        run_belief_update_job.delay(user_id)
+
+    def queue_depth(self) -> int:
+        return len(self.pending)
+
+
+class BeliefUpdateQueue:
+    """Updates of the beliefs waiting for a worker, run one at a time for each user.
+
+    A request for a user whose update has not started yet does not add another job:
+    it only updates the `now` of the pending one (the data of the user are read when it starts).
+    A request while the update of the user is running is not lost: it is run once it is done
+    (whether it has succeeded or not), the next requests only updating its `now`.
+    The challenges updated by the job are sent to the user at the next sync.
+    """
+    def __init__(self, broker, update=run_belief_update):
+        self.broker = broker
+        self.update = update
+        self.metrics = BeliefUpdateMetrics()
+        self.broker.start(self.run_job)
+
+    def enqueue(self, user_id: int, now: str = None) -> bool:
+        """Ask for the update of the beliefs of the user. Returns whether a new job has been added."""
+        is_new, can_start = self.broker.pending.add(user_id=user_id, now=now, enqueued_at=time.time())
+        self.metrics.record_enqueued(deduplicated=not is_new)
+        if can_start:
+            self.broker.publish(user_id)
+        return is_new
+
+    def run_job(self, user_id: int):
+        start = time.time()
+        job = self.broker.pending.start(user_id)
+        is_started = job is not None
+        if not is_started:
+            # Forgotten in the meantime: do the update anyway
+            job = {"now": None, "enqueued_at": start}
+        failed = False
+        try:
+            self.update(user_id, job["now"])
+        except Exception:
+            failed = True
+            LOGGER.exception(f"Update of the beliefs of user {user_id} failed")
+        finally:
+            end = time.time()
+            self.metrics.record_done(latency=end - job["enqueued_at"], run_time=end - start, failed=failed)
+            if is_started and self.broker.pending.finish(user_id):
+                # Requested again while it was running
+                self.broker.publish(user_id)
+
+    def stats(self) -> dict:
+        stats = self.metrics.stats()
+        stats["queue_depth"] = self.broker.queue_depth()
+        return stats
+
+
+_QUEUE = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_belief_update_queue() -> BeliefUpdateQueue:
+    """Queue of the process, for the broker of the settings"""
+    global _QUEUE
+    with _QUEUE_LOCK:
+        if _QUEUE is None:
+            if BELIEF_UPDATE_BROKER == "local":
+                broker = LocalBroker()
+            elif BELIEF_UPDATE_BROKER == "celery":
+                broker = CeleryBroker()
+            else:
+                raise ValueError(f"Broker not recognized: '{BELIEF_UPDATE_BROKER}'")
+            _QUEUE = BeliefUpdateQueue(broker=broker)
+        return _QUEUE
+
+
+def request_belief_update(u: User, now: str = None):
+    """Update the beliefs of the user, in the background unless no broker is set"""
+    if BELIEF_UPDATE_BROKER is None:
+        update_beliefs_and_challenges(u=u, now=now)
+    else:
+        get_belief_update_queue().enqueue(user_id=u.pk, now=now)
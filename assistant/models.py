@@ -5,6 +5,31 @@ from django.contrib.postgres.fields import ArrayField
 
 class ActionPlan(models.Model):
 
+    class Meta:
+        # The decision is taken once a day
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'date'],
+                name='only one action plan per day for a single user')
+        ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     date = models.DateField()
     value = ArrayField(models.IntegerField())
+    # Same action plan, packed into words of 64 timesteps (see `core.action_plan_bits`)
+    packed_value = ArrayField(models.BigIntegerField(), null=True, blank=True)
+
+
+class PseudoCounts(models.Model):
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    # Last (completed) day whose transitions have been added to the pseudo-counts
+    last_date = models.DateField(null=True)
+    # Number of days (with activity) whose transitions have been added to the pseudo-counts
+    n_days = models.IntegerField(default=0)
+    # Last activity received when the pseudo-counts were updated
+    # (a later one for a day already added means that the pseudo-counts are out of date)
+    last_activity_id = models.IntegerField(null=True)
+    jitter = models.FloatField()
+    # Pseudo-counts (flattened)
+    value = ArrayField(models.FloatField())
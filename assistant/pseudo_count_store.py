@@ -0,0 +1,156 @@
+import numpy as np
+from datetime import date, timedelta
+from django.db import transaction
+from django.db.models import Count, Max, Q
+
+from MAppServer.settings import ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER
+from assistant.models import User, PseudoCounts
+from assistant.user_snapshot import UserSnapshot, get_midnight
+from assistant.activity_binning import read_cumulative_steps
+from core.activity import (
+    extract_actions,
+    initialize_pseudo_counts,
+    add_to_pseudo_count_matrix
+)
+
+
+def read_completed_days(
+        u: User,
+        today: date,
+        after: date = None
+) -> (np.ndarray, np.ndarray):
+    """Compute the cumulative steps of each day with activity before `today`
+    (and after `after`, if given), with the date of each day."""
+    return read_cumulative_steps(
+        u=u,
+        before=get_midnight(today),
+        after=None if after is None else get_midnight(after + timedelta(days=1))
+    )
+
+
+def get_completed_days(
+        u: User,
+        today: date,
+        after: date = None,
+        snapshot: UserSnapshot = None
+) -> (np.ndarray, np.ndarray):
+    """Same as `read_completed_days`, from the snapshot if it has them"""
+    if snapshot is not None and snapshot.today == today:
+        completed_days = snapshot.get_completed_days(after=after)
+        if completed_days is not None:
+            return completed_days
+    return read_completed_days(u=u, today=today, after=after)
+
+
+def get_actions(u: User, snapshot: UserSnapshot = None) -> np.ndarray:
+    """Actions taken by the assistant, for each date with a challenge"""
+    if snapshot is not None:
+        return np.atleast_2d(snapshot.get_actions())
+    return np.atleast_2d(extract_actions(u=u))
+
+
+def compute_pseudo_counts(
+        u: User,
+        today: date,
+        jitter: float = ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER,
+        snapshot: UserSnapshot = None
+) -> (np.ndarray, int, date or None):
+    """Compute the pseudo-counts from all the days with activity before `today`.
+
+    Returns the pseudo-counts, the number of days and the last of them.
+    """
+    cum_steps, dates = get_completed_days(u=u, today=today, snapshot=snapshot)
+    pseudo_counts = initialize_pseudo_counts(jitter=jitter)
+    actions = get_actions(u=u, snapshot=snapshot)
+    add_to_pseudo_count_matrix(
+        pseudo_counts=pseudo_counts,
+        actions=actions,
+        cum_steps=cum_steps
+    )
+    last_date = dates[-1].item() if len(dates) else None
+    return pseudo_counts, len(dates), last_date
+
+
+def count_late_activities(
+        u: User,
+        today: date,
+        store: PseudoCounts or None
+) -> (int, int or None):
+    """Look (in a single query) for the activities received after the last update of the pseudo-counts
+    for the days already added to them.
+
+    Returns their number, and the last activity received for the days before `today`.
+    """
+    if store is None or store.last_date is None or store.last_activity_id is None:
+        is_late = Q(pk__in=[])
+    else:
+        is_late = Q(dt__lt=get_midnight(store.last_date + timedelta(days=1)), pk__gt=store.last_activity_id)
+    stats = u.activity_set.filter(dt__lt=get_midnight(today)).aggregate(
+        n_late=Count("pk", filter=is_late),
+        last_activity_id=Max("pk"))
+    return stats["n_late"], stats["last_activity_id"]
+
+
+def get_pseudo_counts(
+        u: User,
+        today: date,
+        jitter: float = ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER,
+        snapshot: UserSnapshot = None
+) -> np.ndarray:
+    """Get the pseudo-counts of the user, from all the days with activity before `today`.
+
+    The pseudo-counts are stored, and only the days completed since the last call are added.
+    They are computed from scratch the first time, if the settings have changed,
+    or if some activity has been received for a day already added since then.
+    The activities and the challenges are taken from `snapshot` when it has them.
+    """
+    shape = initialize_pseudo_counts(jitter=jitter).shape
+    with transaction.atomic():
+        store = PseudoCounts.objects.select_for_update().filter(user=u).first()
+        # Activities received later are added (or detected) next time
+        n_late, last_activity_id = count_late_activities(u=u, today=today, store=store)
+        if (store is None or store.jitter != jitter or len(store.value) != np.prod(shape)
+                or store.last_activity_id is None or n_late > 0):
+            pseudo_counts, n_days, last_date = compute_pseudo_counts(u=u, today=today, jitter=jitter, snapshot=snapshot)
+            if store is None:
+                store = PseudoCounts(user=u)
+            store.jitter = jitter
+        else:
+            pseudo_counts = np.asarray(store.value, dtype=float).reshape(shape)
+            n_days, last_date = store.n_days, store.last_date
+            # Add the days completed since the last time
+            cum_steps, dates = get_completed_days(u=u, today=today, after=last_date, snapshot=snapshot)
+            if len(dates) == 0 and last_activity_id == store.last_activity_id:
+                return pseudo_counts
+            actions = get_actions(u=u, snapshot=snapshot)
+            add_to_pseudo_count_matrix(
+                pseudo_counts=pseudo_counts,
+                actions=actions[n_days:],
+                cum_steps=cum_steps
+            )
+            n_days += len(dates)
+            if len(dates):
+                last_date = dates[-1].item()
+        store.n_days = n_days
+        store.last_date = last_date
+        store.last_activity_id = last_activity_id
+        store.value = pseudo_counts.ravel().tolist()
+        store.save()
+    return pseudo_counts
+
+
+def verify_pseudo_counts(
+        u: User,
+        today: date,
+        rebuild: bool = True
+) -> bool:
+    """Check that the stored pseudo-counts are the same as the ones computed from scratch
+    (the activities received late are already taken into account by `get_pseudo_counts`).
+    If they are not (and `rebuild`), replace them."""
+    pseudo_counts = get_pseudo_counts(u=u, today=today)
+    expected, n_days, last_date = compute_pseudo_counts(u=u, today=today)
+    is_valid = np.array_equal(pseudo_counts, expected)
+    if not is_valid and rebuild:
+        PseudoCounts.objects.filter(user=u).delete()
+        get_pseudo_counts(u=u, today=today)
+    return is_valid
@@ -1,29 +1,40 @@
 import numpy as np
 import pandas as pd
-from datetime import datetime, time
+from datetime import datetime
 from pytz import timezone
 import uuid
-from django.db import transaction
-import django.db.models
+from django.db import transaction, IntegrityError
 
 from MAppServer.settings import (
-    TIMESTEP,
-    POSITION,
     HEURISTIC,
-    ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER,
-    SEED_ASSISTANT,
-    INIT_POS_IDX,
+    PLANNER,
+    ACTION_PLAN_SELECTION_BUDGET,
+    ACTION_PLAN_CHUNK_SIZE,
     TIME_ZONE
 )
 from assistant.models import User, ActionPlan
+from user.models import Challenge
 from core.action_plan_selection import select_action_plan
-from core.action_plan_generation import get_possible_action_plans
-from core.activity import (
-    step_events_to_cumulative_steps,
-    extract_actions,
-    extract_step_events,
-    build_pseudo_count_matrix
+from core.action_plan_generation import (
+    get_possible_action_plans,
+    generate_possible_action_plans,
+    get_challenge_strategies,
+    filter_strategies_compatible_with_past
 )
+from core.action_plan_search import (
+    select_action_plan_beam_search,
+    select_action_plan_factorized,
+    select_action_plan_anytime,
+    select_action_plan_branch_and_bound,
+    select_action_plan_streaming
+)
+from core.activity import extract_step_events
+from core.action_plan_bits import pack_action_plans, to_signed
+from core.pseudo_count_model import PseudoCountModel
+from assistant.pseudo_count_store import get_pseudo_counts
+from assistant.user_snapshot import load_user_snapshot, read_activities
+from assistant.activity_binning import read_cumulative_steps
+from assistant.user_lock import lock_belief_update
 from core.timestep_and_datetime import get_datetime_from_timestep, get_timestep_from_datetime
 
 
@@ -35,10 +46,8 @@ def read_activities_and_extract_step_events(
         u: User
 ) -> (list[list], pd.Series):
     """Extract the step events for a given user"""
-    entries = u.activity_set.order_by("dt")
-    dts = np.asarray(entries.values_list("dt", flat=True))
-    dts = pd.to_datetime([_dt.astimezone(timezone(TIME_ZONE)) for _dt in dts])
-    all_pos = np.asarray(entries.values_list("step_midnight", flat=True))
+    activity_dt, all_pos = read_activities(u=u)
+    dts = pd.DatetimeIndex(activity_dt).tz_localize("UTC").tz_convert(TIME_ZONE)
     step_events = extract_step_events(
         step_counts=all_pos,
         datetimes=dts,
@@ -47,37 +56,12 @@ def read_activities_and_extract_step_events(
     return step_events, dts
 
 
-def get_future_challenges(
-        u: User,
-        now: datetime
-) -> django.db.models.query.QuerySet:
-    """Get all future challenges that will happen today"""
-    u_challenges = u.challenge_set
-    today_u_challenges = u_challenges.filter(
-        dt_begin__date=now.date(),
-        dt_offer_begin__gt=now)
-    return today_u_challenges.order_by('dt_earliest')
-
-
-def get_current_position_and_velocity(
-        u: User,
-        now: datetime,
-) -> tuple:
-    """Get the current position and velocity of the user"""
-    # Get the current timestep
-    t_idx = get_timestep_from_datetime(now)
-    # Manage the case where there is no activity/we are at the start of the day
-    if t_idx == 0:
-        return INIT_POS_IDX, t_idx
-    # Get the current position and velocity
-    start_of_day = datetime.combine(now, time.min, tzinfo=now.tzinfo)
-    today_activities = u.activity_set.filter(dt__gt=start_of_day, dt__lt=now)
-    last_act = today_activities.order_by('dt').first()
-    if last_act is None:
-        return 0, t_idx
-    pos = last_act.step_midnight
-    pos_idx = np.argmin(POSITION - pos)
-    return pos_idx, t_idx
+def read_activities_and_extract_cumulative_steps(
+        u: User
+) -> (np.ndarray, np.ndarray):
+    """Compute the cumulative steps of each day with activity for a given user
+    (summed by the database when possible, see `read_cumulative_steps`), with the date of each day"""
+    return read_cumulative_steps(u=u)
 
 
 def update_challenges_based_on_action_plan(action_plan, now, later_challenges):
@@ -89,98 +73,217 @@ def update_challenges_based_on_action_plan(action_plan, now, later_challenges):
         for t in t_selected
     ]
 
+    updated_challenges = []
     for ch, dt in zip(later_challenges, action_plan__datetime):
         challenge_delta = ch.dt_end - ch.dt_begin
         ch.dt_begin = dt
         ch.dt_end = dt + challenge_delta
         ch.server_tag = generate_uuid()
-        ch.save()
+        updated_challenges.append(ch)
+    Challenge.objects.bulk_update(updated_challenges, ["dt_begin", "dt_end", "server_tag"])
+
+
+def select_action_plan_with_enumeration(
+        u: User,
+        now: datetime,
+        pseudo_counts: PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        challenges: list,
+        action_taken: np.ndarray
+) -> np.ndarray or None:
+    """Select the (future) action plan by evaluating all the possible action plans"""
+    # Get the possible action plans
+    action_plans_including_past, action_plans = get_possible_action_plans(
+        challenges=challenges,
+        u=u,
+        now=now,
+        action_taken=action_taken
+    )
+    if len(action_plans) == 0:
+        return None
+    if HEURISTIC is not None:
+        # Use the heuristic (for debug)
+        print("Using heuristic")
+        return action_plans_including_past[HEURISTIC, t_idx:]
+    if PLANNER == "branch_and_bound":
+        # Select the action plan without evaluating the ones that cannot be the best
+        action_plan_idx, pragmatic_value, epistemic_value, stats = select_action_plan_branch_and_bound(
+            pseudo_counts=pseudo_counts,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans
+        )
+    elif ACTION_PLAN_SELECTION_BUDGET is not None:
+        # Select the best action plan that can be found within the time budget
+        action_plan_idx, pragmatic_value, epistemic_value, coverage = select_action_plan_anytime(
+            pseudo_counts=pseudo_counts,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans
+        )
+        if coverage < 1:
+            print(f"Only {coverage*100:.1f}% of the action plans evaluated within the time budget")
+    else:
+        # Select the action plan using active inference
+        action_plan_idx, pragmatic_value, epistemic_value = select_action_plan(
+            pseudo_counts=pseudo_counts,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans
+        )
+    # Get the action plan based on the index
+    return action_plans[action_plan_idx]
+
+
+def select_action_plan_without_enumeration(
+        u: User,
+        now: datetime,
+        pseudo_counts: PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        challenges: list,
+        action_taken: np.ndarray
+) -> np.ndarray or None:
+    """Select the (future) action plan from the strategies of each challenge,
+    without enumerating all their combinations"""
+    strategies, related_timesteps, last_challenge_t_idx = get_challenge_strategies(
+        challenges=challenges,
+        t_idx=t_idx
+    )
+    strategies = filter_strategies_compatible_with_past(
+        strategies=strategies,
+        related_timesteps=related_timesteps,
+        action_taken=action_taken,
+        last_challenge_t_idx=last_challenge_t_idx
+    )
+    if strategies is None:
+        return None
+    if PLANNER == "factorized":
+        select = select_action_plan_factorized
+    else:
+        select = select_action_plan_beam_search
+    action_plan, pragmatic_value, epistemic_value = select(
+        pseudo_counts=pseudo_counts,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        strategies=strategies,
+        related_timesteps=related_timesteps
+    )
+    return action_plan
+
+
+def select_action_plan_with_streaming(
+        u: User,
+        now: datetime,
+        pseudo_counts: PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        challenges: list,
+        action_taken: np.ndarray
+) -> np.ndarray or None:
+    """Select the (future) action plan by generating and evaluating the possible action plans
+    chunk by chunk, without keeping all of them in memory"""
+    action_plan_chunks = generate_possible_action_plans(
+        challenges=challenges,
+        now=now,
+        u=u,
+        chunk_size=ACTION_PLAN_CHUNK_SIZE,
+        action_taken=action_taken
+    )
+    action_plan, pragmatic_value, epistemic_value = select_action_plan_streaming(
+        pseudo_counts=pseudo_counts,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        action_plan_chunks=(future_action_plans for _, future_action_plans in action_plan_chunks)
+    )
+    return action_plan
 
 
 def update_beliefs_and_challenges(
         u: User,
         now: str = None
 ):
-    """Update the beliefs concerning the user and update the challenges accordingly."""
+    """Update the beliefs concerning the user and update the challenges accordingly.
+
+    Only one update runs at a time for a given user: if one is already running, this one waits for it.
+    It then only reads the user's data, unless the running one has not taken the decision of the day
+    (e.g. it has failed, or there was no later challenge yet).
+    """
     if now is None:
         now = datetime.now(tz=timezone(TIME_ZONE))
     else:
         now = timezone(TIME_ZONE).localize(datetime.strptime(now, "%d/%m/%Y %H:%M:%S"))
 
+    with lock_belief_update(u):
+        take_daily_decision(u=u, now=now)
+
+
+def take_daily_decision(
+        u: User,
+        now: datetime
+):
+    """Select the action plan of the day (if not done yet) and update the challenges accordingly"""
+    # Read everything needed from the database at once
+    snapshot = load_user_snapshot(u=u, now=now)
+
     # Look if a decision has already been taken for that day
-    ap = u.actionplan_set.filter(date=now.date()).first()
-    if ap is not None:
+    if snapshot.has_action_plan:
         # print("Decision already taken")
         return
 
     # Get later challenges
-    later_challenges = get_future_challenges(u, now)
-    first_challenge = later_challenges.first()
-    if first_challenge is None:
+    later_challenges = snapshot.get_later_challenges()
+    if len(later_challenges) == 0:
         return
 
-    # Get the step events
-    step_events, dts = read_activities_and_extract_step_events(u=u)
-
-    # Transform the step events into cumulative steps
-    if len(step_events) > 0:
-        # Get the minimum date
-        min_date = dts.min().date()
-        day_idx_now = (now.date() - min_date).days
-        # TODO: It will probably be suitable to discard the first day to avoid
-        #      to bias the inferences
-        cum_steps = step_events_to_cumulative_steps(step_events=step_events)
-        n_days_act = cum_steps.shape[0]
-        if day_idx_now < n_days_act:
-            cum_steps = cum_steps[:day_idx_now]  # Exclude today
-    else:
-        cum_steps = np.empty((0, TIMESTEP.size))
-
-    pos_idx, t_idx = get_current_position_and_velocity(
+    pos_idx, t_idx = snapshot.get_current_position_and_timestep()
+    # Get the pseudo-counts from the days before today
+    # (only the days completed since the last update are read)
+    # TODO: It will probably be suitable to discard the first day to avoid
+    #      to bias the inferences
+    pseudo_counts = get_pseudo_counts(
         u=u,
-        now=now
-    )
-    actions = extract_actions(
-        u=u
-    )
-    actions = np.atleast_2d(actions)
-    pseudo_counts = build_pseudo_count_matrix(
-        cum_steps=cum_steps,
-        actions=actions,
-        jitter=ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER
+        today=now.date(),
+        snapshot=snapshot
     )
-    # Get the challenges for today
-    today_challenges = u.challenge_set.filter(dt_begin__date=now.date())
-    # Get the possible action plans
-    action_plans_including_past, action_plans = get_possible_action_plans(
-        challenges=today_challenges,
+    # Compute the transitions and the epistemic weights once for all the evaluations
+    pseudo_count_model = PseudoCountModel(pseudo_counts)
+    # Select the action plan
+    if HEURISTIC is None and PLANNER in ("beam_search", "factorized"):
+        select = select_action_plan_without_enumeration
+    elif HEURISTIC is None and PLANNER == "streaming":
+        select = select_action_plan_with_streaming
+    else:
+        select = select_action_plan_with_enumeration
+    action_plan = select(
         u=u,
-        now=now
+        now=now,
+        pseudo_counts=pseudo_count_model,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        challenges=snapshot.get_today_challenges(),
+        action_taken=snapshot.get_action_taken()
     )
     # TODO: Do extra tests to be sure that the action plans are correct
-    if len(action_plans) == 0:
+    if action_plan is None:
         print("No possible action plans")
         return
-    # Select the action plan
-    if HEURISTIC is None:
-        # Select the action plan using active inference
-        action_plan_idx, pragmatic_value, epistemic_value = select_action_plan(
-            pseudo_counts=pseudo_counts,
-            pos_idx=pos_idx,
-            t_idx=t_idx,
-            action_plans=action_plans
-        )
-        # Get the action plan based on the index
-        action_plan = action_plans[action_plan_idx]
-    else:
-        # Use the heuristic (for debug)
-        print("Using heuristic")
-        action_plan = action_plans_including_past[HEURISTIC, t_idx:]
-    # Update the challenges based on the action plan
-    update_challenges_based_on_action_plan(
-        action_plan=action_plan,
-        now=now,
-        later_challenges=later_challenges
-    )
-    with transaction.atomic():
-        ActionPlan.objects.create(user=u, date=now.date(), value=list(action_plan))
+    # Record the decision and update the challenges in one go: if another decision
+    # has been recorded for that day in the meantime, it is the one to keep
+    try:
+        with transaction.atomic():
+            ActionPlan.objects.create(
+                user=u,
+                date=now.date(),
+                value=list(action_plan),
+                packed_value=to_signed(pack_action_plans(action_plan)).tolist()
+            )
+            update_challenges_based_on_action_plan(
+                action_plan=action_plan,
+                now=now,
+                later_challenges=later_challenges
+            )
+    except IntegrityError:
+        # print("Decision already taken")
+        return
@@ -0,0 +1,54 @@
+import threading
+import zlib
+from contextlib import contextmanager
+from django.db import connection
+
+from assistant.models import User
+
+
+# First key of the advisory locks of PostgreSQL taken here (the second one being the user)
+LOCK_NAMESPACE = zlib.crc32(b"belief-update") & 0x7fffffff
+
+# Without PostgreSQL, the updates are only serialized within the process
+_LOCAL_LOCKS = {}
+_LOCAL_LOCKS_LOCK = threading.Lock()
+
+
+@contextmanager
+def lock_belief_update(u: User, blocking: bool = True):
+    """Take the lock of the updates of the beliefs of the user, waiting for it unless not `blocking`.
+    Yields whether it has been taken (in which case it is released at the end).
+
+    On PostgreSQL, it is an advisory lock, which holds for all the processes
+    (and is released if the connection is lost).
+    """
+    if connection.vendor != "postgresql":
+        with lock_belief_update_in_process(user_id=u.pk, blocking=blocking) as is_locked:
+            yield is_locked
+        return
+    with connection.cursor() as cursor:
+        if blocking:
+            cursor.execute("SELECT pg_advisory_lock(%s, %s)", [LOCK_NAMESPACE, u.pk])
+            is_locked = True
+        else:
+            cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [LOCK_NAMESPACE, u.pk])
+            is_locked = cursor.fetchone()[0]
+    try:
+        yield is_locked
+    finally:
+        if is_locked:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [LOCK_NAMESPACE, u.pk])
+
+
+@contextmanager
+def lock_belief_update_in_process(user_id: int, blocking: bool = True):
+    """Same as `lock_belief_update`, for the threads of this process only"""
+    with _LOCAL_LOCKS_LOCK:
+        lock = _LOCAL_LOCKS.setdefault(user_id, threading.Lock())
+    is_locked = lock.acquire(blocking=blocking)
+    try:
+        yield is_locked
+    finally:
+        if is_locked:
+            lock.release()
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+import pytz
+from datetime import date, datetime, time, timedelta
+from pytz import timezone
+from django.db.models import Exists, OuterRef
+
+from MAppServer.settings import (
+    TIMESTEP,
+    POSITION,
+    INIT_POS_IDX,
+    TIME_ZONE
+)
+from assistant.models import User, ActionPlan
+from core.activity import extract_cumulative_steps, get_actions_from_challenge_begins
+from core.timestep_and_datetime import (
+    get_timestep_from_datetime,
+    datetimes_to_epochs,
+    get_local_dates_from_epochs
+)
+
+
+def get_midnight(d: date) -> datetime:
+    """Start of the (local) day"""
+    return timezone(TIME_ZONE).localize(datetime.combine(d, time.min))
+
+
+def to_datetime64(dts: list) -> np.ndarray:
+    """(Timezone aware) datetimes, as datetime64[us] in UTC"""
+    return np.asarray([dt.astimezone(pytz.UTC).replace(tzinfo=None) for dt in dts], dtype="datetime64[us]")
+
+
+def read_activities(
+        u: User,
+        before: datetime = None,
+        after: datetime = None
+) -> (np.ndarray, np.ndarray):
+    """Datetimes (see `to_datetime64`) and step counts of the activities before `before`
+    and from `after` (if given), ordered by datetime, in a single query"""
+    entries = u.activity_set.all()
+    if before is not None:
+        entries = entries.filter(dt__lt=before)
+    if after is not None:
+        entries = entries.filter(dt__gte=after)
+    rows = list(entries.order_by("dt", "id").values_list("dt", "step_midnight"))
+    activity_dt = to_datetime64([dt for dt, _ in rows])
+    step_counts = np.asarray([n_steps for _, n_steps in rows], dtype=int)
+    return activity_dt, step_counts
+
+
+def records_to_cumulative_steps(
+        activity_dt: np.ndarray,
+        step_counts: np.ndarray
+) -> (np.ndarray, np.ndarray):
+    """Cumulative steps at each timestep of each day with activity, with the date of each day"""
+    if len(step_counts) == 0:
+        return np.empty((0, TIMESTEP.size+1), dtype=int), np.empty(0, dtype="datetime64[D]")
+    datetimes = pd.DatetimeIndex(activity_dt).tz_localize("UTC").tz_convert(TIME_ZONE)
+    return extract_cumulative_steps(
+        step_counts=step_counts,
+        datetimes=datetimes,
+        return_dates=True
+    )
+
+
+def extract_completed_days(
+        activity_dt: np.ndarray,
+        step_counts: np.ndarray,
+        today: date,
+        after: date = None
+) -> (np.ndarray, np.ndarray):
+    """Compute the cumulative steps of each day with activity before `today`
+    (and after `after`, if given), with the date of each day."""
+    keep = activity_dt < to_datetime64([get_midnight(today)])[0]
+    if after is not None:
+        keep &= activity_dt >= to_datetime64([get_midnight(after + timedelta(days=1))])[0]
+    return records_to_cumulative_steps(activity_dt=activity_dt[keep], step_counts=step_counts[keep])
+
+
+class UserSnapshot:
+    """Everything the update of the beliefs of a user needs from the database, at `now`:
+
+    - whether an action plan has already been chosen for today,
+    - the activities before `now` (only from the day after `activity_after`, if given:
+      the days before are already in the stored pseudo-counts),
+    - all the challenges of the user.
+    """
+    def __init__(
+            self,
+            now: datetime,
+            has_action_plan: bool,
+            activity_after: date or None,
+            activity_dt: np.ndarray,
+            step_counts: np.ndarray,
+            challenges: list
+    ):
+        self.now = now
+        self.today = now.date()
+        self.has_action_plan = has_action_plan
+        self.activity_after = activity_after
+        self.activity_dt = activity_dt
+        self.step_counts = step_counts
+        self.challenges = challenges
+        # (Local) date of the beginning of each challenge
+        self.challenge_dates = get_local_dates_from_epochs(
+            datetimes_to_epochs([ch.dt_begin for ch in challenges]))
+
+    def get_today_challenges(self) -> list:
+        return [ch for ch, d in zip(self.challenges, self.challenge_dates) if d == self.today]
+
+    def get_later_challenges(self) -> list:
+        """Challenges of today that have not been offered yet, in the order of their window"""
+        later_challenges = [ch for ch in self.get_today_challenges() if ch.dt_offer_begin > self.now]
+        return sorted(later_challenges, key=lambda ch: ch.dt_earliest)
+
+    def get_actions(self) -> np.ndarray:
+        """Actions taken by the assistant, for each date with a challenge"""
+        return get_actions_from_challenge_begins([ch.dt_begin for ch in self.challenges])
+
+    def get_action_taken(self) -> np.ndarray:
+        """Actions taken by the assistant today"""
+        return get_actions_from_challenge_begins([ch.dt_begin for ch in self.get_today_challenges()])
+
+    def get_completed_days(self, after: date = None) -> (np.ndarray, np.ndarray) or None:
+        """Cumulative steps of the days before today (and after `after`, if given),
+        or None if they have not been loaded"""
+        if self.activity_after is not None and (after is None or after < self.activity_after):
+            return None
+        return extract_completed_days(
+            activity_dt=self.activity_dt,
+            step_counts=self.step_counts,
+            today=self.today,
+            after=after
+        )
+
+    def get_current_position_and_timestep(self) -> tuple:
+        """Get the current position and timestep of the user"""
+        t_idx = get_timestep_from_datetime(self.now)
+        # Manage the case where there is no activity/we are at the start of the day
+        if t_idx == 0:
+            return INIT_POS_IDX, t_idx
+        start_of_day = datetime.combine(self.now, time.min, tzinfo=self.now.tzinfo)
+        is_today = self.activity_dt > to_datetime64([start_of_day])[0]
+        if not np.any(is_today):
+            return 0, t_idx
+        pos = self.step_counts[np.argmax(is_today)]
+        pos_idx = np.argmin(POSITION - pos)
+        return pos_idx, t_idx
+
+
+def load_user_snapshot(
+        u: User,
+        now: datetime
+) -> UserSnapshot:
+    """Load everything the update of the beliefs of the user needs, in three queries"""
+    # Whether an action plan has already been chosen, and the last day in the pseudo-counts
+    has_action_plan, activity_after = User.objects.filter(pk=u.pk).annotate(
+        has_action_plan=Exists(ActionPlan.objects.filter(user=OuterRef("pk"), date=now.date()))
+    ).values_list("has_action_plan", "pseudocounts__last_date").get()
+    after = None
+    if activity_after is not None:
+        after = get_midnight(activity_after + timedelta(days=1))
+    activity_dt, step_counts = read_activities(u=u, before=now, after=after)
+    return UserSnapshot(
+        now=now,
+        has_action_plan=has_action_plan,
+        activity_after=activity_after,
+        activity_dt=activity_dt,
+        step_counts=step_counts,
+        challenges=list(u.challenge_set.all())
+    )
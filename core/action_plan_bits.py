@@ -0,0 +1,69 @@
+import numpy as np
+
+WORD_SIZE = 64
+
+
+def pack_action_plans(action_plans: np.ndarray) -> np.ndarray:
+    """Pack each action plan into uint64 words (one bit per timestep, the first timestep
+    being the least significant bit of the first word).
+
+    Returns an array of shape (n_action_plan, n_word), or (n_word,) for a single action plan.
+    """
+    action_plans = np.asarray(action_plans)
+    is_single = action_plans.ndim == 1
+    action_plans = np.atleast_2d(action_plans)
+    n_action_plan, h = action_plans.shape
+    n_word = max(1, -(-h // WORD_SIZE))
+    bits = np.zeros((n_action_plan, n_word * WORD_SIZE), dtype=np.uint8)
+    bits[:, :h] = action_plans != 0
+    packed = np.packbits(bits, axis=1, bitorder="little").view("<u8")
+    return packed[0] if is_single else packed
+
+
+def unpack_action_plans(packed: np.ndarray, h: int) -> np.ndarray:
+    """Get back the action plans (as used by the selection) from their packed form"""
+    packed = np.asarray(packed, dtype="<u8")
+    is_single = packed.ndim == 1
+    packed = np.ascontiguousarray(np.atleast_2d(packed))
+    bits = np.unpackbits(packed.view(np.uint8), axis=1, count=h, bitorder="little")
+    action_plans = bits.astype(int)
+    return action_plans[0] if is_single else action_plans
+
+
+def make_prefix_mask(length: int, n_word: int) -> np.ndarray:
+    """Words with the bits of the first `length` timesteps set"""
+    return pack_action_plans(np.arange(n_word * WORD_SIZE) < length)
+
+
+def is_compatible_with_past(
+        packed: np.ndarray,
+        packed_action_taken: np.ndarray,
+        last_challenge_t_idx: int
+) -> np.ndarray:
+    """Whether each (packed) action plan starts with the actions taken until `last_challenge_t_idx`"""
+    mask = make_prefix_mask(length=last_challenge_t_idx, n_word=packed.shape[-1])
+    return ~np.any((packed ^ packed_action_taken) & mask, axis=-1)
+
+
+def take_future(packed: np.ndarray, t_idx: int) -> np.ndarray:
+    """Drop the first `t_idx` timesteps of each (packed) action plan"""
+    n_word = packed.shape[-1]
+    word_shift, bit_shift = divmod(t_idx, WORD_SIZE)
+    # Shift by whole words first
+    shifted = np.zeros_like(packed)
+    shifted[..., :n_word-word_shift] = packed[..., word_shift:]
+    if bit_shift == 0:
+        return shifted
+    # Then by the remaining bits, carrying the low bits of the next word
+    future = shifted >> np.uint64(bit_shift)
+    future[..., :-1] |= shifted[..., 1:] << np.uint64(WORD_SIZE - bit_shift)
+    return future
+
+
+def to_signed(packed: np.ndarray) -> np.ndarray:
+    """Same bits, as int64 (e.g. to be stored in a `BigIntegerField`)"""
+    return np.asarray(packed, dtype="<u8").view("<i8")
+
+
+def from_signed(packed: np.ndarray) -> np.ndarray:
+    return np.asarray(packed, dtype="<i8").view("<u8")
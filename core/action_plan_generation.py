@@ -1,20 +1,25 @@
 import numpy as np
 from datetime import datetime, timedelta
 from pytz import timezone
-import itertools
-from itertools import product
 
 from user.models import User
 from core.activity import extract_actions
+from core.action_plan_library import get_action_plan_library, build_action_plans
 from MAppServer.settings import (
     TIME_ZONE,
     TIMESTEP,
     OFFER_WINDOW,
     CHALLENGE_WINDOW,
     N_CHALLENGES_PER_DAY,
-    DISCARD_OVERLAPPING_STRATEGIES
+    DISCARD_OVERLAPPING_STRATEGIES,
+    ACTION_PLAN_CHUNK_SIZE
+)
+from core.timestep_and_datetime import (
+    get_timestep_from_datetime,
+    get_timesteps_from_epochs,
+    datetimes_to_epochs,
+    challenge_duration_to_n_timesteps
 )
-from core.timestep_and_datetime import get_timestep_from_datetime, challenge_duration_to_n_timesteps
 
 
 def get_challenges(
@@ -44,99 +49,171 @@ def get_challenges(
     return challenges
 
 
-def generate_possibilities_for_single_challenge():
-    """Generate all the possibilities for a single challenge."""
+def generate_possibilities_for_single_challenge(
+        challenge_window: int = CHALLENGE_WINDOW,
+        ch_dur: int = None,
+        discard_overlapping_strategies: bool = DISCARD_OVERLAPPING_STRATEGIES
+) -> np.ndarray:
+    """Generate all the possibilities for a single challenge.
+
+    A possibility is a single block of `ch_dur` ones in the window,
+    from the latest start to the earliest one.
+    Without the overlapping ones, the blocks tile the window from its start.
+    """
     # Duration in timesteps of a single challenge
-    ch_dur = challenge_duration_to_n_timesteps()
-    # Generate all possible combinations of 1's and 0's of length n
-    all_combinations = list(product([0, 1], repeat=CHALLENGE_WINDOW))
-    # Filter out combinations that don't have 'g' groups of 'k' ones
-    valid_combinations = []
-    for combination in all_combinations:
-        # Convert combination to string
-        str_comb = ''.join(map(str, combination))
-        # Split string by '0'
-        groups = str_comb.split('0')
-        # Count groups of 'ch_dur' ones
-        count = sum(1 for group in groups if group == '1'*ch_dur)
-        if count != 1:
-            continue
-        count_2 = sum(1 for group in groups if '1' in group)
-        if count_2 != 1:
-            continue
-        valid_combinations.append(combination)
-
-    # Convert valid combinations to numpy array
-    action_plans = np.array(valid_combinations, dtype=int)
-
-    # Discard overlapping strategies if asked for it
-    if DISCARD_OVERLAPPING_STRATEGIES:
-        action_plans = action_plans[::-1]
-        valid_action_plans = np.atleast_2d(action_plans[0])
-        for i in range(1, action_plans.shape[0]):
-            stacked = np.atleast_2d(np.vstack((valid_action_plans, np.atleast_2d(action_plans[i]))))
-            _sum_columns = np.sum(stacked, axis=0)
-            if np.any(_sum_columns > 1):
-                continue
-            else:
-                valid_action_plans = stacked
-        action_plans = valid_action_plans
+    if ch_dur is None:
+        ch_dur = challenge_duration_to_n_timesteps()
+    # Timesteps at which the block can start
+    if discard_overlapping_strategies:
+        starts = np.arange(0, challenge_window - ch_dur + 1, ch_dur)
+    else:
+        starts = np.arange(challenge_window - ch_dur, -1, -1)
+    # Put the block at each start
+    action_plans = np.zeros((starts.size, challenge_window), dtype=int)
+    action_plans[np.arange(starts.size)[:, np.newaxis], starts[:, np.newaxis] + np.arange(ch_dur)] = 1
     return action_plans
 
 
-def get_possible_action_plans(
+def get_challenge_strategies(
         challenges: list,
-        now: datetime = None,
-        u: User = None
-) -> np.ndarray or tuple:
-
-    h = TIMESTEP.size
+        t_idx: int = None
+) -> (list, list, int):
+    """Get the timesteps of the window of each challenge that can still be planned,
+    and the possible strategies for it.
 
+    Also returns the timestep index up to which the past cannot be changed.
+    """
     strategies = []
     related_timesteps = []
-
-    t_idx = None
-    last_challenge_t_idx = None
-    action_taken = None
-    if u is not None:
-        t_idx = get_timestep_from_datetime(now)
-        action_taken = extract_actions(u=u, now=now)
-        last_challenge_t_idx = 0  # Every future will be compatible
-
-    for ch in challenges:
-        ch_earliest_t_idx = get_timestep_from_datetime(ch.dt_earliest)
-        ch_latest_t_idx = get_timestep_from_datetime(ch.dt_latest)
-        ch_offer_t_idx = get_timestep_from_datetime(ch.dt_offer_begin)
-        if now is not None and ch_offer_t_idx <= t_idx:
+    last_challenge_t_idx = 0  # Every future will be compatible
+    # The strategies are the same for every challenge
+    strategies_for_single = generate_possibilities_for_single_challenge()
+    strategies_for_single.setflags(write=False)
+    # Timesteps of the window and of the offer of each challenge
+    all_t_idx = get_timesteps_from_epochs(datetimes_to_epochs(
+        [dt for ch in challenges for dt in (ch.dt_earliest, ch.dt_latest, ch.dt_offer_begin)]))
+    for ch_earliest_t_idx, ch_latest_t_idx, ch_offer_t_idx in all_t_idx.reshape(-1, 3).tolist():
+        if t_idx is not None and ch_offer_t_idx <= t_idx:
             last_challenge_t_idx = ch_latest_t_idx
             continue
         window_duration_in_ts = ch_latest_t_idx - ch_earliest_t_idx
         timesteps = np.arange(ch_earliest_t_idx, ch_latest_t_idx)
         challenge_duration_in_ts = challenge_duration_to_n_timesteps()
         assert challenge_duration_in_ts % window_duration_in_ts, "Nope"
-        strategies_for_single = generate_possibilities_for_single_challenge()
         strategies.append(strategies_for_single)
         related_timesteps.append(timesteps)
+    return strategies, related_timesteps, last_challenge_t_idx
+
+
+def filter_strategies_compatible_with_past(
+        strategies: list,
+        related_timesteps: list,
+        action_taken: np.ndarray,
+        last_challenge_t_idx: int
+) -> list or None:
+    """Keep only the strategies that are compatible with the actions already taken.
+
+    Returns None if no action plan can be compatible with the past.
+    """
+    is_past = np.zeros(TIMESTEP.size, dtype=bool)
+    is_past[:last_challenge_t_idx] = True
+    # Outside the challenge windows, the action plans do nothing
+    outside_windows = is_past.copy()
+    for timesteps in related_timesteps:
+        outside_windows[timesteps] = False
+    if np.any(action_taken[outside_windows] != 0):
+        return None
+    compatible_strategies = []
+    for strategies_for_single, timesteps in zip(strategies, related_timesteps):
+        is_past_ts = is_past[timesteps]
+        mask = np.all(
+            strategies_for_single[:, is_past_ts] == action_taken[timesteps[is_past_ts]],
+            axis=1)
+        if not np.any(mask):
+            return None
+        compatible_strategies.append(strategies_for_single[mask])
+    return compatible_strategies
 
-    action_plans = []
-    for challenge_parts in itertools.product(*strategies):
-        action_plan = np.zeros(h, dtype=int)
-        for i, challenge_part in enumerate(challenge_parts):
-            action_plan[related_timesteps[i]] = challenge_part
 
-        action_plans.append(action_plan)
-    action_plans = np.asarray(action_plans, dtype=int)
+def get_possible_action_plans(
+        challenges: list,
+        now: datetime = None,
+        u: User = None,
+        action_taken: np.ndarray = None
+) -> np.ndarray or tuple:
+
+    """Get all the possible action plans for the challenges.
+
+    If `now` is given, only the ones compatible with the actions already taken by the user
+    (read from the database if `action_taken` is not given), together with their future part.
+    The action plans come from a library shared by the whole process: they cannot be modified.
+    """
+    t_idx = None
+    if u is not None or action_taken is not None:
+        t_idx = get_timestep_from_datetime(now)
+        if action_taken is None:
+            action_taken = extract_actions(u=u, now=now)
+
+    strategies, related_timesteps, last_challenge_t_idx = get_challenge_strategies(
+        challenges=challenges,
+        t_idx=t_idx
+    )
+
+    library = get_action_plan_library(
+        strategies=strategies,
+        related_timesteps=related_timesteps
+    )
 
     if now is None:
-        return action_plans
+        return library.action_plans
     else:
         # Changing the past is not a possibility
         # Select only the action plans which are compatible with the past
-        mask = np.all(
-            action_plans[:, :last_challenge_t_idx]
-            == action_taken[:last_challenge_t_idx],
-            axis=1)
-        action_plans = action_plans[mask]
+        rows = library.get_rows_compatible_with_past(
+            action_taken=action_taken,
+            last_challenge_t_idx=last_challenge_t_idx
+        )
+        action_plans = library.action_plans[rows]
         # Take only the future
-        future_action_plans = action_plans[:, t_idx:]
+        future_action_plans = library.get_future_action_plans(rows=rows, t_idx=t_idx)
         return action_plans, future_action_plans
+
+
+def generate_possible_action_plans(
+        challenges: list,
+        now: datetime,
+        u: User,
+        chunk_size: int = ACTION_PLAN_CHUNK_SIZE,
+        action_taken: np.ndarray = None
+):
+    """Generate the action plans compatible with the actions already taken by the user
+    (read from the database if `action_taken` is not given),
+    chunk by chunk (in the same order as `get_possible_action_plans`).
+
+    The strategies that contradict the past are discarded before combining them,
+    so that the incompatible action plans are never built.
+    Yields the action plans of each chunk, together with their future part.
+    """
+    t_idx = get_timestep_from_datetime(now)
+    strategies, related_timesteps, last_challenge_t_idx = get_challenge_strategies(
+        challenges=challenges,
+        t_idx=t_idx
+    )
+    if action_taken is None:
+        action_taken = extract_actions(u=u, now=now)
+    strategies = filter_strategies_compatible_with_past(
+        strategies=strategies,
+        related_timesteps=related_timesteps,
+        action_taken=action_taken,
+        last_challenge_t_idx=last_challenge_t_idx
+    )
+    if strategies is None:
+        return
+    n_action_plan = int(np.prod([len(strategies_for_single) for strategies_for_single in strategies]))
+    for start in range(0, n_action_plan, chunk_size):
+        action_plans = build_action_plans(
+            strategies=strategies,
+            related_timesteps=related_timesteps,
+            rows=np.arange(start, min(start + chunk_size, n_action_plan))
+        )
+        yield action_plans, action_plans[:, t_idx:]
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from MAppServer.settings import TIMESTEP, ACTION_PLAN_LIBRARY_DIR
+from core.action_plan_bits import pack_action_plans, unpack_action_plans, make_prefix_mask, take_future
+from core.decision_cache import hash_array
+
+
+class ActionPlanLibrary:
+    """All the action plans for a set of challenges (one row per combination of strategies,
+    in the order of `itertools.product`), also kept in their packed form (see `core.action_plan_bits`),
+    with an index of the rows by their (packed) first actions, from which their future is taken.
+
+    The arrays are read-only, so that the library can be shared by all the users of the process
+    (and the action plans by all the processes, when they are memory-mapped from the disk).
+    """
+    def __init__(self, action_plans: np.ndarray):
+        self.action_plans = action_plans
+        self.action_plans.setflags(write=False)
+        self.packed = pack_action_plans(self.action_plans)
+        self.packed.setflags(write=False)
+        # For each length of prefix, the rows of the action plans for each (packed) prefix
+        self._rows_by_prefix = {}
+        self._lock = threading.Lock()
+
+    @property
+    def h(self):
+        return self.action_plans.shape[1]
+
+    def _get_rows_by_prefix(self, length: int) -> dict:
+        with self._lock:
+            rows_by_prefix = self._rows_by_prefix.get(length)
+            if rows_by_prefix is None:
+                prefixes, inverse, counts = np.unique(
+                    self.packed & make_prefix_mask(length=length, n_word=self.packed.shape[1]),
+                    axis=0, return_inverse=True, return_counts=True)
+                # Group the rows by prefix, keeping them in order
+                rows = np.split(np.argsort(inverse.ravel(), kind="stable"), np.cumsum(counts)[:-1])
+                rows_by_prefix = {}
+                for prefix, rows_for_prefix in zip(prefixes, rows):
+                    rows_for_prefix.setflags(write=False)
+                    rows_by_prefix[prefix.tobytes()] = rows_for_prefix
+                self._rows_by_prefix[length] = rows_by_prefix
+            return rows_by_prefix
+
+    def get_rows_compatible_with_past(self, action_taken: np.ndarray, last_challenge_t_idx: int) -> np.ndarray:
+        """Rows of the action plans that start with the actions taken until `last_challenge_t_idx`"""
+        rows_by_prefix = self._get_rows_by_prefix(length=last_challenge_t_idx)
+        prefix = np.zeros(self.packed.shape[1], dtype=self.packed.dtype)
+        packed_action_taken = pack_action_plans(np.asarray(action_taken)[:last_challenge_t_idx])
+        prefix[:packed_action_taken.size] = packed_action_taken
+        return rows_by_prefix.get(prefix.tobytes(), np.zeros(0, dtype=int))
+
+    def get_future_action_plans(self, rows: np.ndarray, t_idx: int) -> np.ndarray:
+        """Action plans of the given rows, without their first `t_idx` timesteps"""
+        future = take_future(self.packed[rows], t_idx=t_idx)
+        return unpack_action_plans(future, h=self.h - t_idx)
+
+
+def build_all_action_plans(strategies: list, related_timesteps: list, h: int = TIMESTEP.size) -> np.ndarray:
+    """Build the action plans for every combination of strategies (in the order of `itertools.product`)"""
+    n_action_plan = int(np.prod([len(strategies_for_single) for strategies_for_single in strategies]))
+    return build_action_plans(
+        strategies=strategies,
+        related_timesteps=related_timesteps,
+        rows=np.arange(n_action_plan),
+        h=h)
+
+
+def build_action_plans(strategies: list, related_timesteps: list, rows: np.ndarray, h: int = TIMESTEP.size) -> np.ndarray:
+    """Build only the given rows of the action plans for every combination of strategies"""
+    n_strategy = [len(strategies_for_single) for strategies_for_single in strategies]
+    # Index of the strategy of each challenge, for each combination
+    if len(strategies):
+        choices = np.unravel_index(rows, n_strategy)
+    else:
+        choices = ()
+    action_plans = np.zeros((rows.size, h), dtype=int)
+    for choice, strategies_for_single, timesteps in zip(choices, strategies, related_timesteps):
+        action_plans[:, timesteps] = strategies_for_single[choice]
+    return action_plans
+
+
+def load_or_build_all_action_plans(
+        strategies: list,
+        related_timesteps: list,
+        h: int,
+        digest: str,
+        library_dir: str or None = ACTION_PLAN_LIBRARY_DIR
+) -> np.ndarray:
+    """Memory-map the action plans saved for this configuration (read-only),
+    building and saving them first if they have not been saved yet.
+
+    The configuration is identified by `digest`, which is part of the file name.
+    """
+    if library_dir is None:
+        return build_all_action_plans(strategies=strategies, related_timesteps=related_timesteps, h=h)
+    path = os.path.join(library_dir, f"action_plans_{digest}.npy")
+    if not os.path.exists(path):
+        action_plans = build_all_action_plans(strategies=strategies, related_timesteps=related_timesteps, h=h)
+        os.makedirs(library_dir, exist_ok=True)
+        # Write to a temporary file first, so that other processes never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=library_dir, suffix=".npy.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, action_plans)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return np.load(path, mmap_mode="r")
+
+
+_LIBRARIES = {}
+_LIBRARIES_LOCK = threading.Lock()
+
+
+def get_action_plan_library(
+        strategies: list,
+        related_timesteps: list,
+        h: int = TIMESTEP.size,
+        library_dir: str or None = ACTION_PLAN_LIBRARY_DIR
+) -> ActionPlanLibrary:
+    """Get the library of the action plans for this configuration, building it the first time
+    (or loading it from `library_dir`, if another process has already built it)"""
+    key = (h,) + tuple(
+        (tuple(int(t) for t in timesteps), hash_array(strategies_for_single))
+        for strategies_for_single, timesteps in zip(strategies, related_timesteps))
+    with _LIBRARIES_LOCK:
+        library = _LIBRARIES.get(key)
+        if library is None:
+            digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+            action_plans = load_or_build_all_action_plans(
+                strategies=strategies,
+                related_timesteps=related_timesteps,
+                h=h,
+                digest=digest,
+                library_dir=library_dir)
+            library = ActionPlanLibrary(action_plans=action_plans)
+            _LIBRARIES[key] = library
+        return library
@@ -0,0 +1,394 @@
+import time
+import numpy as np
+
+from MAppServer.settings import (
+    TIMESTEP,
+    POSITION,
+    LOG_PRIOR,
+    SEED_ASSISTANT,
+    GAMMA,
+    BEAM_SEARCH_WIDTH,
+    ACTION_PLAN_SELECTION_BUDGET
+)
+from core.action_plan_selection import (
+    propagate_beliefs,
+    evaluate_action_plans_trie,
+    compute_expected_free_energy,
+    choose_best_action_plan,
+    select_action_plan
+)
+from core.action_plan_trie import build_action_plan_trie
+from core.decision_cache import DECISION_CACHE, DecisionCache
+from core.pseudo_count_model import PseudoCountModel, as_pseudo_count_model
+
+
+class Rollout:
+    """Beliefs and values of a set of partial action plans, rolled out step by step."""
+    def __init__(self, pseudo_counts: np.ndarray or PseudoCountModel, pos_idx: int, t_idx: int):
+        model = as_pseudo_count_model(pseudo_counts)
+        self.qt = model.qt
+        self.w = model.w
+        self.t_idx = t_idx
+        # We know where we start
+        self.qp = np.zeros((1, POSITION.size))
+        self.qp[:, pos_idx] = 1.
+        self.pragmatic = np.zeros(1)
+        self.epistemic = np.zeros(1)
+        # Index of the strategy chosen for each challenge
+        self.choices = np.zeros((1, 0), dtype=int)
+
+    @property
+    def size(self):
+        return self.qp.shape[0]
+
+    def advance(self, actions: np.ndarray):
+        """Make as many steps as there are columns in `actions` (one row per partial action plan)"""
+        for h_idx in range(actions.shape[1]):
+            rollout_t_index = self.t_idx + h_idx
+            self.qp, v_model = propagate_beliefs(
+                qp=self.qp,
+                actions=actions[:, h_idx],
+                qt=self.qt[:, rollout_t_index],
+                w=self.w[:, rollout_t_index])
+            self.epistemic += v_model
+            self.pragmatic += self.qp @ LOG_PRIOR
+        self.t_idx += actions.shape[1]
+
+    def wait_until(self, t_idx: int):
+        """Do nothing until `t_idx`"""
+        self.advance(np.zeros((self.size, t_idx - self.t_idx), dtype=int))
+
+    def branch(self, strategies: np.ndarray):
+        """Extend every partial action plan with every strategy"""
+        n_strategy = strategies.shape[0]
+        n_partial = self.size
+        self.qp = np.repeat(self.qp, n_strategy, axis=0)
+        self.pragmatic = np.repeat(self.pragmatic, n_strategy)
+        self.epistemic = np.repeat(self.epistemic, n_strategy)
+        self.choices = np.hstack((
+            np.repeat(self.choices, n_strategy, axis=0),
+            np.tile(np.arange(n_strategy), n_partial)[:, np.newaxis]))
+        self.advance(np.tile(strategies, (n_partial, 1)))
+
+    def keep(self, idx: np.ndarray):
+        self.qp = self.qp[idx]
+        self.pragmatic = self.pragmatic[idx]
+        self.epistemic = self.epistemic[idx]
+        self.choices = self.choices[idx]
+
+
+def build_action_plan(
+        choices: np.ndarray,
+        strategies: list,
+        related_timesteps: list,
+        t_idx: int
+) -> np.ndarray:
+    """Build the (future) action plan corresponding to the strategy chosen for each challenge"""
+    action_plan = np.zeros(TIMESTEP.size, dtype=int)
+    for choice, strategies_for_single, timesteps in zip(choices, strategies, related_timesteps):
+        action_plan[timesteps] = strategies_for_single[choice]
+    return action_plan[t_idx:]
+
+
+def select_action_plan_beam_search(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        strategies: list,
+        related_timesteps: list,
+        beam_width: int = BEAM_SEARCH_WIDTH
+) -> (np.ndarray, float, float):
+    """Select an action plan with a beam search over the combinations of strategies,
+    without enumerating all of them.
+
+    The partial action plans are rolled out together, and at the start of each challenge window
+    only the `beam_width` best ones (given their value so far) are kept.
+    The cost is then linear in the number of challenges.
+
+    The selection is approximate: the epistemic value of the steps after a window depends
+    on the belief reached there, so that a partial action plan discarded at a window can lead
+    to the best action plan. It is exact for a single challenge, or when `beam_width` is at least
+    the number of combinations of strategies of all the challenges but the last one
+    (nothing is then discarded).
+
+    Returns the selected (future) action plan, with its pragmatic and epistemic values.
+    """
+    # Go through the challenges in chronological order
+    order = np.argsort([timesteps[0] for timesteps in related_timesteps], kind="stable")
+    strategies = [strategies[i] for i in order]
+    related_timesteps = [related_timesteps[i] for i in order]
+    assert all(timesteps[0] >= t_idx for timesteps in related_timesteps), \
+        "Challenges that have already started cannot be planned"
+    rollout = Rollout(pseudo_counts=pseudo_counts, pos_idx=pos_idx, t_idx=t_idx)
+    for strategies_for_single, timesteps in zip(strategies, related_timesteps):
+        rollout.wait_until(timesteps[0])
+        # Keep only the best partial action plans,
+        # in the order in which they would have been enumerated
+        if rollout.size > beam_width:
+            efe = compute_expected_free_energy(
+                pragmatic=rollout.pragmatic,
+                epistemic=rollout.epistemic)
+            best = np.argsort(-efe, kind="stable")[:beam_width]
+            rollout.keep(np.sort(best))
+        rollout.branch(strategies_for_single)
+    rollout.wait_until(TIMESTEP.size)
+    efe = compute_expected_free_energy(
+        pragmatic=rollout.pragmatic,
+        epistemic=rollout.epistemic)
+    best_idx = choose_best_action_plan(efe=efe)
+    action_plan = build_action_plan(
+        choices=rollout.choices[best_idx],
+        strategies=strategies,
+        related_timesteps=related_timesteps,
+        t_idx=t_idx)
+    return action_plan, rollout.pragmatic[best_idx], rollout.epistemic[best_idx]
+
+
+def select_action_plan_factorized(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        strategies: list,
+        related_timesteps: list
+) -> (np.ndarray, float, float):
+    """Select an action plan greedily, one challenge at a time.
+
+    The strategies of each challenge are scored given the belief that arrives
+    at its window (i.e. after the strategies chosen for the previous challenges),
+    until the start of the next window, and the best one is kept for good.
+    The cost is then proportional to the sum of the number of strategies of each challenge,
+    and not to their product.
+    This is the beam search with a beam of a single partial action plan: the selection
+    is approximate as soon as there are several challenges, as a strategy that is the best
+    until the next window does not always lead to the best action plan.
+
+    Returns the selected (future) action plan, with its pragmatic and epistemic values.
+    """
+    return select_action_plan_beam_search(
+        pseudo_counts=pseudo_counts,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        strategies=strategies,
+        related_timesteps=related_timesteps,
+        beam_width=1
+    )
+
+
+def select_action_plan_anytime(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        action_plans: np.ndarray,
+        budget: float = ACTION_PLAN_SELECTION_BUDGET,
+        chunk_size: int = 256
+) -> (int, np.ndarray, np.ndarray, float):
+    """Select the best action plan found within a time budget (in seconds).
+
+    The action plans are evaluated chunk by chunk, in a random order so that
+    the evaluated ones are a uniform sample of all of them. At least one chunk
+    is always evaluated. If every action plan is evaluated in time,
+    the selection is the same as the one of `select_action_plan` (with order-independent values).
+
+    Returns the index of the selected action plan, the pragmatic and epistemic values
+    (nan for the action plans that have not been evaluated),
+    and the fraction of the action plans that have been evaluated.
+    """
+    start = time.perf_counter()
+    n_action_plan = action_plans.shape[0]
+    model = as_pseudo_count_model(pseudo_counts)
+    key = DecisionCache.make_key(
+        model=model,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        action_plans=action_plans)
+    cached = DECISION_CACHE.get(key)
+    if cached is not None:
+        pragmatic, epistemic = cached
+        efe = compute_expected_free_energy(pragmatic=pragmatic, epistemic=epistemic)
+        return choose_best_action_plan(efe=efe), pragmatic, epistemic, 1.0
+    pragmatic = np.full(n_action_plan, np.nan)
+    epistemic = np.full(n_action_plan, np.nan)
+    rng = np.random.default_rng(SEED_ASSISTANT)
+    order = rng.permutation(n_action_plan)
+    n_evaluated = 0
+    while n_evaluated < n_action_plan:
+        idx = order[n_evaluated:n_evaluated+chunk_size]
+        pragmatic[idx], epistemic[idx] = evaluate_action_plans_trie(
+            pseudo_counts=model,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans[idx])
+        n_evaluated += idx.size
+        if budget is not None and time.perf_counter() - start > budget:
+            break
+    if n_evaluated == n_action_plan:
+        DECISION_CACHE.put(key, (pragmatic, epistemic))
+    # Choose among the evaluated action plans (in their original order)
+    evaluated = np.sort(order[:n_evaluated])
+    efe = compute_expected_free_energy(pragmatic=pragmatic[evaluated], epistemic=epistemic[evaluated])
+    best_action_plan_index = evaluated[choose_best_action_plan(efe=efe)]
+    return best_action_plan_index, pragmatic, epistemic, n_evaluated / n_action_plan
+
+
+def find_nodes(nodes: np.ndarray, sorted_nodes: np.ndarray) -> (np.ndarray, np.ndarray):
+    """For each node, whether it is in `sorted_nodes` and, if so, its position there"""
+    position = np.searchsorted(sorted_nodes, nodes)
+    position = np.minimum(position, sorted_nodes.size - 1)
+    found = sorted_nodes[position] == nodes
+    return found, position
+
+
+def select_action_plan_branch_and_bound(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        action_plans: np.ndarray,
+        n_probe: int = 16
+) -> (int, np.ndarray, np.ndarray, dict):
+    """Select the best action plan, without evaluating the action plans that cannot be the best one.
+
+    The prefix tree of the action plans is explored level by level.
+    The value of the remaining steps is bounded using the log-prior and the extreme
+    epistemic weights of each row of the transition, and the nodes that cannot reach
+    the tolerance of `np.isclose` around the best value are discarded,
+    so that the selection is the same as the one of `select_action_plan` (with order-independent values).
+
+    Returns the index of the selected action plan, the pragmatic and epistemic values
+    (nan for the action plans that have been discarded), and some statistics about the search.
+    """
+    n_action_plan, h = action_plans.shape
+    # Get the normalized transitions and the epistemic weights
+    model = as_pseudo_count_model(pseudo_counts)
+    qt, w = model.qt, model.w
+    trie = build_action_plan_trie(action_plans=action_plans, n_action=model.n_action)
+    # Bounds of the value of the remaining steps, for each position, if we could choose
+    # the best (or worst) action at each step and for each position independently.
+    # The value of the remaining steps of an action plan is linear in the belief,
+    # so that the bound for a node is the expectation of these bounds under its belief.
+    remaining_upper_bound = np.zeros((h+1, POSITION.size))
+    remaining_lower_bound = np.zeros((h+1, POSITION.size))
+    for h_idx in reversed(range(h)):
+        rollout_t_index = t_idx + h_idx
+        actions = np.unique(trie.actions[h_idx])
+        _qt = qt[actions, rollout_t_index]
+        _w = w[actions, rollout_t_index]
+        # The epistemic value of a step is between the min and the max of the weights of the row
+        w_max = _w.max(axis=-1)
+        w_min = _w.min(axis=-1)
+        if GAMMA >= 0:
+            epistemic_upper_bound, epistemic_lower_bound = GAMMA * w_max, GAMMA * w_min
+        else:
+            epistemic_upper_bound, epistemic_lower_bound = GAMMA * w_min, GAMMA * w_max
+        remaining_upper_bound[h_idx] = np.max(
+            epistemic_upper_bound + _qt @ (LOG_PRIOR + remaining_upper_bound[h_idx+1]),
+            axis=0)
+        remaining_lower_bound[h_idx] = np.min(
+            epistemic_lower_bound + _qt @ (LOG_PRIOR + remaining_lower_bound[h_idx+1]),
+            axis=0)
+    # Get a first idea of the best value with a few action plans
+    rng = np.random.default_rng(SEED_ASSISTANT)
+    probe = rng.choice(n_action_plan, size=min(n_probe, n_action_plan), replace=False)
+    pragmatic_probe, epistemic_probe = evaluate_action_plans_trie(
+        pseudo_counts=model,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        action_plans=action_plans[probe])
+    best_value = np.max(GAMMA * epistemic_probe + pragmatic_probe)
+    # We know where we start
+    alive = np.zeros(1, dtype=int)
+    qp = np.zeros((1, POSITION.size))
+    qp[:, pos_idx] = 1.
+    pragmatic = np.zeros(1)
+    epistemic = np.zeros(1)
+    n_visited = 0
+    for h_idx in range(trie.depth):
+        # Expand the nodes that have not been discarded
+        is_child, parent_position = find_nodes(nodes=trie.parents[h_idx], sorted_nodes=alive)
+        nodes = np.flatnonzero(is_child)
+        parent_position = parent_position[nodes]
+        qp, v_model = propagate_beliefs(
+            qp=qp[parent_position],
+            actions=trie.actions[h_idx][nodes],
+            qt=qt[:, t_idx + h_idx],
+            w=w[:, t_idx + h_idx])
+        epistemic = epistemic[parent_position] + v_model
+        pragmatic = pragmatic[parent_position] + qp @ LOG_PRIOR
+        n_visited += nodes.size
+        # At least one action plan below each node reaches the lower bound
+        value = GAMMA * epistemic + pragmatic
+        best_value = max(best_value, np.max(value + qp @ remaining_lower_bound[h_idx+1]))
+        # Discard the nodes that cannot be close to the best value
+        # (`np.isclose` tolerance, which increases slower than the best value)
+        upper_bound = value + qp @ remaining_upper_bound[h_idx+1]
+        keep = ~(upper_bound < best_value - (1e-08 + 1e-05 * np.abs(best_value)))
+        alive = nodes[keep]
+        qp = qp[keep]
+        pragmatic = pragmatic[keep]
+        epistemic = epistemic[keep]
+    # Get the values of the action plans that have not been discarded
+    is_evaluated, leaf_position = find_nodes(nodes=trie.leaves, sorted_nodes=alive)
+    pragmatic_value = np.full(n_action_plan, np.nan)
+    epistemic_value = np.full(n_action_plan, np.nan)
+    pragmatic_value[is_evaluated] = pragmatic[leaf_position[is_evaluated]]
+    epistemic_value[is_evaluated] = epistemic[leaf_position[is_evaluated]]
+    if np.isnan(pragmatic_value[is_evaluated]).any() or np.isnan(epistemic_value[is_evaluated]).any():
+        # Bounds are meaningless, evaluate everything
+        best_action_plan_index, pragmatic_value, epistemic_value = select_action_plan(
+            pseudo_counts=model,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans,
+            order_independent=True)
+        n_visited = trie.n_nodes
+    else:
+        efe = np.full(n_action_plan, -np.inf)
+        efe[is_evaluated] = compute_expected_free_energy(
+            pragmatic=pragmatic_value[is_evaluated],
+            epistemic=epistemic_value[is_evaluated])
+        best_action_plan_index = choose_best_action_plan(efe=efe)
+    stats = {
+        "n_nodes": trie.n_nodes,
+        "n_visited": n_visited,
+        "n_pruned": trie.n_nodes - n_visited
+    }
+    return best_action_plan_index, pragmatic_value, epistemic_value, stats
+
+
+def select_action_plan_streaming(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        action_plan_chunks
+) -> (np.ndarray or None, float, float):
+    """Select the best action plan among action plans given chunk by chunk
+    (e.g. by `generate_possible_action_plans`).
+
+    After each chunk, only the action plans close enough to the best value so far are kept
+    (the ones that are not cannot get close to the final best value, which can only be higher),
+    so that the memory does not depend on the number of action plans.
+    The selection is the same as the one of `select_action_plan` on all the action plans
+    (with order-independent values).
+
+    Returns the selected action plan, with its pragmatic and epistemic values
+    (None if there is no action plan).
+    """
+    model = as_pseudo_count_model(pseudo_counts)
+    candidates = None
+    for action_plans in action_plan_chunks:
+        pragmatic, epistemic = evaluate_action_plans_trie(
+            pseudo_counts=model,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans)
+        efe = compute_expected_free_energy(pragmatic=pragmatic, epistemic=epistemic)
+        chunk = (action_plans, efe, pragmatic, epistemic)
+        if candidates is not None:
+            chunk = tuple(np.concatenate((c, x)) for c, x in zip(candidates, chunk))
+        # Keep only the action plans that can still be selected
+        keep = np.isclose(chunk[1], chunk[1].max())
+        candidates = tuple(x[keep] for x in chunk)
+    if candidates is None:
+        return None, np.nan, np.nan
+    action_plans, efe, pragmatic, epistemic = candidates
+    best_idx = choose_best_action_plan(efe=efe)
+    return action_plans[best_idx], pragmatic[best_idx], epistemic[best_idx]
@@ -7,9 +7,13 @@ from MAppServer.settings import (
     POSITION,
     LOG_PRIOR,
     GAMMA,
-    SEED_ASSISTANT
+    SEED_ASSISTANT,
+    ORDER_INDEPENDENT_EPISTEMIC_VALUE
 )
 from core.activity import initialize_pseudo_counts
+from core.action_plan_trie import build_action_plan_trie
+from core.decision_cache import DECISION_CACHE, DecisionCache
+from core.pseudo_count_model import PseudoCountModel, as_pseudo_count_model
 
 
 def normalize_last_dim(alpha):
@@ -44,70 +48,191 @@ def compute_number_of_observations(pseudo_counts):
     return int(np.sum(pseudo_counts)
                - initialize_pseudo_counts(ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER).sum())
 
-from MAppServer.settings import TIMESTEP
-def select_action_plan(
-        pseudo_counts: np.ndarray,
+def propagate_beliefs(
+        qp: np.ndarray,
+        actions: np.ndarray,
+        qt: np.ndarray,
+        w: np.ndarray,
+        w_visited: np.ndarray = None
+) -> (np.ndarray, np.ndarray):
+    """Make one step forward for a batch of beliefs.
+
+    `qt` and `w` are the transition beliefs and epistemic weights
+    for the current timestep, for each action.
+    If `w_visited` is given, only the first belief of each action uses `w`,
+    the next ones using `w_visited` (as in the original evaluation, see `ORDER_INDEPENDENT_EPISTEMIC_VALUE`).
+    Returns the new beliefs and the epistemic value of the step.
+    """
+    new_qp = np.empty_like(qp)
+    v_model = np.zeros(qp.shape[0])
+    for a in range(qt.shape[0]):
+        is_a = np.flatnonzero(actions == a)
+        if is_a.size == 0:
+            continue
+        previous_qp = qp[is_a]
+        _qp = previous_qp @ qt[a]
+        if w_visited is None:
+            v_model[is_a] = np.sum((previous_qp @ w[a]) * _qp, axis=1)
+        else:
+            v_model[is_a] = np.sum((previous_qp @ w_visited[a]) * _qp, axis=1)
+            v_model[is_a[0]] = (previous_qp[0] @ w[a]) @ _qp[0]
+        new_qp[is_a] = _qp
+    return new_qp, v_model
+
+
+def evaluate_action_plans(
+        pseudo_counts: np.ndarray or PseudoCountModel,
         pos_idx: int,
         t_idx: int,
-        action_plans: np.ndarray
-):
-    """Select the best action to take"""
-    # Set the seed
-    # TODO: Check if this is the correct way to set the seed
-    # log_str = ""
-    rng = np.random.default_rng(SEED_ASSISTANT)
-    if LOG_ASSISTANT_MODEL:
-        n_obs = compute_number_of_observations(pseudo_counts)
-        # rng state {rng.bit_generator.state['state']['state']}"
-        print(f"Assistant: t_idx={t_idx:02} pos_idx={pos_idx:02} n obs {n_obs:02}")
-        # if n_obs == 24:  # 144
-        #     print("action plans")
-        #     print(action_plans)
-        #     print("peseudo counts")
-        #     for action in range(2):
-        #         for ts in range(TIMESTEP.size):
-        #             for pos in range(POSITION.size):
-        #                 print("action", action, "ts", ts, "pos", pos, pseudo_counts[action, ts, pos])
+        action_plans: np.ndarray,
+        order_independent: bool = ORDER_INDEPENDENT_EPISTEMIC_VALUE
+) -> (np.ndarray, np.ndarray):
+    """Compute the pragmatic and epistemic values of all the action plans at once.
+
+    Beliefs are propagated for all the action plans together, as a
+    (n_action_plan, POSITION.size) matrix at each step of the horizon.
+    Unless `order_independent`, the values are the ones of the original loop over the action plans,
+    where the epistemic weights of the transitions never observed depend on the action plans
+    evaluated before (see `ORDER_INDEPENDENT_EPISTEMIC_VALUE`).
+    """
     # Get the dimensions of the action plans
     n_action_plan, h = action_plans.shape
     # Initialize action plan values
     pragmatic = np.zeros(n_action_plan)
     epistemic = np.zeros(n_action_plan)
-    # Initialize belief about the velocity transition
-    alpha_t = pseudo_counts.copy()
-    # Normalize the last dimension
-    qt = normalize_last_dim(alpha_t)
-    # Compute value of each action plan
-    for ap_index, ap in enumerate(action_plans):
-        # For history of beliefs
-        qps = np.zeros((h, POSITION.size))
-        # We know where we start
-        qp = np.zeros(POSITION.size)
-        qp[pos_idx] = 1.
-        for h_idx in range(h):
-            previous_qp = qp.copy()
-            a = ap[h_idx]
-            rollout_t_index = t_idx + h_idx
-            _qt = qt[a, rollout_t_index]
-            _alpha = alpha_t[a, rollout_t_index]
-            _sums = np.sum(_alpha, axis=-1, keepdims=True)
-            qp = qp @ _qt
-            # Handle specific case where the pseudo count is 0
-            make_sense = _alpha > 0
-            _alpha[_alpha == 0] = 1
-            w = 1/(2*_alpha) - 1/(2*_sums)
-            w *= make_sense.astype(float)
-            v_model = (previous_qp@w)@qp
-            epistemic[ap_index] += v_model
-            # record the values
-            qps[h_idx] = qp
-        pragmatic[ap_index] = np.sum(qps @ LOG_PRIOR)
-    # Choose the best action plan
+    # Get the normalized transitions and the epistemic weights
+    model = as_pseudo_count_model(pseudo_counts)
+    qt, w = model.qt, model.w
+    w_visited = None if order_independent else model.w_visited
+    # We know where we start
+    qp = np.zeros((n_action_plan, POSITION.size))
+    qp[:, pos_idx] = 1.
+    for h_idx in range(h):
+        qp, v_model = propagate_beliefs(
+            qp=qp,
+            actions=action_plans[:, h_idx],
+            qt=qt[:, t_idx + h_idx],
+            w=w[:, t_idx + h_idx],
+            w_visited=None if w_visited is None else w_visited[:, t_idx + h_idx])
+        epistemic += v_model
+        pragmatic += qp @ LOG_PRIOR
+    return pragmatic, epistemic
+
+
+def evaluate_action_plans_trie(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        action_plans: np.ndarray
+) -> (np.ndarray, np.ndarray):
+    """Compute the pragmatic and epistemic values of all the action plans at once.
+
+    Beliefs and values are computed once per distinct prefix of the action plans,
+    so that the cost is proportional to the number of nodes of the prefix tree.
+    The values are the order-independent ones (see `ORDER_INDEPENDENT_EPISTEMIC_VALUE`).
+    """
+    # Get the normalized transitions and the epistemic weights
+    model = as_pseudo_count_model(pseudo_counts)
+    qt, w = model.qt, model.w
+    trie = build_action_plan_trie(action_plans=action_plans, n_action=model.n_action)
+    # We know where we start
+    qp = np.zeros((1, POSITION.size))
+    qp[:, pos_idx] = 1.
+    pragmatic = np.zeros(1)
+    epistemic = np.zeros(1)
+    for h_idx in range(trie.depth):
+        parents = trie.parents[h_idx]
+        qp, v_model = propagate_beliefs(
+            qp=qp[parents],
+            actions=trie.actions[h_idx],
+            qt=qt[:, t_idx + h_idx],
+            w=w[:, t_idx + h_idx])
+        epistemic = epistemic[parents] + v_model
+        pragmatic = pragmatic[parents] + qp @ LOG_PRIOR
+    return pragmatic[trie.leaves], epistemic[trie.leaves]
+
+
+def evaluate_action_plans_all_positions(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        t_idx: int,
+        action_plans: np.ndarray
+) -> (np.ndarray, np.ndarray):
+    """Compute the pragmatic and epistemic values of all the action plans,
+    for every starting position at once.
+
+    The initial belief is the identity matrix (one row per starting position).
+    Returns two (POSITION.size, n_action_plan) arrays.
+    """
+    n_position = POSITION.size
+    # Get the normalized transitions and the epistemic weights
+    model = as_pseudo_count_model(pseudo_counts)
+    qt, w = model.qt, model.w
+    trie = build_action_plan_trie(action_plans=action_plans, n_action=model.n_action)
+    # One belief per (node, starting position)
+    qp = np.eye(n_position)[np.newaxis]
+    pragmatic = np.zeros((1, n_position))
+    epistemic = np.zeros((1, n_position))
+    for h_idx in range(trie.depth):
+        parents = trie.parents[h_idx]
+        n_node = parents.size
+        _qp, v_model = propagate_beliefs(
+            qp=qp[parents].reshape(n_node * n_position, n_position),
+            actions=np.repeat(trie.actions[h_idx], n_position),
+            qt=qt[:, t_idx + h_idx],
+            w=w[:, t_idx + h_idx])
+        qp = _qp.reshape(n_node, n_position, n_position)
+        epistemic = epistemic[parents] + v_model.reshape(n_node, n_position)
+        pragmatic = pragmatic[parents] + qp @ LOG_PRIOR
+    return pragmatic[trie.leaves].T, epistemic[trie.leaves].T
+
+
+def compute_policy_table(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        t_idx: int,
+        action_plans: np.ndarray
+) -> np.ndarray:
+    """Compute the (POSITION.size, n_action_plan) table of the value of each action plan,
+    for every starting position."""
+    pragmatic, epistemic = evaluate_action_plans_all_positions(
+        pseudo_counts=pseudo_counts,
+        t_idx=t_idx,
+        action_plans=action_plans
+    )
+    return np.vstack([
+        compute_expected_free_energy(pragmatic=pr, epistemic=ep)
+        for pr, ep in zip(pragmatic, epistemic)
+    ])
+
+
+def select_action_plan_from_policy_table(
+        policy_table: np.ndarray,
+        pos_idx: int
+) -> int:
+    """Select the best action plan for the current position, using a pre-computed policy table"""
+    return choose_best_action_plan(efe=policy_table[pos_idx])
+
+
+def choose_best_action_plan(efe: np.ndarray) -> int:
+    """Pick (at random) one of the action plans with the maximum expected free energy"""
+    # Set the seed
+    # TODO: Check if this is the correct way to set the seed
+    rng = np.random.default_rng(SEED_ASSISTANT)
+    close_to_max_efe = np.isclose(efe, efe.max())
+    idx_close_to_max = np.where(close_to_max_efe)[0]
+    return rng.choice(idx_close_to_max)
+
+
+def compute_expected_free_energy(
+        pragmatic: np.ndarray,
+        epistemic: np.ndarray,
+        gamma: float = GAMMA
+) -> np.ndarray:
+    """Combine the pragmatic and epistemic values"""
     # If all values are nan, return a random action plan
     if np.isnan(pragmatic).all() and np.isnan(epistemic).all():
         if LOG_WARNING_NAN:
             print("All values are nan")
-        efe = np.ones(n_action_plan)
+        efe = np.ones(pragmatic.size)
     # If one of the values is nan, return the other
     elif np.isnan(pragmatic).all():
         if LOG_WARNING_NAN:
@@ -119,11 +244,103 @@ def select_action_plan(
         efe = pragmatic
     # Otherwise, compute the Expected Free Energy
     else:
-        efe = GAMMA * epistemic + pragmatic
-    close_to_max_efe = np.isclose(efe, efe.max())
-    idx_close_to_max = np.where(close_to_max_efe)[0]
-    best_action_plan_index = rng.choice(idx_close_to_max)
+        efe = gamma * epistemic + pragmatic
+    return efe
+
+
+def get_action_plan_values(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        action_plans: np.ndarray,
+        order_independent: bool = ORDER_INDEPENDENT_EPISTEMIC_VALUE
+) -> (np.ndarray, np.ndarray):
+    """Get the pragmatic and epistemic values of each action plan"""
+    model = as_pseudo_count_model(pseudo_counts)
+    if LOG_ASSISTANT_MODEL:
+        n_obs = compute_number_of_observations(model.pseudo_counts)
+        print(f"Assistant: t_idx={t_idx:02} pos_idx={pos_idx:02} n obs {n_obs:02}")
+    if order_independent:
+        # The action plans that share a prefix share its value
+        def compute():
+            return evaluate_action_plans_trie(
+                pseudo_counts=model,
+                pos_idx=pos_idx,
+                t_idx=t_idx,
+                action_plans=action_plans)
+    else:
+        def compute():
+            return evaluate_action_plans(
+                pseudo_counts=model,
+                pos_idx=pos_idx,
+                t_idx=t_idx,
+                action_plans=action_plans,
+                order_independent=False)
+    # Compute value of each action plan (or re-use it if it has already been computed)
+    return DECISION_CACHE.get_or_compute(
+        key=DecisionCache.make_key(
+            model=model,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans,
+            order_independent=order_independent),
+        compute=compute
+    )
+
+
+def select_action_plan(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        action_plans: np.ndarray,
+        order_independent: bool = ORDER_INDEPENDENT_EPISTEMIC_VALUE
+):
+    """Select the best action to take"""
+    pragmatic, epistemic = get_action_plan_values(
+        pseudo_counts=pseudo_counts,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        action_plans=action_plans,
+        order_independent=order_independent
+    )
+    # Choose the best action plan
+    efe = compute_expected_free_energy(pragmatic=pragmatic, epistemic=epistemic)
+    best_action_plan_index = choose_best_action_plan(efe=efe)
     if LOG_ASSISTANT_MODEL:
         print("Selected action plan", best_action_plan_index)
+        print("Decision cache", DECISION_CACHE.stats())
         print("-"*80)
     return best_action_plan_index, pragmatic, epistemic
+
+
+def select_action_plan_for_each_gamma(
+        pseudo_counts: np.ndarray or PseudoCountModel,
+        pos_idx: int,
+        t_idx: int,
+        action_plans: np.ndarray,
+        gammas: np.ndarray,
+        order_independent: bool = ORDER_INDEPENDENT_EPISTEMIC_VALUE
+) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Select the best action plan for each value of gamma.
+
+    Gamma only weights the epistemic value in the expected free energy,
+    so that the action plans are evaluated once, and only re-ranked for each value.
+    The selection for each value is the same as the one of `select_action_plan`
+    with `GAMMA` set to this value.
+    """
+    pragmatic, epistemic = get_action_plan_values(
+        pseudo_counts=pseudo_counts,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        action_plans=action_plans,
+        order_independent=order_independent
+    )
+    best_action_plan_indexes = np.zeros(len(gammas), dtype=int)
+    for i, gamma in enumerate(gammas):
+        efe = compute_expected_free_energy(pragmatic=pragmatic, epistemic=epistemic, gamma=gamma)
+        best_action_plan_indexes[i] = choose_best_action_plan(efe=efe)
+    if LOG_ASSISTANT_MODEL:
+        print("Selected action plans", best_action_plan_indexes)
+        print("Decision cache", DECISION_CACHE.stats())
+        print("-"*80)
+    return best_action_plan_indexes, pragmatic, epistemic
@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class ActionPlanTrie:
+    """Prefix tree of a set of action plans.
+
+    Level `k` contains one node per distinct prefix of length `k+1`.
+    For each node, we keep the index of its parent in the previous level
+    (the root being the only node of level -1) and the action leading to it.
+    """
+    def __init__(self, parents: list, actions: list, leaves: np.ndarray):
+        self.parents = parents
+        self.actions = actions
+        self.leaves = leaves
+
+    @property
+    def depth(self):
+        return len(self.parents)
+
+    @property
+    def n_nodes(self):
+        return sum(p.size for p in self.parents)
+
+
+def build_action_plan_trie(
+        action_plans: np.ndarray,
+        n_action: int = 2
+) -> ActionPlanTrie:
+    """Build the prefix tree of the action plans."""
+    n_action_plan, h = action_plans.shape
+    parents = []
+    actions = []
+    # All the action plans start at the root
+    node_of_action_plan = np.zeros(n_action_plan, dtype=int)
+    for h_idx in range(h):
+        key = node_of_action_plan * n_action + action_plans[:, h_idx]
+        uniq_key, node_of_action_plan = np.unique(key, return_inverse=True)
+        parents.append(uniq_key // n_action)
+        actions.append(uniq_key % n_action)
+    return ActionPlanTrie(parents=parents, actions=actions, leaves=node_of_action_plan)
@@ -5,7 +5,7 @@ application = get_wsgi_application()
 
 import numpy as np
 import pandas as pd
-from datetime import datetime, time
+from datetime import datetime
 
 from MAppServer.settings import (
     POSITION,
@@ -13,7 +13,11 @@ from MAppServer.settings import (
     LOG_AT_EACH_TIMESTEP
 )
 from user.models import User
-from core.timestep_and_datetime import get_timestep_from_datetime, challenge_duration_to_n_timesteps
+from core.timestep_and_datetime import (
+    get_timesteps_from_epochs,
+    datetimes_to_epochs,
+    challenge_duration_to_n_timesteps
+)
 from utils import logging
 from utils.constants import SECONDS_IN_A_DAY
 
@@ -42,10 +46,17 @@ def step_events_to_cumulative_steps(step_events: list) -> np.ndarray:
 
 
 def cum_steps_to_pos_idx(cum_steps):
-    all_v_idx = np.zeros_like(cum_steps, dtype=int)
-    for idx_day, act in enumerate(cum_steps):
-        all_v_idx[idx_day] = np.argmin(np.abs(POSITION[:, None] - act), axis=0)
-    return all_v_idx
+    """Index of the closest position (the lowest one in case of a tie)"""
+    cum_steps = np.asarray(cum_steps, dtype=float)
+    # Find the closest position using the midpoints between positions...
+    idx = np.searchsorted((POSITION[1:] + POSITION[:-1]) / 2, cum_steps)
+    # ...but around the midpoints, rounding errors can make it one of the neighbours
+    lower = np.maximum(idx - 1, 0)
+    upper = np.minimum(idx + 1, POSITION.size - 1)
+    dist = np.abs(POSITION[idx] - cum_steps)
+    is_lower = np.abs(POSITION[lower] - cum_steps) <= dist
+    is_upper = np.abs(POSITION[upper] - cum_steps) < dist
+    return np.where(is_lower, lower, np.where(is_upper, upper, idx))
 
 
 def initialize_pseudo_counts(jitter, n_action: int = 2):
@@ -72,69 +83,181 @@ def build_pseudo_count_matrix(
         n_action: int = 2
 ) -> np.ndarray:
     """Compute the alpha matrix (pseudo-counts) for the transition matrix."""
-    # Extract the number of days
-    n_days = cum_steps.shape[0]
-    # Get the position indexes
-    all_idx = cum_steps_to_pos_idx(cum_steps=cum_steps)
     # Initialise it
     pseudo_counts = initialize_pseudo_counts(
         jitter=jitter,
         n_action=n_action
     )
-    # Loop over the days
-    for day in range(n_days):
-        # Loop over the timesteps
-        for t_idx in range(TIMESTEP.size):
-            # Increment the pseudo-count matrix
-            action = actions[day, t_idx]
-            idx_at_t = all_idx[day, t_idx]
-            idx_at_tp1 = all_idx[day, t_idx + 1]
-            pseudo_counts[action, t_idx, idx_at_t, idx_at_tp1] += 1
-
+    add_to_pseudo_count_matrix(
+        pseudo_counts=pseudo_counts,
+        actions=actions,
+        cum_steps=cum_steps
+    )
     return pseudo_counts
 
 
-def extract_step_events(
+def add_to_pseudo_count_matrix(
+        pseudo_counts: np.ndarray,
+        actions: np.ndarray,
+        cum_steps: np.ndarray
+):
+    """Add the transitions of each day of `cum_steps` to the pseudo-counts (in place).
+
+    Adding the days in several times gives the same pseudo-counts as adding them all at once.
+    """
+    # Extract the number of days
+    n_days = cum_steps.shape[0]
+    # Get the position indexes
+    all_idx = cum_steps_to_pos_idx(cum_steps=cum_steps)
+    # Increment the pseudo-count matrix for each day and timestep
+    # (in that order, like a loop over the days and the timesteps would)
+    t_idx = np.broadcast_to(np.arange(TIMESTEP.size), (n_days, TIMESTEP.size))
+    np.add.at(
+        pseudo_counts,
+        (actions[:n_days, :TIMESTEP.size], t_idx, all_idx[:, :-1], all_idx[:, 1:]),
+        1)
+
+
+def sort_records(
         step_counts: pd.Series or np.ndarray,
-        datetimes: pd.Series,
-        remove_empty_days: bool = False):
+        datetimes: pd.Series or pd.DatetimeIndex
+) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Sort the step count records by day, then by time.
 
+    Returns, for each record, the index of its day (among the days with data),
+    its time (as a fraction of the day), and the number of steps
+    until the next record of the same day (0 for the last one, or if the count went back).
+    Also returns the (local) date of each day with data.
+    """
     if isinstance(step_counts, pd.Series):
         step_counts = step_counts.to_numpy()
-    all_pos = step_counts
-    all_dt = datetimes
-    # Get the minimum date
-    min_date = all_dt.min().date()
-    # Get days as indexes with 0 being the first day, 1 being the second day, etc.
-    days = np.asarray([(dt.date() - min_date).days for dt in all_dt])
-    uniq_days = np.unique(days)
-    # noinspection PyTestUnpassedFixture
-    all_timestamp = np.asarray([
-        (dt - datetime.combine(dt, time.min, dt.tz)).total_seconds()
-        for dt in all_dt
-    ])
+    all_pos = np.asarray(step_counts)
+    all_dt = pd.DatetimeIndex(datetimes)
+    # Local date of each record, as an index among the days with data
+    local_dt = all_dt if all_dt.tz is None else all_dt.tz_localize(None)
+    dates, day_idx = np.unique(np.asarray(local_dt, dtype="datetime64[D]"), return_inverse=True)
+    # Time elapsed since the (local) midnight
+    midnights = pd.DatetimeIndex(dates)
+    if all_dt.tz is not None:
+        midnights = midnights.tz_localize(all_dt.tz, nonexistent="shift_forward").tz_convert("UTC").tz_localize(None)
+        all_dt = all_dt.tz_convert("UTC").tz_localize(None)
+    elapsed = np.asarray(all_dt, dtype="datetime64[us]") - np.asarray(midnights, dtype="datetime64[us]")[day_idx]
     # Make it a fraction of day (between 0 and 1)
-    all_timestamp /= SECONDS_IN_A_DAY
+    all_timestamp = elapsed / np.timedelta64(1, "s") / SECONDS_IN_A_DAY
+    # Sort the data by day, then by timestamp
+    idx = np.lexsort((all_timestamp, day_idx))
+    day_idx, all_timestamp, all_pos = day_idx[idx], all_timestamp[idx], all_pos[idx]
+    # Number of steps between each record and the next one of the same day
+    n_steps = np.zeros(all_pos.size, dtype=int)
+    if all_pos.size:
+        n_steps[:-1] = np.maximum(np.diff(all_pos), 0)
+        n_steps[:-1][day_idx[1:] != day_idx[:-1]] = 0
+    return day_idx, all_timestamp, n_steps, dates
+
+
+def extract_step_events_flat(
+        step_counts: pd.Series or np.ndarray,
+        datetimes: pd.Series or pd.DatetimeIndex
+) -> (np.ndarray, np.ndarray):
+    """Extract the step events of all the days (with data) at once.
+
+    Each step event is the time (as a fraction of the day) of the record preceding the step.
+    Returns the step events, sorted by day, and the offset of the first step event of each day
+    (plus the total number of step events), so that the step events of day `i`
+    are `step_events[day_offsets[i]:day_offsets[i+1]]`.
+    """
+    day_idx, all_timestamp, n_steps, _ = sort_records(step_counts=step_counts, datetimes=datetimes)
+    n_days = day_idx[-1] + 1 if day_idx.size else 0
+    # Add as many step events as the difference since the last record
+    # TODO: In the future, we probably want to spread that
+    #  over a period assuming something like 6000 steps per hour
+    step_events = np.repeat(all_timestamp, n_steps)
+    n_events_per_day = np.bincount(day_idx, weights=n_steps, minlength=n_days)
+    day_offsets = np.concatenate(([0], np.cumsum(n_events_per_day))).astype(int)
+    return step_events, day_offsets
+
+
+def extract_cumulative_steps(
+        step_counts: pd.Series or np.ndarray,
+        datetimes: pd.Series or pd.DatetimeIndex,
+        return_dates: bool = False
+) -> np.ndarray or (np.ndarray, np.ndarray):
+    """Compute the cumulative steps at each timestep of each day (with data),
+    directly from the records (same as `step_events_to_cumulative_steps` of the step events).
+
+    If `return_dates`, also returns the date (`datetime64[D]`) of each day.
+    """
+    day_idx, all_timestamp, n_steps, dates = sort_records(step_counts=step_counts, datetimes=datetimes)
+    n_days = day_idx[-1] + 1 if day_idx.size else 0
+    # Number of steps before each record (over all the days)
+    steps_before = np.concatenate(([0], np.cumsum(n_steps)))
+    day_starts = np.searchsorted(day_idx, np.arange(n_days + 1))
+    cum_steps = np.zeros((n_days, TIMESTEP.size+1), dtype=int)
+    for day, (start, end) in enumerate(zip(day_starts[:-1], day_starts[1:])):
+        # Steps of the records up to each timestep
+        n_records = np.searchsorted(all_timestamp[start:end], TIMESTEP, side="right")
+        cum_steps[day, 1:] = steps_before[start + n_records] - steps_before[start]
+    if return_dates:
+        return cum_steps, dates
+    return cum_steps
+
+
+def sum_steps_by_timestep(
+        step_counts: pd.Series or np.ndarray,
+        datetimes: pd.Series or pd.DatetimeIndex
+) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Sum the steps of the records of each day by timestep, each record being counted
+    at the first timestep that is not before it (as done by the database, see `assistant.activity_binning`).
+
+    Returns the date, the timestep index and the number of steps of each (day, timestep) with records.
+    """
+    day_idx, all_timestamp, n_steps, dates = sort_records(step_counts=step_counts, datetimes=datetimes)
+    t_bins = np.searchsorted(TIMESTEP, all_timestamp, side="left")
+    bins, bin_idx = np.unique(np.column_stack((day_idx, t_bins)), axis=0, return_inverse=True)
+    n_steps_by_bin = np.zeros(len(bins), dtype=int)
+    np.add.at(n_steps_by_bin, bin_idx.ravel(), n_steps)
+    return dates[bins[:, 0]], bins[:, 1], n_steps_by_bin
+
+
+def timestep_increments_to_cumulative_steps(
+        dates: np.ndarray,
+        t_bins: np.ndarray,
+        n_steps: np.ndarray
+) -> (np.ndarray, np.ndarray):
+    """Compute the cumulative steps at each timestep of each day from the steps summed
+    by (day, timestep) (see `sum_steps_by_timestep`).
+
+    Returns the cumulative steps (same as `extract_cumulative_steps`), with the date of each day.
+    """
+    dates, day_idx = np.unique(np.asarray(dates, dtype="datetime64[D]"), return_inverse=True)
+    t_bins = np.asarray(t_bins, dtype=int)
+    # The records after the last timestep (when the day lasts 25 hours) are not counted
+    is_counted = t_bins < TIMESTEP.size
+    increments = np.zeros((dates.size, TIMESTEP.size), dtype=int)
+    np.add.at(increments, (day_idx[is_counted], t_bins[is_counted]), np.asarray(n_steps, dtype=int)[is_counted])
+    cum_steps = np.zeros((dates.size, TIMESTEP.size+1), dtype=int)
+    cum_steps[:, 1:] = np.cumsum(increments, axis=1)
+    return cum_steps, dates
+
+
+def extract_step_events(
+        step_counts: pd.Series or np.ndarray,
+        datetimes: pd.Series or pd.DatetimeIndex,
+        remove_empty_days: bool = False
+) -> list:
+    """Extract the step events (as arrays) of each day with data"""
+    step_events, day_offsets = extract_step_events_flat(
+        step_counts=step_counts,
+        datetimes=datetimes
+    )
     # List of step events for each day, the event itself being the timestamp of the step
-    step_events = [[] for _ in range(uniq_days.size)]
-    # Loop over the unique days
-    for idx_day, day in enumerate(uniq_days):
-        is_day = days == day
-        obs_timestamp, obs_pos = all_timestamp[is_day], all_pos[is_day]
-        # Sort the data by timestamp
-        idx = np.argsort(obs_timestamp)
-        obs_timestamp, obs_pos = obs_timestamp[idx], obs_pos[idx]
-        # Compute the number of steps between each observed timestamp
-        diff_obs_pos = np.diff(obs_pos)
-        # Add as many step events as the difference since the last record
-        for ts, dif in zip(obs_timestamp, diff_obs_pos):
-            # TODO: In the future, we probably want to spread that
-            #  over a period assuming something like 6000 steps per hour
-            step_events[idx_day] += [ts for _ in range(dif)]
+    step_events = [
+        step_events[start:end]
+        for start, end in zip(day_offsets[:-1], day_offsets[1:])
+    ]
     # Remove empty days
     if remove_empty_days:
         step_events = [i for i in step_events if len(i)]
-    # print("n_days after filtering empty days", len(step_events))
     return step_events
 
 
@@ -151,19 +274,23 @@ def extract_actions(
         all_ch = u.challenge_set.all()
     else:
         all_ch = u.challenge_set.filter(dt_begin__date=now.date())
-    # Get the unique dates for this user (by looking at the beginning of the challenges)
-    dates = sorted(np.unique([ch.dt_begin.date() for ch in all_ch]))
+    return get_actions_from_challenge_begins(list(all_ch.values_list("dt_begin", flat=True)))
+
+
+def get_actions_from_challenge_begins(dt_begin: list) -> np.ndarray:
+    """Actions taken by the assistant, from the beginning of each challenge
+    (one row for each date with a challenge)"""
+    # Get the unique dates for this user (by looking at the beginning of the challenges),
+    # and the date of each challenge
+    dates, ch_date = np.unique(np.asarray([dt.date() for dt in dt_begin], dtype=object), return_inverse=True)
     # Initialize the actions array
     actions = np.zeros((len(dates), TIMESTEP.size), dtype=int)
-    # Get the date and timestep for each challenge
-    ch_date = np.asarray([dates.index(ch.dt_begin.date()) for ch in all_ch])
-    ch_timestep = np.asarray([get_timestep_from_datetime(ch.dt_begin) for ch in all_ch])
+    # Get the timestep for each challenge
+    ch_timestep = get_timesteps_from_epochs(datetimes_to_epochs(dt_begin))
     # Duration of a challenge in timesteps
     ch_dur = challenge_duration_to_n_timesteps()
     # Set the actions
-    for date, t in zip(ch_date, ch_timestep):
-        for _t in range(ch_dur):
-            actions[date, t + _t] = 1
+    actions[ch_date.reshape(-1, 1), ch_timestep.reshape(-1, 1) + np.arange(ch_dur)] = 1
     # Handle special case
     if actions.shape[0] == 1:
         actions = actions.flatten()
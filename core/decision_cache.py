@@ -0,0 +1,92 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from MAppServer.settings import DECISION_CACHE_SIZE
+
+
+def hash_array(x: np.ndarray) -> str:
+    """Fast content-based hash of an array (including its shape and type)."""
+    x = np.ascontiguousarray(x)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((x.dtype.str, x.shape)).encode())
+    h.update(x.data)
+    return h.hexdigest()
+
+
+class DecisionCache:
+    """Bounded LRU cache of the values of the action plans.
+
+    The cache is shared by all the users of the process: the key only depends
+    on the content of the inputs of the selection, so that users with the same
+    pseudo-counts (e.g. new users) share the same entries.
+    It can be used from several threads at the same time.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+            model,
+            pos_idx: int,
+            t_idx: int,
+            action_plans: np.ndarray,
+            order_independent: bool = True
+    ) -> tuple:
+        """Key for the inputs of the selection (`model` being a `PseudoCountModel`)"""
+        return model.digest, int(pos_idx), int(t_idx), hash_array(action_plans), bool(order_independent)
+
+    def get(self, key):
+        """Get the values for the key, None if they are not in the cache"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        for v in value:
+            v.setflags(write=False)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Get the values for the key, computing (and caching) them if necessary"""
+        value = self.get(key)
+        if value is None:
+            # Compute outside the lock, so that other users are not blocked
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+DECISION_CACHE = DecisionCache(max_size=DECISION_CACHE_SIZE)
@@ -0,0 +1,81 @@
+import numpy as np
+
+from core.activity import normalize_last_dim
+from core.decision_cache import hash_array
+
+
+def compute_epistemic_weights(alpha):
+    """Compute the epistemic weights associated with the pseudo-counts.
+
+    Entries with a pseudo-count of 0 get a weight of 0.
+    """
+    sums = np.sum(alpha, axis=-1, keepdims=True)
+    # Handle specific case where the pseudo count is 0
+    make_sense = alpha > 0
+    safe_alpha = np.where(make_sense, alpha, 1)
+    w = 1/(2*safe_alpha) - 1/(2*sums)
+    w *= make_sense.astype(float)
+    return w
+
+
+def compute_epistemic_weights_after_first_visit(alpha):
+    """Compute the epistemic weights seen by the original evaluation of the action plans
+    once a first action plan has gone through the transition.
+
+    It replaced (in place) the pseudo-counts of 0 by 1 when computing the weights,
+    so that the next action plans saw them as observed once.
+    """
+    return compute_epistemic_weights(np.where(alpha == 0, 1, alpha))
+
+
+class PseudoCountModel:
+    """Pseudo-counts of the transitions, with everything the selection of the action plans
+    needs from them: the normalized transitions (`qt`) and the epistemic weights
+    (`w`, and `w_visited` for the transitions already gone through by another action plan,
+    see `ORDER_INDEPENDENT_EPISTEMIC_VALUE`),
+    all of shape (n_action, TIMESTEP.size, POSITION.size, POSITION.size).
+
+    They are computed once for each update of the pseudo-counts,
+    and then shared by all the evaluations of action plans.
+    An observation only updates the row of the transition it concerns.
+    """
+    def __init__(self, pseudo_counts: np.ndarray):
+        self.pseudo_counts = pseudo_counts.astype(float)
+        self.sums = np.sum(self.pseudo_counts, axis=-1)
+        self.qt = normalize_last_dim(self.pseudo_counts)
+        self.w = compute_epistemic_weights(self.pseudo_counts)
+        self.w_visited = compute_epistemic_weights_after_first_visit(self.pseudo_counts)
+        self._digest = None
+
+    @property
+    def n_action(self):
+        return self.pseudo_counts.shape[0]
+
+    @property
+    def digest(self):
+        """Hash of the pseudo-counts"""
+        if self._digest is None:
+            self._digest = hash_array(self.pseudo_counts)
+        return self._digest
+
+    def observe(self, action: int, t_idx: int, pos_idx: int, new_pos_idx: int):
+        """Add the observation of a transition from `pos_idx` to `new_pos_idx`
+        when doing `action` at `t_idx`"""
+        self.pseudo_counts[action, t_idx, pos_idx, new_pos_idx] += 1
+        # Keep the row as a 2D array, so that it goes through the same computations as the whole
+        row = np.s_[action, t_idx, pos_idx:pos_idx+1]
+        self.sums[row] = np.sum(self.pseudo_counts[row], axis=-1)
+        self.qt[row] = normalize_last_dim(self.pseudo_counts[row])
+        self.w[row] = compute_epistemic_weights(self.pseudo_counts[row])
+        self.w_visited[row] = compute_epistemic_weights_after_first_visit(self.pseudo_counts[row])
+        self._digest = None
+
+    def mean_absolute_error(self, transition: np.ndarray) -> float:
+        """Mean absolute difference between the normalized transitions and `transition`"""
+        return np.mean(np.absolute(transition - self.qt))
+
+
+def as_pseudo_count_model(pseudo_counts: np.ndarray or PseudoCountModel) -> PseudoCountModel:
+    if isinstance(pseudo_counts, PseudoCountModel):
+        return pseudo_counts
+    return PseudoCountModel(pseudo_counts)
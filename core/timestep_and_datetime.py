@@ -4,6 +4,8 @@ from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
 from datetime import datetime, time, timedelta
+from functools import lru_cache
+import numpy as np
 from pytz import timezone as tz
 
 from MAppServer.settings import (
@@ -35,6 +37,66 @@ def get_timestep_from_datetime(dt):
     return int(timestep)
 
 
+@lru_cache()
+def get_utc_offset_table(time_zone: str = TIME_ZONE) -> (np.ndarray, np.ndarray):
+    """Epochs (in seconds) at which the UTC offset of the time zone changes,
+    with the offset (in seconds) from each of them on"""
+    zone = tz(time_zone)
+    transitions = getattr(zone, "_utc_transition_times", None)
+    if not transitions:
+        # Fixed offset (e.g. UTC)
+        offset = zone.utcoffset(datetime(1970, 1, 1)).total_seconds()
+        return np.array([-2**62]), np.array([offset], dtype=np.int64)
+    epoch = datetime(1970, 1, 1)
+    transition_epochs = np.array([(t - epoch).total_seconds() for t in transitions], dtype=np.int64)
+    offsets = np.array([info[0].total_seconds() for info in zone._transition_info], dtype=np.int64)
+    for a in (transition_epochs, offsets):
+        a.setflags(write=False)
+    return transition_epochs, offsets
+
+
+def datetimes_to_epochs(dts) -> np.ndarray:
+    """Seconds since the epoch of (timezone aware) datetimes"""
+    return np.floor([dt.timestamp() for dt in dts]).astype(np.int64).reshape(-1)
+
+
+def epochs_to_local_seconds(epochs: np.ndarray) -> np.ndarray:
+    """Seconds since the epoch, as shown by a clock of TIME_ZONE
+    (i.e. counting the days of TIME_ZONE, whether they last 23, 24 or 25 hours)"""
+    transition_epochs, offsets = get_utc_offset_table()
+    epochs = np.asarray(epochs, dtype=np.int64)
+    idx = np.searchsorted(transition_epochs, epochs, side="right") - 1
+    return epochs + offsets[idx]
+
+
+def get_local_dates_from_epochs(epochs: np.ndarray) -> np.ndarray:
+    """Dates in TIME_ZONE, as datetime64[D]"""
+    return (epochs_to_local_seconds(epochs) // SECONDS_IN_A_DAY).astype("datetime64[D]")
+
+
+def get_timesteps_from_epochs(epochs: np.ndarray) -> np.ndarray:
+    """Same as `get_timestep_from_datetime` for an array of epochs (in seconds)"""
+    timestep_duration = SECONDS_IN_A_DAY / TIMESTEP.size
+    local_seconds = epochs_to_local_seconds(epochs)
+    return (np.mod(local_seconds, SECONDS_IN_A_DAY) // timestep_duration).astype(int)
+
+
+def get_epochs_from_timesteps(timesteps: np.ndarray, dates: np.ndarray) -> np.ndarray:
+    """Epochs (in seconds) of the beginning of the timesteps of the (local) dates.
+
+    Times that do not exist or happen twice when the clocks change are taken
+    in standard time (as `localize` of pytz does by default).
+    """
+    transition_epochs, offsets = get_utc_offset_table()
+    timestep_duration = SECONDS_IN_A_DAY / TIMESTEP.size
+    days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+    local_seconds = days * SECONDS_IN_A_DAY + (np.asarray(timesteps) * timestep_duration).astype(np.int64)
+    # Local time of each change, as shown by the clock after the change
+    local_transitions = transition_epochs + offsets
+    idx = np.searchsorted(local_transitions, local_seconds, side="right") - 1
+    return local_seconds - offsets[idx]
+
+
 def challenge_duration_to_n_timesteps():
     if len(TIMESTEP) != 24:
         raise NotImplementedError("Sorry mate")
@@ -6,7 +6,7 @@ import numpy as np
 import re
 from django.db.models import F
 
-import assistant.tasks
+import assistant.belief_update_queue
 from MAppServer.settings import TIME_ZONE, APP_VERSION
 from user.models import User, Activity, Status, ConnectionToServer, Interaction
 
@@ -284,10 +284,8 @@ class RequestHandler:
         Status.objects.filter(user=u).update(**read_android_json(status))
         # Register the connection to the server
         ConnectionToServer.objects.create(user=u)
-        # Update the model
-        # TODO: this might take a long time
-        #  would need to use Celery or something similar
-        assistant.tasks.update_beliefs_and_challenges(u=u, now=now)
+        # Update the model (in the background: the challenges will be sent at the next sync)
+        assistant.belief_update_queue.request_belief_update(u=u, now=now)
         # Prepare the response
         r = {"subject": subject}
         r.update(get_last_activity_timestamp(u))
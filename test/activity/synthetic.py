@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from MAppServer.settings import TIME_ZONE
+
+
+def random_activity(rng, n_days, n_records_per_day=300, start="2024-03-01"):
+    """Step counts since midnight, recorded at random times of `n_days` consecutive days
+    (some of them without any record), with the datetimes of the records"""
+    step_counts, datetimes = [], []
+    for day in pd.date_range(start, periods=n_days, freq="D"):
+        if rng.random() < 0.1:
+            continue
+        seconds = np.sort(rng.choice(86400, size=n_records_per_day, replace=False))
+        steps = np.cumsum(rng.integers(0, 100, size=n_records_per_day))
+        # Sometimes the counter goes back
+        steps[rng.random(n_records_per_day) < 0.01] = 0
+        step_counts.append(steps)
+        datetimes.append(day + pd.to_timedelta(seconds, unit="s"))
+    # Recorded in UTC, so that times are unique even when the clocks change
+    datetimes = pd.DatetimeIndex(np.concatenate(datetimes)).tz_localize("UTC").tz_convert(TIME_ZONE)
+    # The records do not come in order
+    order = rng.permutation(len(datetimes))
+    return np.concatenate(step_counts)[order], datetimes[order]
@@ -0,0 +1,26 @@
+import itertools
+import numpy as np
+
+from MAppServer.settings import TIMESTEP
+
+
+def make_challenge_windows(starts, window=2, duration=1):
+    """Timesteps and strategies for challenges starting at `starts`"""
+    related_timesteps = [np.arange(start, start + window) for start in starts]
+    strategies = []
+    for _ in starts:
+        # All the ways of placing a block of `duration` ones in the window
+        strategies.append(np.vstack([
+            np.concatenate((np.zeros(s), np.ones(duration), np.zeros(window - duration - s))).astype(int)
+            for s in range(window - duration + 1)]))
+    return strategies, related_timesteps
+
+
+def enumerate_action_plans(strategies, related_timesteps, t_idx):
+    action_plans = []
+    for challenge_parts in itertools.product(*strategies):
+        action_plan = np.zeros(TIMESTEP.size, dtype=int)
+        for i, challenge_part in enumerate(challenge_parts):
+            action_plan[related_timesteps[i]] = challenge_part
+        action_plans.append(action_plan)
+    return np.asarray(action_plans)[:, t_idx:]
@@ -0,0 +1,18 @@
+from MAppServer.settings import (
+    TIMESTEP,
+    POSITION,
+    ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER
+)
+from core.activity import initialize_pseudo_counts
+
+
+def random_pseudo_counts(rng, n_obs=500):
+    """Pseudo-counts with some observations on top of the jitter"""
+    pseudo_counts = initialize_pseudo_counts(jitter=ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER)
+    for _ in range(n_obs):
+        a = rng.integers(pseudo_counts.shape[0])
+        t = rng.integers(TIMESTEP.size)
+        p = rng.integers(POSITION.size)
+        p_tp1 = rng.integers(p, POSITION.size)
+        pseudo_counts[a, t, p, p_tp1] += 1
+    return pseudo_counts
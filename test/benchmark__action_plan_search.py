@@ -0,0 +1,80 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+import time
+import numpy as np
+
+from MAppServer.settings import INIT_POS_IDX, BEAM_SEARCH_WIDTH
+from core.action_plan_library import build_all_action_plans
+from core.action_plan_selection import select_action_plan
+from core.action_plan_search import (
+    select_action_plan_beam_search,
+    select_action_plan_factorized
+)
+from core.decision_cache import DECISION_CACHE
+from test.assistant_model.pseudo_counts import random_pseudo_counts
+from test.assistant_model.action_plans import make_challenge_windows
+
+
+SEED = 123
+# Challenges of 3h one after the other from midnight, so that the number of combinations
+# of strategies (3 per challenge) grows up to 3^8 = 6561 action plans
+WINDOW = 3
+CHALLENGE_DURATION = 1
+N_CHALLENGES = range(2, 9)
+N_REPEAT = 3
+
+
+def timeit(f, **kwargs):
+    """Best time of a few runs (the decision cache being emptied before each of them)"""
+    best = np.inf
+    for _ in range(N_REPEAT):
+        DECISION_CACHE.clear()
+        start = time.perf_counter()
+        result = f(**kwargs)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def select_by_enumeration(pseudo_counts, pos_idx, t_idx, strategies, related_timesteps):
+    action_plans = build_all_action_plans(strategies=strategies, related_timesteps=related_timesteps)
+    idx, pragmatic, epistemic = select_action_plan(
+        pseudo_counts=pseudo_counts,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        action_plans=action_plans,
+        order_independent=True)
+    return action_plans[idx, t_idx:], pragmatic[idx], epistemic[idx]
+
+
+def main():
+    rng = np.random.default_rng(SEED)
+    pseudo_counts = random_pseudo_counts(rng)
+    print(f"{'challenges':>10} {'plans':>6} {'strategies':>10} "
+          f"{'enumeration':>12} {f'beam ({BEAM_SEARCH_WIDTH})':>16} {'factorized':>16}")
+    for n_challenge in N_CHALLENGES:
+        starts = WINDOW * np.arange(n_challenge)
+        strategies, related_timesteps = make_challenge_windows(
+            starts=starts, window=WINDOW, duration=CHALLENGE_DURATION)
+        kwargs = dict(
+            pseudo_counts=pseudo_counts,
+            pos_idx=INIT_POS_IDX,
+            t_idx=0,
+            strategies=strategies,
+            related_timesteps=related_timesteps)
+        expected, t_enumeration = timeit(select_by_enumeration, **kwargs)
+        results = [f"{n_challenge:>10} {np.prod([len(s) for s in strategies]):>6} "
+                   f"{sum(len(s) for s in strategies):>10} {t_enumeration:>11.4f}s"]
+        for select in (select_action_plan_beam_search, select_action_plan_factorized):
+            result, t_select = timeit(select, **kwargs)
+            # Whether the (approximate) planner selects the same action plan as the enumeration
+            is_same = "=" if np.array_equal(result[0], expected[0]) else "!="
+            results.append(f"{t_select:>11.4f}s {is_same:>3}")
+        print(" ".join(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+import time
+import numpy as np
+
+from MAppServer.settings import TIMESTEP, ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER
+from core.activity import (
+    extract_step_events,
+    extract_cumulative_steps,
+    step_events_to_cumulative_steps,
+    build_pseudo_count_matrix
+)
+from test.activity.synthetic import random_activity
+from test.test__activity import extract_step_events_loop, build_pseudo_count_matrix_loop, random_cum_steps
+
+
+SEED = 123
+N_DAYS = 90
+
+
+def timeit(f, **kwargs):
+    start = time.perf_counter()
+    result = f(**kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rng = np.random.default_rng(SEED)
+    step_counts, datetimes = random_activity(rng, n_days=N_DAYS)
+    _, t_loop = timeit(extract_step_events_loop, step_counts=step_counts, datetimes=datetimes)
+    step_events, t_vectorized = timeit(extract_step_events, step_counts=step_counts, datetimes=datetimes)
+    n_steps = sum(len(step_events_day) for step_events_day in step_events)
+    print(f"{N_DAYS} days ({len(step_events)} with data, {n_steps} steps): "
+          f"loop {t_loop*1000:.1f}ms, vectorized {t_vectorized*1000:.1f}ms "
+          f"(x{t_loop/t_vectorized:.0f})")
+    _, t_two_stage = timeit(step_events_to_cumulative_steps, step_events=step_events)
+    _, t_direct = timeit(extract_cumulative_steps, step_counts=step_counts, datetimes=datetimes)
+    print(f"cumulative steps: from the step events {(t_vectorized + t_two_stage)*1000:.1f}ms, "
+          f"directly {t_direct*1000:.1f}ms")
+    for n_days in (1000, 100000):
+        cum_steps = random_cum_steps(rng, n_days=n_days)
+        actions = rng.integers(2, size=(n_days, TIMESTEP.size))
+        kwargs = dict(actions=actions, cum_steps=cum_steps, jitter=ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER)
+        _, t_loop = timeit(build_pseudo_count_matrix_loop, **kwargs)
+        _, t_vectorized = timeit(build_pseudo_count_matrix, **kwargs)
+        print(f"pseudo-counts for {n_days} days: loop {t_loop*1000:.1f}ms, "
+              f"vectorized {t_vectorized*1000:.1f}ms (x{t_loop/t_vectorized:.0f})")
+
+
+if __name__ == "__main__":
+    main()
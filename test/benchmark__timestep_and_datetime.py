@@ -0,0 +1,47 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+from datetime import datetime, timezone as dt_timezone
+import numpy as np
+from pytz import timezone
+
+from MAppServer.settings import TIME_ZONE, TIMESTEP
+from core.timestep_and_datetime import (
+    get_timestep_from_datetime,
+    get_timesteps_from_epochs,
+    get_epochs_from_timesteps
+)
+from test.benchmark__activity import timeit
+from test.test__timestep_and_datetime import random_epochs
+
+
+SEED = 123
+N_SINGLE = 10000
+N_RECORDS = 5000000
+
+
+def get_timesteps_one_by_one(epochs):
+    tz = timezone(TIME_ZONE)
+    return [
+        get_timestep_from_datetime(datetime.fromtimestamp(int(e), tz=dt_timezone.utc).astimezone(tz))
+        for e in epochs]
+
+
+def main():
+    rng = np.random.default_rng(SEED)
+    epochs = random_epochs(rng, n=N_RECORDS)
+    _, t_single = timeit(get_timesteps_one_by_one, epochs=epochs[:N_SINGLE])
+    timesteps, t_vectorized = timeit(get_timesteps_from_epochs, epochs=epochs)
+    print(f"datetime -> timestep: one by one {N_SINGLE/t_single/1e6:.2f}M/s, "
+          f"vectorized {epochs.size/t_vectorized/1e6:.1f}M/s")
+    dates = rng.choice(np.arange(np.datetime64("2023-01-01"), np.datetime64("2025-01-01")), size=N_RECORDS)
+    timesteps = rng.integers(TIMESTEP.size, size=N_RECORDS)
+    _, t_vectorized = timeit(get_epochs_from_timesteps, timesteps=timesteps, dates=dates)
+    print(f"timestep -> datetime: vectorized {N_RECORDS/t_vectorized/1e6:.1f}M/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import copy
 import numpy as np
 from tqdm import tqdm
 
@@ -14,77 +15,116 @@ from MAppServer.settings import (
     TEST_SEED_RUN,
     ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER
 )
-from core.action_plan_selection import select_action_plan, normalize_last_dim, make_a_step
+from core.action_plan_selection import select_action_plan_for_each_gamma, make_a_step
 from core.activity import initialize_pseudo_counts
+from core.pseudo_count_model import PseudoCountModel
+
+
+def split_by_action_plan(group, action_plan_idx):
+    """Split a group of gamma values according to the action plan selected for each of them.
+
+    Each new group gets its own copy of the state of the simulation.
+    """
+    gammas = group["gammas"]
+    new_groups = []
+    for idx in np.unique(action_plan_idx):
+        new_group = group if len(new_groups) == 0 else copy.deepcopy(group)
+        new_group["gammas"] = gammas[action_plan_idx == idx]
+        new_group["action_plan_idx"] = idx
+        new_groups.append(new_group)
+    return new_groups
 
 
 def test_assistant_model(
         transition,
-        action_plans
+        action_plans,
+        gammas=None
 ):
-    # Seed for reproducibility
-    rng = np.random.default_rng(seed=TEST_SEED_RUN)
+    """Run the assistant model, for each of the `gammas` if given (GAMMA otherwise).
+
+    The values of gamma that select the same action plans see the same observations,
+    so that they share a single simulation until their selections differ.
+    The run for each value is the same as the one of a separate run with GAMMA set to this value.
+    """
+    if gammas is None:
+        return test_assistant_model(transition=transition, action_plans=action_plans, gammas=[GAMMA])[0]
+    gammas = np.asarray(gammas, dtype=float)
+    n_gamma = gammas.size
     # Initialize history
-    hist_err = np.zeros((TEST_N_RESTART, N_DAY*TIMESTEP.size))
-    hist_pos = np.zeros((TEST_N_RESTART, N_DAY, TIMESTEP.size+1))
-    hist_epistemic = np.zeros((TEST_N_RESTART, N_DAY, len(action_plans)))
+    hist_err = np.zeros((n_gamma, TEST_N_RESTART, N_DAY*TIMESTEP.size))
+    hist_pos = np.zeros((n_gamma, TEST_N_RESTART, N_DAY, TIMESTEP.size+1))
+    hist_epistemic = np.zeros((n_gamma, TEST_N_RESTART, N_DAY, len(action_plans)))
     hist_pragmatic = np.zeros_like(hist_epistemic)
+    # Seed for reproducibility
+    groups = [{"gammas": np.arange(n_gamma), "rng": np.random.default_rng(seed=TEST_SEED_RUN)}]
     # Run the model
     for sample in range(TEST_N_RESTART):
         # Initialize alpha
-        pseudo_counts = initialize_pseudo_counts(jitter=ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER)
+        for group in groups:
+            group["model"] = PseudoCountModel(initialize_pseudo_counts(jitter=ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER))
         epoch = 0
         _iter = range(N_DAY)
         if USE_PROGRESS_BAR:
             _iter = tqdm(_iter)
         for ep_idx in _iter:
-            # Select action plan
-            action_plan_idx, pr_value, ep_value = select_action_plan(
-                pseudo_counts=pseudo_counts,
-                pos_idx=INIT_POS_IDX,
-                t_idx=0,
-                action_plans=action_plans
-            )
-            # Record values
-            hist_epistemic[sample, ep_idx] = ep_value
-            hist_pragmatic[sample, ep_idx] = pr_value
-            # Select the best action plan ('policy')
-            policy = action_plans[action_plan_idx]
-            if LOG_AT_EACH_EPISODE:
-                print(f"restart #{sample} - episode #{ep_idx} - policy #{action_plan_idx}")
-                print("-"*80)
-            # Run the policy
-            pos_idx = INIT_POS_IDX
-            # Going through the policy
-            for t_idx in range(TIMESTEP.size):
-                # Record position and velocity
-                hist_pos[sample, ep_idx, t_idx] = POSITION[pos_idx]
-                # Make a step
-                action, new_pos_idx = make_a_step(
-                    policy=policy,
-                    t_idx=t_idx,
-                    pos_idx=pos_idx,
-                    transition=transition,
-                    rng=rng
+            new_groups = []
+            for group in groups:
+                # Select action plan
+                action_plan_idx, pr_value, ep_value = select_action_plan_for_each_gamma(
+                    pseudo_counts=group["model"],
+                    pos_idx=INIT_POS_IDX,
+                    t_idx=0,
+                    action_plans=action_plans,
+                    gammas=gammas[group["gammas"]]
                 )
-                # Update pseudo-counts
-                pseudo_counts[action, t_idx, pos_idx, new_pos_idx] += 1
-                if LOG_PSEUDO_COUNT_UPDATE:
-                    print("UPDATE PSEUDO-COUNTS", "t_idx", t_idx, "action", action, "day", ep_idx, "pos_idx", pos_idx, "new_pos_idx", new_pos_idx)
-                    # print("pseudo_counts sum", int(pseudo_counts.sum() - pseudo_counts.size * alpha_jitter))
-                # Replace old value with the new value
-                pos_idx = new_pos_idx
-                # Log
-                error = np.mean(np.absolute(transition - normalize_last_dim(pseudo_counts)))
-                hist_err[sample, epoch] = error
-            # Record the last position
-            hist_pos[sample, ep_idx, -1] = POSITION[pos_idx]
+                # Record values
+                hist_epistemic[group["gammas"], sample, ep_idx] = ep_value
+                hist_pragmatic[group["gammas"], sample, ep_idx] = pr_value
+                new_groups += split_by_action_plan(group=group, action_plan_idx=action_plan_idx)
+            groups = new_groups
+            for group in groups:
+                # Select the best action plan ('policy')
+                policy = action_plans[group["action_plan_idx"]]
+                model = group["model"]
+                if LOG_AT_EACH_EPISODE:
+                    print(f"restart #{sample} - episode #{ep_idx} - gammas {gammas[group['gammas']]} "
+                          f"- policy #{group['action_plan_idx']}")
+                    print("-"*80)
+                # Run the policy
+                pos_idx = INIT_POS_IDX
+                # Going through the policy
+                for t_idx in range(TIMESTEP.size):
+                    # Record position and velocity
+                    hist_pos[group["gammas"], sample, ep_idx, t_idx] = POSITION[pos_idx]
+                    # Make a step
+                    action, new_pos_idx = make_a_step(
+                        policy=policy,
+                        t_idx=t_idx,
+                        pos_idx=pos_idx,
+                        transition=transition,
+                        rng=group["rng"]
+                    )
+                    # Update pseudo-counts
+                    model.observe(action=action, t_idx=t_idx, pos_idx=pos_idx, new_pos_idx=new_pos_idx)
+                    if LOG_PSEUDO_COUNT_UPDATE:
+                        print("UPDATE PSEUDO-COUNTS", "t_idx", t_idx, "action", action, "day", ep_idx, "pos_idx", pos_idx, "new_pos_idx", new_pos_idx)
+                        # print("pseudo_counts sum", int(pseudo_counts.sum() - pseudo_counts.size * alpha_jitter))
+                    # Replace old value with the new value
+                    pos_idx = new_pos_idx
+                    # Log
+                    error = model.mean_absolute_error(transition)
+                    hist_err[group["gammas"], sample, epoch] = error
+                # Record the last position
+                hist_pos[group["gammas"], sample, ep_idx, -1] = POSITION[pos_idx]
             epoch += 1
-    return {
-            "gamma": GAMMA,
+    return [
+        {
+            "gamma": gamma,
             "policy": "af",
-            "error": hist_err,
-            "epistemic": hist_epistemic,
-            "pragmatic": hist_pragmatic,
-            "position": hist_pos[:, :, :]
-    }
+            "error": hist_err[i],
+            "epistemic": hist_epistemic[i],
+            "pragmatic": hist_pragmatic[i],
+            "position": hist_pos[i, :, :, :]
+        }
+        for i, gamma in enumerate(gammas)
+    ]
@@ -0,0 +1,183 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+from itertools import product
+import tempfile
+import numpy as np
+
+from core.action_plan_generation import generate_possibilities_for_single_challenge
+from core.action_plan_library import (
+    get_action_plan_library,
+    build_action_plans,
+    load_or_build_all_action_plans
+)
+from core.action_plan_bits import (
+    pack_action_plans,
+    unpack_action_plans,
+    is_compatible_with_past,
+    take_future,
+    to_signed,
+    from_signed
+)
+from test.assistant_model.action_plans import make_challenge_windows, enumerate_action_plans
+
+
+SEED = 123
+
+
+def generate_possibilities_for_single_challenge_brute_force(
+        challenge_window,
+        ch_dur,
+        discard_overlapping_strategies
+):
+    """Previous implementation, going through all the combinations of 0's and 1's"""
+    valid_combinations = []
+    for combination in product([0, 1], repeat=challenge_window):
+        groups = ''.join(map(str, combination)).split('0')
+        if sum(1 for group in groups if group == '1'*ch_dur) != 1:
+            continue
+        if sum(1 for group in groups if '1' in group) != 1:
+            continue
+        valid_combinations.append(combination)
+    action_plans = np.array(valid_combinations, dtype=int)
+    if discard_overlapping_strategies:
+        action_plans = action_plans[::-1]
+        valid_action_plans = np.atleast_2d(action_plans[0])
+        for i in range(1, action_plans.shape[0]):
+            stacked = np.atleast_2d(np.vstack((valid_action_plans, np.atleast_2d(action_plans[i]))))
+            if np.any(np.sum(stacked, axis=0) > 1):
+                continue
+            valid_action_plans = stacked
+        action_plans = valid_action_plans
+    return action_plans
+
+
+def test_single_challenge_possibilities_match_brute_force():
+    for challenge_window in range(1, 13):
+        for ch_dur in range(1, challenge_window + 1):
+            for discard_overlapping_strategies in (False, True):
+                expected = generate_possibilities_for_single_challenge_brute_force(
+                    challenge_window=challenge_window,
+                    ch_dur=ch_dur,
+                    discard_overlapping_strategies=discard_overlapping_strategies)
+                result = generate_possibilities_for_single_challenge(
+                    challenge_window=challenge_window,
+                    ch_dur=ch_dur,
+                    discard_overlapping_strategies=discard_overlapping_strategies)
+                assert result.dtype == expected.dtype
+                assert np.array_equal(result, expected), (challenge_window, ch_dur, discard_overlapping_strategies)
+
+
+def test_action_plan_library_matches_enumeration():
+    rng = np.random.default_rng(SEED)
+    strategies, related_timesteps = make_challenge_windows(starts=(4, 9, 14, 19), window=4, duration=1)
+    library = get_action_plan_library(strategies=strategies, related_timesteps=related_timesteps)
+    action_plans = enumerate_action_plans(strategies, related_timesteps, 0)
+    assert np.array_equal(library.action_plans, action_plans)
+    # Built only once, and cannot be modified
+    assert get_action_plan_library(strategies=strategies, related_timesteps=related_timesteps) is library
+    assert not library.action_plans.flags.writeable
+    for last_challenge_t_idx in (0, 6, 13, 23):
+        for action_taken in list(action_plans[rng.choice(len(action_plans), size=5)]) + [np.ones(24, dtype=int)]:
+            mask = np.all(
+                action_plans[:, :last_challenge_t_idx] == action_taken[:last_challenge_t_idx],
+                axis=1)
+            rows = library.get_rows_compatible_with_past(
+                action_taken=action_taken,
+                last_challenge_t_idx=last_challenge_t_idx)
+            assert np.array_equal(rows, np.flatnonzero(mask))
+            # Looked up in the index of the prefixes of that length, built only once
+            if rows.size:
+                assert library.get_rows_compatible_with_past(
+                    action_taken=action_taken,
+                    last_challenge_t_idx=last_challenge_t_idx) is rows
+            for t_idx in (0, last_challenge_t_idx, 23):
+                future = library.get_future_action_plans(rows=rows, t_idx=t_idx)
+                assert np.array_equal(future, action_plans[rows, t_idx:])
+    # Without any challenge, the only action plan is to do nothing
+    library = get_action_plan_library(strategies=[], related_timesteps=[])
+    assert np.array_equal(library.action_plans, np.zeros((1, 24), dtype=int))
+
+
+def test_action_plans_built_by_chunks():
+    strategies, related_timesteps = make_challenge_windows(starts=(4, 9, 14), window=4, duration=2)
+    action_plans = enumerate_action_plans(strategies, related_timesteps, 0)
+    chunks = [
+        build_action_plans(
+            strategies=strategies,
+            related_timesteps=related_timesteps,
+            rows=np.arange(start, min(start + 5, len(action_plans))))
+        for start in range(0, len(action_plans), 5)]
+    assert np.array_equal(np.vstack(chunks), action_plans)
+
+
+def test_action_plan_library_on_disk():
+    strategies, related_timesteps = make_challenge_windows(starts=(2, 11), window=3, duration=1)
+    action_plans = enumerate_action_plans(strategies, related_timesteps, 0)
+    with tempfile.TemporaryDirectory() as library_dir:
+        library = get_action_plan_library(
+            strategies=strategies,
+            related_timesteps=related_timesteps,
+            library_dir=library_dir)
+        # Memory-mapped from the file that has just been saved
+        assert isinstance(library.action_plans, np.memmap)
+        assert not library.action_plans.flags.writeable
+        assert np.array_equal(library.action_plans, action_plans)
+        files = os.listdir(library_dir)
+        assert len(files) == 1 and files[0].endswith(".npy")
+        # Another process re-uses the file
+        path = os.path.join(library_dir, files[0])
+        modified = os.path.getmtime(path)
+        digest = files[0][len("action_plans_"):-len(".npy")]
+        loaded = load_or_build_all_action_plans(
+            strategies=strategies,
+            related_timesteps=related_timesteps,
+            h=24,
+            digest=digest,
+            library_dir=library_dir)
+        assert np.array_equal(loaded, action_plans)
+        assert os.path.getmtime(path) == modified
+
+
+def test_packed_action_plans():
+    rng = np.random.default_rng(SEED)
+    for h in (24, 64, 100):
+        action_plans = rng.integers(2, size=(50, h))
+        packed = pack_action_plans(action_plans)
+        assert packed.dtype == np.uint64 and packed.shape == (50, -(-h // 64))
+        assert np.array_equal(unpack_action_plans(packed, h=h), action_plans)
+        assert np.array_equal(unpack_action_plans(packed[3], h=h), action_plans[3])
+        assert np.array_equal(from_signed(to_signed(packed)), packed)
+        action_taken = action_plans[0].copy()
+        action_plans[:25, :h//2] = action_taken[:h//2]
+        packed = pack_action_plans(action_plans)
+        for last_challenge_t_idx in (0, 1, h//2, h):
+            mask = np.all(
+                action_plans[:, :last_challenge_t_idx] == action_taken[:last_challenge_t_idx],
+                axis=1)
+            result = is_compatible_with_past(
+                packed=packed,
+                packed_action_taken=pack_action_plans(action_taken),
+                last_challenge_t_idx=last_challenge_t_idx)
+            assert np.array_equal(result, mask)
+        for t_idx in (0, 5, 63, 64, 70, h - 1):
+            if t_idx >= h:
+                continue
+            future = take_future(packed, t_idx=t_idx)
+            assert np.array_equal(unpack_action_plans(future, h=h-t_idx), action_plans[:, t_idx:])
+
+
+def main():
+    test_single_challenge_possibilities_match_brute_force()
+    test_action_plan_library_matches_enumeration()
+    test_action_plans_built_by_chunks()
+    test_action_plan_library_on_disk()
+    test_packed_action_plans()
+    print("All good!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+import numpy as np
+
+from MAppServer.settings import (
+    TIMESTEP,
+    POSITION
+)
+from core.action_plan_generation import generate_possibilities_for_single_challenge
+from core.action_plan_selection import (
+    select_action_plan,
+    evaluate_action_plans,
+    compute_expected_free_energy,
+    choose_best_action_plan
+)
+from core.action_plan_search import (
+    select_action_plan_beam_search,
+    select_action_plan_factorized,
+    select_action_plan_anytime,
+    select_action_plan_branch_and_bound,
+    select_action_plan_streaming
+)
+from core.decision_cache import DECISION_CACHE
+from test.assistant_model.pseudo_counts import random_pseudo_counts
+from test.assistant_model.action_plans import make_challenge_windows, enumerate_action_plans
+
+
+SEED = 123
+
+
+def select_by_enumeration(pseudo_counts, pos_idx, t_idx, strategies, related_timesteps):
+    action_plans = enumerate_action_plans(strategies, related_timesteps, t_idx)
+    idx, pragmatic, epistemic = select_action_plan(
+        pseudo_counts=pseudo_counts,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        action_plans=action_plans,
+        order_independent=True)
+    return action_plans[idx], pragmatic[idx], epistemic[idx]
+
+
+def test_beam_search_single_challenge_is_exact():
+    rng = np.random.default_rng(SEED)
+    strategies, related_timesteps = [generate_possibilities_for_single_challenge()], [np.arange(8, 10)]
+    for _ in range(5):
+        pseudo_counts = random_pseudo_counts(rng)
+        pos_idx = rng.integers(POSITION.size)
+        expected = select_by_enumeration(pseudo_counts, pos_idx, 3, strategies, related_timesteps)
+        result = select_action_plan_beam_search(
+            pseudo_counts=pseudo_counts,
+            pos_idx=pos_idx,
+            t_idx=3,
+            strategies=strategies,
+            related_timesteps=related_timesteps)
+        assert np.array_equal(expected[0], result[0])
+        assert np.allclose(expected[1:], result[1:])
+
+
+def test_beam_search_full_beam_is_exact():
+    rng = np.random.default_rng(SEED)
+    strategies, related_timesteps = make_challenge_windows(starts=(4, 9, 14, 19), window=4, duration=1)
+    n_action_plan = np.prod([len(s) for s in strategies])
+    for _ in range(5):
+        pseudo_counts = random_pseudo_counts(rng)
+        pos_idx = rng.integers(POSITION.size)
+        expected = select_by_enumeration(pseudo_counts, pos_idx, 0, strategies, related_timesteps)
+        result = select_action_plan_beam_search(
+            pseudo_counts=pseudo_counts,
+            pos_idx=pos_idx,
+            t_idx=0,
+            strategies=strategies,
+            related_timesteps=related_timesteps,
+            beam_width=n_action_plan)
+        assert np.array_equal(expected[0], result[0])
+        assert np.allclose(expected[1:], result[1:])
+
+
+def test_beam_search_is_approximate():
+    rng = np.random.default_rng(SEED)
+    strategies, related_timesteps = make_challenge_windows(starts=(4, 9, 14, 19), window=4, duration=1)
+    action_plans = enumerate_action_plans(strategies, related_timesteps, 0)
+    # Nothing is discarded once the beam holds all the combinations of the first challenges
+    full_beam_width = np.prod([len(s) for s in strategies[:-1]])
+    n_missed = {1: 0, 4: 0, full_beam_width: 0}
+    for _ in range(10):
+        pseudo_counts = random_pseudo_counts(rng)
+        pos_idx = rng.integers(POSITION.size)
+        expected = select_by_enumeration(pseudo_counts, pos_idx, 0, strategies, related_timesteps)
+        for beam_width in n_missed:
+            action_plan, pragmatic, epistemic = select_action_plan_beam_search(
+                pseudo_counts=pseudo_counts,
+                pos_idx=pos_idx,
+                t_idx=0,
+                strategies=strategies,
+                related_timesteps=related_timesteps,
+                beam_width=beam_width)
+            efe = compute_expected_free_energy(pragmatic=pragmatic, epistemic=epistemic)
+            expected_efe = compute_expected_free_energy(pragmatic=expected[1], epistemic=expected[2])
+            # Never better than the best action plan
+            assert efe <= expected_efe or np.isclose(efe, expected_efe)
+            n_missed[beam_width] += not np.array_equal(action_plan, expected[0])
+    # With a narrow beam, the best action plan is missed
+    assert n_missed[1] > 0 and n_missed[4] > 0, n_missed
+    assert n_missed[full_beam_width] == 0, n_missed
+
+
+def test_beam_search_small_beam():
+    rng = np.random.default_rng(SEED)
+    strategies, related_timesteps = make_challenge_windows(starts=(4, 9, 14, 19), window=4, duration=1)
+    pseudo_counts = random_pseudo_counts(rng)
+    action_plan, pragmatic, epistemic = select_action_plan_beam_search(
+        pseudo_counts=pseudo_counts,
+        pos_idx=0,
+        t_idx=0,
+        strategies=strategies,
+        related_timesteps=related_timesteps,
+        beam_width=1)
+    # The selected action plan is one of the possible action plans
+    action_plans = enumerate_action_plans(strategies, related_timesteps, 0)
+    assert np.any(np.all(action_plans == action_plan, axis=1))
+
+
+def test_factorized_plans_one_challenge_at_a_time():
+    rng = np.random.default_rng(SEED)
+    strategies, related_timesteps = make_challenge_windows(starts=(4, 9, 14, 19), window=4, duration=1)
+    pseudo_counts = random_pseudo_counts(rng)
+    t_idx, pos_idx = 2, 1
+    result = select_action_plan_factorized(
+        pseudo_counts=pseudo_counts,
+        pos_idx=pos_idx,
+        t_idx=t_idx,
+        strategies=strategies,
+        related_timesteps=related_timesteps)
+    # Choose the strategy of each challenge in turn, looking only until the next challenge
+    action_plan = np.zeros(TIMESTEP.size, dtype=int)
+    ends = [timesteps[0] for timesteps in related_timesteps[1:]] + [TIMESTEP.size]
+    for strategies_for_single, timesteps, end in zip(strategies, related_timesteps, ends):
+        candidates = np.tile(action_plan, (len(strategies_for_single), 1))
+        candidates[:, timesteps] = strategies_for_single
+        pragmatic, epistemic = evaluate_action_plans(
+            pseudo_counts=pseudo_counts,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=candidates[:, t_idx:end],
+            order_independent=True)
+        efe = compute_expected_free_energy(pragmatic=pragmatic, epistemic=epistemic)
+        best = np.argmax(efe)
+        action_plan = candidates[best]
+    # For the last challenge, ties are broken as usual
+    best = choose_best_action_plan(efe)
+    action_plan = candidates[best]
+    assert np.array_equal(result[0], action_plan[t_idx:])
+    assert np.allclose(result[1:], (pragmatic[best], epistemic[best]))
+
+
+def test_anytime_selection():
+    rng = np.random.default_rng(SEED)
+    strategies, related_timesteps = make_challenge_windows(starts=(4, 9, 14, 19), window=4, duration=1)
+    action_plans = enumerate_action_plans(strategies, related_timesteps, 0)
+    pseudo_counts = random_pseudo_counts(rng)
+    expected_idx, expected_pragmatic, expected_epistemic = select_action_plan(
+        pseudo_counts=pseudo_counts,
+        pos_idx=0,
+        t_idx=0,
+        action_plans=action_plans,
+        order_independent=True)
+    DECISION_CACHE.clear()
+    # No time limit: same as the usual selection
+    idx, pragmatic, epistemic, coverage = select_action_plan_anytime(
+        pseudo_counts=pseudo_counts,
+        pos_idx=0,
+        t_idx=0,
+        action_plans=action_plans,
+        budget=None,
+        chunk_size=10)
+    assert coverage == 1
+    assert idx == expected_idx
+    assert np.allclose(pragmatic, expected_pragmatic)
+    assert np.allclose(epistemic, expected_epistemic)
+    DECISION_CACHE.clear()
+    # No time at all: only the first chunk is evaluated
+    idx, pragmatic, epistemic, coverage = select_action_plan_anytime(
+        pseudo_counts=pseudo_counts,
+        pos_idx=0,
+        t_idx=0,
+        action_plans=action_plans,
+        budget=0,
+        chunk_size=10)
+    assert coverage == 10 / len(action_plans)
+    assert np.sum(~np.isnan(pragmatic)) == 10
+    assert not np.isnan(pragmatic[idx])
+    assert np.allclose(pragmatic[~np.isnan(pragmatic)], expected_pragmatic[~np.isnan(pragmatic)])
+
+
+def test_branch_and_bound_is_exact():
+    rng = np.random.default_rng(SEED)
+    strategies, related_timesteps = make_challenge_windows(starts=(4, 9, 14, 19), window=4, duration=1)
+    structured_action_plans = enumerate_action_plans(strategies, related_timesteps, 0)
+    n_pruned = 0
+    for n_obs in (0, 50, 500, 5000):
+        pseudo_counts = random_pseudo_counts(rng, n_obs=n_obs)
+        for action_plans, t_idx in (
+                (structured_action_plans, 0),
+                (structured_action_plans[:, 6:], 6),
+                (rng.integers(2, size=(200, 10)), 14)):
+            pos_idx = rng.integers(POSITION.size)
+            expected_idx, expected_pragmatic, expected_epistemic = select_action_plan(
+                pseudo_counts=pseudo_counts,
+                pos_idx=pos_idx,
+                t_idx=t_idx,
+                action_plans=action_plans,
+                order_independent=True)
+            idx, pragmatic, epistemic, stats = select_action_plan_branch_and_bound(
+                pseudo_counts=pseudo_counts,
+                pos_idx=pos_idx,
+                t_idx=t_idx,
+                action_plans=action_plans)
+            assert idx == expected_idx
+            is_evaluated = ~np.isnan(pragmatic)
+            assert np.allclose(pragmatic[is_evaluated], expected_pragmatic[is_evaluated])
+            assert np.allclose(epistemic[is_evaluated], expected_epistemic[is_evaluated])
+            assert stats["n_visited"] + stats["n_pruned"] == stats["n_nodes"]
+            n_pruned += stats["n_pruned"]
+    assert n_pruned > 0
+
+
+def test_streaming_selection():
+    rng = np.random.default_rng(SEED)
+    strategies, related_timesteps = make_challenge_windows(starts=(4, 9, 14, 19), window=4, duration=1)
+    structured_action_plans = enumerate_action_plans(strategies, related_timesteps, 0)
+    for n_obs in (0, 500):
+        pseudo_counts = random_pseudo_counts(rng, n_obs=n_obs)
+        # Duplicates make ties between chunks
+        for action_plans in (structured_action_plans, np.vstack((structured_action_plans[:20],) * 3)):
+            expected_idx, expected_pragmatic, expected_epistemic = select_action_plan(
+                pseudo_counts=pseudo_counts,
+                pos_idx=0,
+                t_idx=0,
+                action_plans=action_plans,
+                order_independent=True)
+            for chunk_size in (1, 7, len(action_plans)):
+                action_plan, pragmatic, epistemic = select_action_plan_streaming(
+                    pseudo_counts=pseudo_counts,
+                    pos_idx=0,
+                    t_idx=0,
+                    action_plan_chunks=(
+                        action_plans[start:start+chunk_size]
+                        for start in range(0, len(action_plans), chunk_size)))
+                assert np.array_equal(action_plan, action_plans[expected_idx])
+                assert np.isclose(pragmatic, expected_pragmatic[expected_idx])
+                assert np.isclose(epistemic, expected_epistemic[expected_idx])
+    assert select_action_plan_streaming(
+        pseudo_counts=pseudo_counts,
+        pos_idx=0,
+        t_idx=0,
+        action_plan_chunks=iter(()))[0] is None
+
+
+def main():
+    test_beam_search_single_challenge_is_exact()
+    test_beam_search_full_beam_is_exact()
+    test_beam_search_is_approximate()
+    test_beam_search_small_beam()
+    test_factorized_plans_one_challenge_at_a_time()
+    test_anytime_selection()
+    test_branch_and_bound_is_exact()
+    test_streaming_selection()
+    print("All good!")
+
+
+if __name__ == "__main__":
+    main()
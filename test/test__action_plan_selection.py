@@ -0,0 +1,304 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+import numpy as np
+
+from MAppServer.settings import (
+    TIMESTEP,
+    POSITION,
+    TEST_FIRST_CHALLENGE_OFFER
+)
+from core.action_plan_generation import get_possible_action_plans, get_challenges
+from core.action_plan_selection import (
+    select_action_plan,
+    evaluate_action_plans,
+    evaluate_action_plans_trie,
+    evaluate_action_plans_all_positions,
+    compute_policy_table,
+    select_action_plan_from_policy_table,
+    select_action_plan_for_each_gamma,
+    compute_expected_free_energy,
+    choose_best_action_plan,
+    normalize_last_dim
+)
+from core.action_plan_trie import build_action_plan_trie
+from core.decision_cache import DecisionCache
+from core.pseudo_count_model import PseudoCountModel
+from test.assistant_model.pseudo_counts import random_pseudo_counts
+from test.assistant_model.baseline_selection import select_action_plan_baseline
+from test.run.assistant_model import test_assistant_model as run_assistant_model
+
+
+SEED = 123
+
+
+def random_action_plans(rng, n_action_plan, h):
+    return rng.integers(2, size=(n_action_plan, h))
+
+
+def test_select_action_plan_matches_baseline():
+    rng = np.random.default_rng(SEED)
+    challenges = get_challenges(start_time=TEST_FIRST_CHALLENGE_OFFER)
+    possible_action_plans = get_possible_action_plans(challenges=challenges)
+    for n_obs in (0, 10, 500):
+        pseudo_counts = random_pseudo_counts(rng, n_obs=n_obs)
+        for t_idx in (0, 7, TIMESTEP.size - 1):
+            h = TIMESTEP.size - t_idx
+            pos_idx = rng.integers(POSITION.size)
+            for action_plans in (
+                    random_action_plans(rng, n_action_plan=64, h=h),
+                    possible_action_plans[:, t_idx:]):
+                expected = select_action_plan_baseline(
+                    pseudo_counts=pseudo_counts,
+                    pos_idx=pos_idx,
+                    t_idx=t_idx,
+                    action_plans=action_plans)
+                result = select_action_plan(
+                    pseudo_counts=pseudo_counts,
+                    pos_idx=pos_idx,
+                    t_idx=t_idx,
+                    action_plans=action_plans,
+                    order_independent=False)
+                assert result[0] == expected[0], (result[0], expected[0])
+                for e, r in zip(expected[1:], result[1:]):
+                    assert np.allclose(e, r), (e, r)
+
+
+def test_evaluate_action_plans_trie_matches_batch():
+    rng = np.random.default_rng(SEED)
+    pseudo_counts = random_pseudo_counts(rng)
+    for t_idx in (0, 7, TIMESTEP.size - 1):
+        h = TIMESTEP.size - t_idx
+        # Random plans share only short prefixes, so also test plans that share a lot
+        action_plans = np.vstack((
+            random_action_plans(rng, n_action_plan=64, h=h),
+            np.tril(np.ones((h, h), dtype=int))[::-1]))
+        pos_idx = rng.integers(POSITION.size)
+        expected = evaluate_action_plans(
+            pseudo_counts=pseudo_counts,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans,
+            order_independent=True)
+        result = evaluate_action_plans_trie(
+            pseudo_counts=pseudo_counts,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans)
+        for e, r in zip(expected, result):
+            assert np.allclose(e, r), (e, r)
+
+
+def test_action_plan_trie_shares_prefixes():
+    challenges = get_challenges(start_time=TEST_FIRST_CHALLENGE_OFFER)
+    action_plans = get_possible_action_plans(challenges=challenges)
+    trie = build_action_plan_trie(action_plans)
+    n_action_plan, h = action_plans.shape
+    assert trie.depth == h
+    # Unique plans end in unique leaves
+    assert np.unique(trie.leaves).size == np.unique(action_plans, axis=0).shape[0]
+    # Plans are all zeros until the first challenge
+    first_differing_step = np.argmax(np.any(action_plans != action_plans[0], axis=0))
+    assert trie.n_nodes <= first_differing_step + n_action_plan * (h - first_differing_step)
+
+
+def test_select_action_plan_does_not_depend_on_order():
+    rng = np.random.default_rng(SEED)
+    pseudo_counts = random_pseudo_counts(rng)
+    challenges = get_challenges(start_time=TEST_FIRST_CHALLENGE_OFFER)
+    action_plans = get_possible_action_plans(challenges=challenges)
+    _, pragmatic, epistemic = select_action_plan(
+        pseudo_counts=pseudo_counts,
+        pos_idx=0,
+        t_idx=0,
+        action_plans=action_plans,
+        order_independent=True)
+    _, pragmatic_rev, epistemic_rev = select_action_plan(
+        pseudo_counts=pseudo_counts,
+        pos_idx=0,
+        t_idx=0,
+        action_plans=action_plans[::-1],
+        order_independent=True)
+    assert np.allclose(pragmatic, pragmatic_rev[::-1])
+    assert np.allclose(epistemic, epistemic_rev[::-1])
+
+
+def test_policy_table_matches_single_position():
+    rng = np.random.default_rng(SEED)
+    pseudo_counts = random_pseudo_counts(rng)
+    t_idx = 5
+    action_plans = random_action_plans(rng, n_action_plan=32, h=TIMESTEP.size - t_idx)
+    pragmatic, epistemic = evaluate_action_plans_all_positions(
+        pseudo_counts=pseudo_counts,
+        t_idx=t_idx,
+        action_plans=action_plans)
+    assert pragmatic.shape == epistemic.shape == (POSITION.size, action_plans.shape[0])
+    policy_table = compute_policy_table(
+        pseudo_counts=pseudo_counts,
+        t_idx=t_idx,
+        action_plans=action_plans)
+    for pos_idx in range(POSITION.size):
+        expected = evaluate_action_plans(
+            pseudo_counts=pseudo_counts,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans,
+            order_independent=True)
+        assert np.allclose(expected[0], pragmatic[pos_idx])
+        assert np.allclose(expected[1], epistemic[pos_idx])
+        best_idx, _, _ = select_action_plan(
+            pseudo_counts=pseudo_counts,
+            pos_idx=pos_idx,
+            t_idx=t_idx,
+            action_plans=action_plans,
+            order_independent=True)
+        assert best_idx == select_action_plan_from_policy_table(
+            policy_table=policy_table,
+            pos_idx=pos_idx)
+
+
+def test_decision_cache():
+    rng = np.random.default_rng(SEED)
+    cache = DecisionCache(max_size=2)
+    pseudo_counts = random_pseudo_counts(rng)
+    action_plans = random_action_plans(rng, n_action_plan=8, h=TIMESTEP.size)
+    n_compute = 0
+
+    def compute():
+        nonlocal n_compute
+        n_compute += 1
+        return evaluate_action_plans(
+            pseudo_counts=pseudo_counts,
+            pos_idx=0,
+            t_idx=0,
+            action_plans=action_plans)
+
+    key = DecisionCache.make_key(
+        model=PseudoCountModel(pseudo_counts), pos_idx=0, t_idx=0, action_plans=action_plans)
+    # Same content, different objects
+    same_key = DecisionCache.make_key(
+        model=PseudoCountModel(pseudo_counts.copy()), pos_idx=0, t_idx=0, action_plans=action_plans.copy())
+    assert key == same_key
+    value = cache.get_or_compute(key, compute)
+    cached_value = cache.get_or_compute(same_key, compute)
+    assert n_compute == 1
+    assert all(np.array_equal(v, c) for v, c in zip(value, cached_value))
+    # Fill the cache so that the first entry is evicted
+    for t_idx in (1, 2):
+        other_key = DecisionCache.make_key(
+            model=PseudoCountModel(pseudo_counts), pos_idx=0, t_idx=t_idx, action_plans=action_plans)
+        cache.get_or_compute(other_key, compute)
+    cache.get_or_compute(key, compute)
+    assert n_compute == 4
+    assert cache.stats() == {"hits": 1, "misses": 4, "size": 2, "max_size": 2}
+
+
+def test_pseudo_count_model_matches_pseudo_counts():
+    rng = np.random.default_rng(SEED)
+    pseudo_counts = random_pseudo_counts(rng, n_obs=50)
+    model = PseudoCountModel(pseudo_counts)
+    assert model.qt.shape == model.w.shape == pseudo_counts.shape
+    assert np.allclose(model.qt.sum(axis=-1), 1)
+    # The model does not change when the pseudo-counts it was built from are updated
+    pseudo_counts_before = pseudo_counts.copy()
+    pseudo_counts[0, 0, 0, 0] += 1
+    assert np.array_equal(model.pseudo_counts, pseudo_counts_before)
+    action_plans = random_action_plans(rng, n_action_plan=32, h=TIMESTEP.size - 3)
+    _, *expected = select_action_plan_baseline(
+        pseudo_counts=pseudo_counts_before,
+        pos_idx=2,
+        t_idx=3,
+        action_plans=action_plans)
+    result = evaluate_action_plans(
+        pseudo_counts=model,
+        pos_idx=2,
+        t_idx=3,
+        action_plans=action_plans,
+        order_independent=False)
+    for e, r in zip(expected, result):
+        assert np.allclose(e, r), (e, r)
+    expected = evaluate_action_plans(
+        pseudo_counts=pseudo_counts_before,
+        pos_idx=2,
+        t_idx=3,
+        action_plans=action_plans,
+        order_independent=True)
+    result = evaluate_action_plans_trie(
+        pseudo_counts=model,
+        pos_idx=2,
+        t_idx=3,
+        action_plans=action_plans)
+    for e, r in zip(expected, result):
+        assert np.allclose(e, r), (e, r)
+
+
+def test_pseudo_count_model_observe():
+    rng = np.random.default_rng(SEED)
+    pseudo_counts = random_pseudo_counts(rng, n_obs=50)
+    model = PseudoCountModel(pseudo_counts)
+    n_action, n_timestep, n_position, _ = pseudo_counts.shape
+    for _ in range(200):
+        action, t_idx, pos_idx, new_pos_idx = (
+            rng.integers(n) for n in (n_action, n_timestep, n_position, n_position))
+        digest = model.digest
+        model.observe(action=action, t_idx=t_idx, pos_idx=pos_idx, new_pos_idx=new_pos_idx)
+        pseudo_counts[action, t_idx, pos_idx, new_pos_idx] += 1
+        assert model.digest != digest
+    # Same as a model built from scratch from the same pseudo-counts
+    expected = PseudoCountModel(pseudo_counts)
+    for var in ("pseudo_counts", "sums", "qt", "w", "w_visited"):
+        assert np.array_equal(getattr(model, var), getattr(expected, var)), var
+    assert model.digest == expected.digest
+    transition = normalize_last_dim(random_pseudo_counts(rng, n_obs=50))
+    assert model.mean_absolute_error(transition) == np.mean(np.absolute(transition - normalize_last_dim(pseudo_counts)))
+
+
+def test_select_action_plan_for_each_gamma():
+    rng = np.random.default_rng(SEED)
+    pseudo_counts = random_pseudo_counts(rng, n_obs=50)
+    action_plans = random_action_plans(rng, n_action_plan=64, h=TIMESTEP.size)
+    gammas = np.linspace(0, 10, 20)
+    best_idx, pragmatic, epistemic = select_action_plan_for_each_gamma(
+        pseudo_counts=pseudo_counts,
+        pos_idx=0,
+        t_idx=0,
+        action_plans=action_plans,
+        gammas=gammas)
+    assert best_idx.shape == gammas.shape
+    for idx, gamma in zip(best_idx, gammas):
+        efe = compute_expected_free_energy(pragmatic=pragmatic, epistemic=epistemic, gamma=gamma)
+        assert idx == choose_best_action_plan(efe=efe)
+
+
+def test_gamma_sweep_matches_separate_runs():
+    rng = np.random.default_rng(SEED)
+    transition = normalize_last_dim(random_pseudo_counts(rng, n_obs=500))
+    action_plans = random_action_plans(rng, n_action_plan=8, h=TIMESTEP.size)
+    gammas = [0., 1., 100.]
+    runs = run_assistant_model(transition=transition, action_plans=action_plans, gammas=gammas)
+    for gamma, run in zip(gammas, runs):
+        expected, = run_assistant_model(transition=transition, action_plans=action_plans, gammas=[gamma])
+        assert run["gamma"] == gamma
+        for var in ("error", "epistemic", "pragmatic", "position"):
+            assert np.array_equal(run[var], expected[var]), var
+
+
+def main():
+    test_select_action_plan_matches_baseline()
+    test_evaluate_action_plans_trie_matches_batch()
+    test_action_plan_trie_shares_prefixes()
+    test_select_action_plan_does_not_depend_on_order()
+    test_policy_table_matches_single_position()
+    test_decision_cache()
+    test_pseudo_count_model_matches_pseudo_counts()
+    test_pseudo_count_model_observe()
+    test_select_action_plan_for_each_gamma()
+    test_gamma_sweep_matches_separate_runs()
+    print("All good!")
+
+
+if __name__ == "__main__":
+    main()
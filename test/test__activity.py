@@ -0,0 +1,161 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+from datetime import datetime, time
+import numpy as np
+import pandas as pd
+
+from MAppServer.settings import TIMESTEP, POSITION, ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER
+from core.activity import (
+    extract_step_events,
+    extract_cumulative_steps,
+    step_events_to_cumulative_steps,
+    cum_steps_to_pos_idx,
+    build_pseudo_count_matrix,
+    add_to_pseudo_count_matrix,
+    initialize_pseudo_counts,
+    sort_records,
+    sum_steps_by_timestep,
+    timestep_increments_to_cumulative_steps
+)
+from test.activity.synthetic import random_activity
+from utils.constants import SECONDS_IN_A_DAY
+
+
+SEED = 123
+
+
+def extract_step_events_loop(step_counts, datetimes):
+    """Previous implementation, adding the step events one by one"""
+    all_dt = pd.DatetimeIndex(datetimes)
+    min_date = all_dt.min().date()
+    days = np.asarray([(dt.date() - min_date).days for dt in all_dt])
+    uniq_days = np.unique(days)
+    all_timestamp = np.asarray([
+        (dt - datetime.combine(dt, time.min, dt.tz)).total_seconds()
+        for dt in all_dt
+    ]) / SECONDS_IN_A_DAY
+    step_events = [[] for _ in range(uniq_days.size)]
+    for idx_day, day in enumerate(uniq_days):
+        is_day = days == day
+        obs_timestamp, obs_pos = all_timestamp[is_day], step_counts[is_day]
+        idx = np.argsort(obs_timestamp)
+        obs_timestamp, obs_pos = obs_timestamp[idx], obs_pos[idx]
+        for ts, dif in zip(obs_timestamp, np.diff(obs_pos)):
+            step_events[idx_day] += [ts for _ in range(dif)]
+    return step_events
+
+
+def cum_steps_to_pos_idx_argmin(cum_steps):
+    """Previous implementation, comparing each day to every position"""
+    all_v_idx = np.zeros_like(cum_steps, dtype=int)
+    for idx_day, act in enumerate(cum_steps):
+        all_v_idx[idx_day] = np.argmin(np.abs(POSITION[:, None] - act), axis=0)
+    return all_v_idx
+
+
+def build_pseudo_count_matrix_loop(actions, cum_steps, jitter, n_action=2):
+    """Previous implementation, looping over the days and the timesteps"""
+    all_idx = cum_steps_to_pos_idx_argmin(cum_steps=cum_steps)
+    pseudo_counts = initialize_pseudo_counts(jitter=jitter, n_action=n_action)
+    for day in range(cum_steps.shape[0]):
+        for t_idx in range(TIMESTEP.size):
+            pseudo_counts[actions[day, t_idx], t_idx, all_idx[day, t_idx], all_idx[day, t_idx + 1]] += 1
+    return pseudo_counts
+
+
+def random_cum_steps(rng, n_days):
+    steps = rng.integers(0, 1500, size=(n_days, TIMESTEP.size))
+    return np.hstack((np.zeros((n_days, 1), dtype=int), np.cumsum(steps, axis=1)))
+
+
+def test_extract_step_events_matches_loop():
+    rng = np.random.default_rng(SEED)
+    # Includes the change to summer time (31/03/2024)
+    step_counts, datetimes = random_activity(rng, n_days=40, n_records_per_day=50)
+    expected = extract_step_events_loop(step_counts=step_counts, datetimes=datetimes)
+    for dts in (datetimes, pd.Series(datetimes)):
+        result = extract_step_events(step_counts=step_counts, datetimes=dts)
+        assert len(result) == len(expected)
+        for e, r in zip(expected, result):
+            assert np.allclose(e, r)
+    # Remove the days without any step
+    step_counts[:] = 0
+    assert len(extract_step_events(step_counts=step_counts, datetimes=datetimes)) == len(expected)
+    assert len(extract_step_events(step_counts=step_counts, datetimes=datetimes, remove_empty_days=True)) == 0
+
+
+def test_extract_cumulative_steps_matches_step_events():
+    rng = np.random.default_rng(SEED)
+    step_counts, datetimes = random_activity(rng, n_days=40, n_records_per_day=50)
+    # Record exactly at the start of the first timestep
+    datetimes = datetimes.insert(0, datetimes[0].normalize())
+    step_counts = np.concatenate(([10], step_counts))
+    expected = step_events_to_cumulative_steps(
+        step_events=extract_step_events(step_counts=step_counts, datetimes=datetimes))
+    result, dates = extract_cumulative_steps(step_counts=step_counts, datetimes=datetimes, return_dates=True)
+    assert np.array_equal(result, expected)
+    assert np.array_equal(dates, np.unique(np.asarray(datetimes.tz_localize(None), dtype="datetime64[D]")))
+
+
+def test_steps_summed_by_timestep_match_cumulative_steps():
+    rng = np.random.default_rng(SEED)
+    # Including both days when the clocks change
+    step_counts, datetimes = random_activity(rng, n_days=250, n_records_per_day=50)
+    datetimes = datetimes.insert(0, datetimes[0].normalize())
+    step_counts = np.concatenate(([10], step_counts))
+    expected, expected_dates = extract_cumulative_steps(step_counts=step_counts, datetimes=datetimes, return_dates=True)
+    dates, t_bins, n_steps = sum_steps_by_timestep(step_counts=step_counts, datetimes=datetimes)
+    assert np.all(t_bins <= TIMESTEP.size) and np.any(t_bins == TIMESTEP.size)
+    result, result_dates = timestep_increments_to_cumulative_steps(dates=dates, t_bins=t_bins, n_steps=n_steps)
+    assert np.array_equal(result, expected)
+    assert np.array_equal(result_dates, expected_dates)
+    # Same timesteps with the formula used by the database
+    _, all_timestamp, _, _ = sort_records(step_counts=step_counts, datetimes=datetimes)
+    elapsed = all_timestamp * SECONDS_IN_A_DAY
+    assert np.array_equal(
+        np.ceil(elapsed * (TIMESTEP.size - 1) / SECONDS_IN_A_DAY),
+        np.searchsorted(TIMESTEP, all_timestamp, side="left"))
+    # Without any record
+    result, result_dates = timestep_increments_to_cumulative_steps(dates=[], t_bins=[], n_steps=[])
+    assert result.shape == (0, TIMESTEP.size+1) and result_dates.size == 0
+
+
+def test_build_pseudo_count_matrix_matches_loop():
+    rng = np.random.default_rng(SEED)
+    cum_steps = random_cum_steps(rng, n_days=500)
+    # Including the steps exactly between two positions
+    cum_steps[0, 1:] = (POSITION[1:] + POSITION[:-1]).repeat(3)[:TIMESTEP.size] / 2
+    actions = rng.integers(2, size=(500, TIMESTEP.size))
+    assert np.array_equal(cum_steps_to_pos_idx(cum_steps), cum_steps_to_pos_idx_argmin(cum_steps))
+    expected = build_pseudo_count_matrix_loop(
+        actions=actions, cum_steps=cum_steps, jitter=ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER)
+    result = build_pseudo_count_matrix(
+        actions=actions, cum_steps=cum_steps, jitter=ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER)
+    assert np.array_equal(result, expected)
+    # Adding the days in several times
+    result = initialize_pseudo_counts(jitter=ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER)
+    for start, end in ((0, 100), (100, 101), (101, 101), (101, 500)):
+        add_to_pseudo_count_matrix(pseudo_counts=result, actions=actions[start:], cum_steps=cum_steps[start:end])
+    assert np.array_equal(result, expected)
+    # No data
+    result = build_pseudo_count_matrix(
+        actions=np.zeros((0, TIMESTEP.size), dtype=int),
+        cum_steps=np.empty((0, TIMESTEP.size + 1)),
+        jitter=ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER)
+    assert np.array_equal(result, initialize_pseudo_counts(ACTIVE_INFERENCE_PSEUDO_COUNT_JITTER))
+
+
+def main():
+    test_extract_step_events_matches_loop()
+    test_extract_cumulative_steps_matches_step_events()
+    test_steps_summed_by_timestep_match_cumulative_steps()
+    test_build_pseudo_count_matrix_matches_loop()
+    print("All good!")
+
+
+if __name__ == "__main__":
+    main()
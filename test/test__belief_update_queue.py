@@ -0,0 +1,197 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from MAppServer.settings import BELIEF_UPDATE_BROKER, BELIEF_UPDATE_REDIS_URL
+from assistant.belief_update_queue import (
+    BeliefUpdateQueue,
+    LocalBroker,
+    LocalPendingJobs,
+    RedisPendingJobs,
+    LOGGER
+)
+
+
+TIMEOUT = 10
+
+
+@contextmanager
+def no_file_logging(logger):
+    """Keep the logs of the test (e.g. the failures on purpose) out of LOG_DIR"""
+    file_handlers = [h for h in logger.handlers if isinstance(h, logging.FileHandler)]
+    for handler in file_handlers:
+        logger.removeHandler(handler)
+    try:
+        yield
+    finally:
+        for handler in file_handlers:
+            logger.addHandler(handler)
+
+
+class FakeUpdate:
+    """Records the updates instead of doing them (and the ones run at the same time for a user).
+    The ones whose `now` is in `blocking` wait until they are released"""
+    def __init__(self, blocking=()):
+        self.blocking = set(blocking)
+        self.calls = []
+        self.overlaps = []
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, user_id, now):
+        with self._lock:
+            if user_id in self._running:
+                self.overlaps.append((user_id, now))
+            self._running.add(user_id)
+            self.calls.append((user_id, now))
+        try:
+            if now in self.blocking:
+                self.started.set()
+                assert self.released.wait(TIMEOUT)
+            if now.startswith("fail"):
+                raise ValueError("Failing on purpose")
+        finally:
+            with self._lock:
+                self._running.discard(user_id)
+
+
+def check_pending_jobs(pending):
+    """Jobs of the users -1 and -2 (none at the start)"""
+    n_pending = len(pending)
+    now = time.time()
+    assert pending.add(user_id=-1, now="a", enqueued_at=now) == (True, True)
+    assert pending.add(user_id=-1, now="b", enqueued_at=now + 1) == (False, False)
+    assert pending.add(user_id=-2, now=None, enqueued_at=now + 2) == (True, True)
+    assert len(pending) == n_pending + 2
+    # The last `now`, but the time of the first request
+    assert pending.start(-1) == {"now": "b", "enqueued_at": now}
+    assert pending.start(-1) is None
+    assert len(pending) == n_pending + 1
+    # Requested while running: waits until the running one is done
+    assert pending.add(user_id=-1, now="c", enqueued_at=now + 3) == (True, False)
+    assert pending.add(user_id=-1, now="d", enqueued_at=now + 4) == (False, False)
+    assert len(pending) == n_pending + 2
+    assert pending.start(-1) is None
+    assert pending.finish(-1)
+    assert pending.start(-1) == {"now": "d", "enqueued_at": now + 3}
+    assert not pending.finish(-1)
+    assert pending.start(-2) == {"now": None, "enqueued_at": now + 2}
+    assert not pending.finish(-2)
+    assert len(pending) == n_pending
+
+
+def test_local_pending_jobs():
+    check_pending_jobs(LocalPendingJobs())
+
+
+def test_pending_jobs_are_deduplicated():
+    update = FakeUpdate(blocking={"a"})
+    broker = LocalBroker(n_workers=1)
+    q = BeliefUpdateQueue(broker=broker, update=update)
+    # The request returns before the update is done
+    assert q.enqueue(user_id=1, now="a")
+    assert update.started.wait(TIMEOUT)
+    assert q.stats()["queue_depth"] == 0
+    # A job can be added while the update of the same user is running...
+    assert q.enqueue(user_id=1, now="b")
+    # ...but only one can be waiting: the next requests only update it
+    assert not q.enqueue(user_id=1, now="c")
+    assert q.enqueue(user_id=2, now="x")
+    assert q.stats()["queue_depth"] == 2
+    update.released.set()
+    broker.join()
+    assert update.calls == [(1, "a"), (2, "x"), (1, "c")]
+    stats = q.stats()
+    assert stats["queue_depth"] == 0
+    assert (stats["enqueued"], stats["deduplicated"], stats["done"], stats["failed"]) == (4, 1, 3, 0)
+    assert stats["latency_max"] >= stats["latency_mean"] >= stats["run_time_mean"] >= 0
+    # A failing update does not stop the workers
+    with no_file_logging(LOGGER):
+        assert q.enqueue(user_id=3, now="fail")
+        broker.join()
+    assert q.enqueue(user_id=3, now="d")
+    broker.join()
+    assert update.calls[-2:] == [(3, "fail"), (3, "d")]
+    stats = q.stats()
+    assert (stats["done"], stats["failed"]) == (5, 1)
+
+
+def test_requests_while_running_are_not_lost():
+    for first in ("a", "fail"):
+        update = FakeUpdate(blocking={first})
+        # A worker is free to take a second job of the user
+        broker = LocalBroker(n_workers=2)
+        q = BeliefUpdateQueue(broker=broker, update=update)
+        assert q.enqueue(user_id=1, now=first)
+        assert update.started.wait(TIMEOUT)
+        assert q.enqueue(user_id=1, now="b")
+        assert not q.enqueue(user_id=1, now="c")
+        assert q.stats()["queue_depth"] == 1
+        # It does not start before the running one is done...
+        time.sleep(0.1)
+        assert update.calls == [(1, first)]
+        # ...whether it succeeds or not
+        with no_file_logging(LOGGER):
+            update.released.set()
+            broker.join()
+        assert update.calls == [(1, first), (1, "c")]
+        assert update.overlaps == []
+        stats = q.stats()
+        assert (stats["queue_depth"], stats["done"], stats["failed"]) == (0, 2, first == "fail")
+
+
+def test_redis_pending_jobs():
+    # Only with the "celery" broker, and a Redis server
+    import pytest
+    if BELIEF_UPDATE_BROKER != "celery":
+        pytest.skip("The pending jobs are only shared through Redis by the 'celery' broker")
+    redis = pytest.importorskip("redis")
+    try:
+        redis.Redis.from_url(BELIEF_UPDATE_REDIS_URL).ping()
+    except redis.exceptions.ConnectionError:
+        pytest.skip(f"No Redis server at {BELIEF_UPDATE_REDIS_URL}")
+    pending = RedisPendingJobs(timeout=60)
+    user_ids = (-1, -2)
+    for user_id in user_ids:
+        pending.redis.delete(pending.key(user_id))
+        pending.redis.zrem(pending.INDEX_KEY, user_id)
+    check_pending_jobs(pending)
+    # Concurrent requests for the same user add a single job, with one of their `now`
+    barrier = threading.Barrier(8)
+    is_new = []
+
+    def add(i):
+        barrier.wait()
+        is_new.append(pending.add(user_id=-1, now=str(i), enqueued_at=time.time())[0])
+
+    threads = [threading.Thread(target=add, args=(i, )) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(is_new) == 1
+    assert pending.start(-1)["now"] in [str(i) for i in range(8)]
+    assert not pending.finish(-1)
+
+
+def main():
+    test_local_pending_jobs()
+    test_pending_jobs_are_deduplicated()
+    test_requests_while_running_are_not_lost()
+    if BELIEF_UPDATE_BROKER == "celery":
+        # Needs a Redis server
+        test_redis_pending_jobs()
+    print("All good!")
+
+
+if __name__ == "__main__":
+    main()
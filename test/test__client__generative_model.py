@@ -23,12 +23,12 @@ from MAppServer.settings import (
     USE_PROGRESS_BAR
 )
 from user.models import User
-from assistant.tasks import read_activities_and_extract_step_events
+from assistant.tasks import read_activities_and_extract_cumulative_steps
 from core.action_plan_selection import make_a_step
 from test.plot import plot
 from test.user_simulation import creation, websocket_client
 from test.generative_model.core import generative_model
-from core.activity import extract_actions, step_events_to_cumulative_steps
+from core.activity import extract_actions
 from core.action_plan_generation import get_possible_action_plans, get_challenges
 from core.timestep_and_datetime import get_timestep_from_datetime
 
@@ -158,8 +158,7 @@ def run():
 def plot_day_progression():
 
     u = User.objects.filter(username=TEST_USERNAME).first()
-    step_events, _ = read_activities_and_extract_step_events(u=u)
-    cum_steps = step_events_to_cumulative_steps(step_events=step_events)
+    cum_steps, _ = read_activities_and_extract_cumulative_steps(u=u)
     af_run = {
         "position": cum_steps
     }
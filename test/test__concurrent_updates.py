@@ -0,0 +1,143 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+import threading
+import numpy as np
+from django.db import connection, transaction, IntegrityError
+
+from assistant.models import ActionPlan
+from assistant.tasks import update_beliefs_and_challenges
+from assistant.user_lock import lock_belief_update, lock_belief_update_in_process
+from test.test__user_snapshot import create_user_with_activity
+
+
+SEED = 123
+N_CLIENTS = 8
+TIMEOUT = 60
+
+
+def run_concurrently(target, n_threads):
+    """Run `target` in several threads started at the same time, each with its own connection"""
+    barrier = threading.Barrier(n_threads)
+    errors = []
+
+    def run():
+        try:
+            barrier.wait(TIMEOUT)
+            target()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run) for _ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(TIMEOUT)
+    assert not errors, errors
+
+
+def test_concurrent_clients_take_a_single_decision():
+    rng = np.random.default_rng(SEED)
+    u, now = create_user_with_activity(rng, n_days=5)
+    now_str = now.strftime("%d/%m/%Y %H:%M:%S")
+    run_concurrently(lambda: update_beliefs_and_challenges(u=u, now=now_str), n_threads=N_CLIENTS)
+    action_plans = ActionPlan.objects.filter(user=u, date=now.date())
+    assert action_plans.count() == 1, action_plans.count()
+    # The challenges are the ones of the decision recorded
+    challenges = list(u.challenge_set.filter(dt_begin__date=now.date()).order_by("pk").values_list(
+        "pk", "dt_begin", "server_tag"))
+    # The next requests of the day find the decision already taken
+    run_concurrently(lambda: update_beliefs_and_challenges(u=u, now=now_str), n_threads=N_CLIENTS)
+    assert action_plans.count() == 1
+    assert list(u.challenge_set.filter(dt_begin__date=now.date()).order_by("pk").values_list(
+        "pk", "dt_begin", "server_tag")) == challenges
+    u.delete()
+
+
+def test_lock_is_exclusive():
+    rng = np.random.default_rng(SEED)
+    u, _ = create_user_with_activity(rng, n_days=1)
+    is_locked_elsewhere = []
+
+    def try_lock():
+        with lock_belief_update(u, blocking=False) as is_locked:
+            is_locked_elsewhere.append(is_locked)
+
+    with lock_belief_update(u, blocking=False) as is_locked:
+        assert is_locked
+        # Another client (with another connection) can not take it...
+        run_concurrently(try_lock, n_threads=1)
+    # ...until it is released
+    run_concurrently(try_lock, n_threads=1)
+    assert is_locked_elsewhere == [False, True]
+    u.delete()
+
+
+def test_waiting_update_runs_after_a_failure():
+    # Without PostgreSQL (no database needed)
+    user_id = -1
+    started = threading.Event()
+    released = threading.Event()
+    events = []
+
+    def failing_update():
+        with lock_belief_update_in_process(user_id) as is_locked:
+            assert is_locked
+            started.set()
+            assert released.wait(TIMEOUT)
+            events.append("failed")
+            raise ValueError("Failing on purpose")
+
+    def waiting_update():
+        assert started.wait(TIMEOUT)
+        with lock_belief_update_in_process(user_id) as is_locked:
+            events.append(("ran", is_locked))
+
+    def run(target):
+        try:
+            target()
+        except ValueError:
+            pass
+
+    threads = [threading.Thread(target=run, args=(target, )) for target in (failing_update, waiting_update)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(TIMEOUT)
+    # Without waiting, it is not taken
+    with lock_belief_update_in_process(user_id, blocking=False) as is_locked:
+        assert not is_locked
+    released.set()
+    for thread in threads:
+        thread.join(TIMEOUT)
+    # The update waiting for the lock is not dropped, although the running one has failed
+    assert events == ["failed", ("ran", True)], events
+
+
+def test_one_action_plan_per_day():
+    rng = np.random.default_rng(SEED)
+    u, now = create_user_with_activity(rng, n_days=1)
+    ActionPlan.objects.create(user=u, date=now.date(), value=[0], packed_value=[0])
+    try:
+        with transaction.atomic():
+            ActionPlan.objects.create(user=u, date=now.date(), value=[1], packed_value=[1])
+        raise AssertionError("A second action plan has been recorded for the same day")
+    except IntegrityError:
+        pass
+    u.delete()
+
+
+def main():
+    test_concurrent_clients_take_a_single_decision()
+    test_lock_is_exclusive()
+    test_waiting_update_runs_after_a_failure()
+    test_one_action_plan_per_day()
+    print("All good!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from pytz import timezone
+
+from MAppServer.settings import TIME_ZONE, TIMESTEP
+from core.timestep_and_datetime import (
+    get_timestep_from_datetime,
+    get_datetime_from_timestep,
+    datetimes_to_epochs,
+    get_local_dates_from_epochs,
+    get_timesteps_from_epochs,
+    get_epochs_from_timesteps
+)
+
+
+SEED = 123
+
+
+def random_epochs(rng, n, start="2023-01-01", n_days=800):
+    """Random epochs (in seconds), with some of them around the changes of the clocks"""
+    start = int(datetime.fromisoformat(start).replace(tzinfo=dt_timezone.utc).timestamp())
+    epochs = start + rng.integers(n_days * 86400, size=n)
+    # Around each change of the clocks of the period
+    tz = timezone(TIME_ZONE)
+    changes = [
+        int((t - datetime(1970, 1, 1)).total_seconds()) for t in tz._utc_transition_times
+        if start <= (t - datetime(1970, 1, 1)).total_seconds() < start + n_days * 86400]
+    assert len(changes) > 0
+    around = np.concatenate([change + np.arange(-7200, 7200, 30) for change in changes])
+    return np.concatenate((epochs, around))
+
+
+def test_timesteps_from_epochs_match_single_datetime():
+    rng = np.random.default_rng(SEED)
+    epochs = random_epochs(rng, n=5000)
+    tz = timezone(TIME_ZONE)
+    dts = [datetime.fromtimestamp(int(e), tz=dt_timezone.utc).astimezone(tz) for e in epochs]
+    assert np.array_equal(datetimes_to_epochs(dts), epochs)
+    expected = np.asarray([get_timestep_from_datetime(dt) for dt in dts])
+    assert np.array_equal(get_timesteps_from_epochs(epochs), expected)
+    expected = np.asarray([dt.date() for dt in dts], dtype="datetime64[D]")
+    assert np.array_equal(get_local_dates_from_epochs(epochs), expected)
+
+
+def test_epochs_from_timesteps_match_single_timestep():
+    tz = timezone(TIME_ZONE)
+    # Every day of a year, including the days when the clocks change
+    dates = np.arange(np.datetime64("2024-01-01"), np.datetime64("2025-01-01"))
+    timesteps = np.arange(TIMESTEP.size)
+    epochs = get_epochs_from_timesteps(timesteps=timesteps[np.newaxis, :], dates=dates[:, np.newaxis])
+    assert epochs.shape == (dates.size, timesteps.size)
+    for date, epochs_for_date in zip(dates, epochs):
+        now = datetime.fromisoformat(str(date))
+        expected = [
+            int(tz.localize(get_datetime_from_timestep(t, now=now), is_dst=False).timestamp())
+            for t in timesteps]
+        assert np.array_equal(epochs_for_date, expected), date
+    # Back to the same timesteps, except for the times that do not exist
+    dts = [datetime.fromtimestamp(int(e), tz=dt_timezone.utc).astimezone(tz) for e in epochs.ravel()]
+    exists = np.asarray([dt.hour == int(t) for dt, t in zip(dts, np.tile(timesteps, dates.size))])
+    assert np.mean(exists) > 0.99
+    assert np.array_equal(get_timesteps_from_epochs(epochs).ravel()[exists], np.tile(timesteps, dates.size)[exists])
+
+
+def test_challenge_timesteps_match_single_datetime():
+    tz = timezone(TIME_ZONE)
+    start = tz.localize(datetime(2024, 3, 30, 6, 0))
+    dts = [start + timedelta(hours=h) for h in range(0, 72, 5)]
+    expected = [get_timestep_from_datetime(dt) for dt in dts]
+    assert np.array_equal(get_timesteps_from_epochs(datetimes_to_epochs(dts)), expected)
+
+
+def main():
+    test_timesteps_from_epochs_match_single_datetime()
+    test_epochs_from_timesteps_match_single_timestep()
+    test_challenge_timesteps_match_single_datetime()
+    print("All good!")
+
+
+if __name__ == "__main__":
+    main()
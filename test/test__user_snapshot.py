@@ -0,0 +1,180 @@
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "MAppServer.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+from datetime import datetime, time, timedelta
+import numpy as np
+import pandas as pd
+from pytz import timezone
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from MAppServer.settings import (
+    TIME_ZONE,
+    TIMESTEP,
+    POSITION,
+    INIT_POS_IDX,
+    TEST_USERNAME,
+    TEST_EXPERIMENT_NAME,
+    TEST_FIRST_CHALLENGE_OFFER
+)
+from user.models import Activity
+from assistant.models import PseudoCounts
+from assistant.tasks import update_beliefs_and_challenges
+from assistant.user_snapshot import (
+    load_user_snapshot,
+    read_activities,
+    records_to_cumulative_steps,
+    to_datetime64
+)
+from assistant.pseudo_count_store import read_completed_days, get_pseudo_counts, compute_pseudo_counts
+from assistant.activity_binning import (
+    can_sum_steps_in_database,
+    sum_steps_by_timestep_in_database,
+    read_cumulative_steps
+)
+from core.activity import extract_actions, sum_steps_by_timestep
+from core.timestep_and_datetime import get_timestep_from_datetime
+from test.activity.synthetic import random_activity
+from test.user_simulation import creation
+
+
+SEED = 123
+USERNAME = f"{TEST_USERNAME}-snapshot"
+STARTING_DATE = "01/03/2024"
+
+
+def get_future_challenges_orm(u, now):
+    """Previous implementation, with a query"""
+    return u.challenge_set.filter(dt_begin__date=now.date(), dt_offer_begin__gt=now).order_by('dt_earliest')
+
+
+def get_current_position_and_velocity_orm(u, now):
+    """Previous implementation, with a query"""
+    t_idx = get_timestep_from_datetime(now)
+    if t_idx == 0:
+        return INIT_POS_IDX, t_idx
+    start_of_day = datetime.combine(now, time.min, tzinfo=now.tzinfo)
+    last_act = u.activity_set.filter(dt__gt=start_of_day, dt__lt=now).order_by('dt').first()
+    if last_act is None:
+        return 0, t_idx
+    return np.argmin(POSITION - last_act.step_midnight), t_idx
+
+
+def create_user_with_activity(rng, n_days):
+    u = creation.create_test_user(
+        starting_date=STARTING_DATE,
+        username=USERNAME,
+        first_challenge_offer=TEST_FIRST_CHALLENGE_OFFER,
+        experiment_name=TEST_EXPERIMENT_NAME)
+    start = datetime.strptime(STARTING_DATE, "%d/%m/%Y")
+    # Up to the current day included
+    step_counts, datetimes = random_activity(rng, n_days=n_days + 1, start=start.strftime("%Y-%m-%d"))
+    Activity.objects.bulk_create([
+        Activity(user=u, dt=dt, step_midnight=int(n_steps))
+        for n_steps, dt in zip(step_counts, datetimes.to_pydatetime())])
+    now = timezone(TIME_ZONE).localize(start + timedelta(days=n_days, hours=5))
+    return u, now
+
+
+def check_snapshot(u, now):
+    with CaptureQueriesContext(connection) as queries:
+        snapshot = load_user_snapshot(u=u, now=now)
+    assert len(queries.captured_queries) == 3, len(queries.captured_queries)
+    assert snapshot.has_action_plan == u.actionplan_set.filter(date=now.date()).exists()
+    assert [ch.pk for ch in snapshot.get_later_challenges()] == \
+        list(get_future_challenges_orm(u, now).values_list("pk", flat=True))
+    assert sorted(ch.pk for ch in snapshot.get_today_challenges()) == \
+        sorted(u.challenge_set.filter(dt_begin__date=now.date()).values_list("pk", flat=True))
+    assert snapshot.get_current_position_and_timestep() == get_current_position_and_velocity_orm(u, now)
+    assert np.array_equal(snapshot.get_action_taken(), extract_actions(u=u, now=now))
+    assert np.array_equal(snapshot.get_actions(), extract_actions(u=u))
+    store = PseudoCounts.objects.filter(user=u).first()
+    after = None if store is None else store.last_date
+    cum_steps, dates = snapshot.get_completed_days(after=after)
+    expected_cum_steps, expected_dates = read_completed_days(u=u, today=now.date(), after=after)
+    assert np.array_equal(cum_steps, expected_cum_steps)
+    assert np.array_equal(dates, expected_dates)
+    if after is not None:
+        # The days already in the pseudo-counts have not been loaded
+        assert snapshot.get_completed_days() is None
+    return snapshot
+
+
+def test_user_snapshot_query_count():
+    rng = np.random.default_rng(SEED)
+    n_queries = []
+    for n_days in (3, 20):
+        u, now = create_user_with_activity(rng, n_days=n_days)
+        check_snapshot(u, now)
+        # The number of queries of the whole update does not depend on the amount of data
+        with CaptureQueriesContext(connection) as queries:
+            update_beliefs_and_challenges(u=u, now=now.strftime("%d/%m/%Y %H:%M:%S"))
+        n_queries.append(len(queries.captured_queries))
+        # Once the pseudo-counts are stored, only the days after them are loaded
+        check_snapshot(u, now)
+        u.delete()
+    assert n_queries[0] == n_queries[1], n_queries
+
+
+def test_steps_summed_in_database():
+    rng = np.random.default_rng(SEED)
+    # Including the day when the clocks go forward
+    u, now = create_user_with_activity(rng, n_days=40)
+    assert can_sum_steps_in_database()
+    activity_dt, step_counts = read_activities(u=u, before=now)
+    datetimes = pd.DatetimeIndex(activity_dt).tz_localize("UTC").tz_convert(TIME_ZONE)
+    expected = sum_steps_by_timestep(step_counts=step_counts, datetimes=datetimes)
+    result = sum_steps_by_timestep_in_database(u=u, before=now)
+    for e, r in zip(expected, result):
+        assert np.array_equal(e, r)
+    # Only a few numbers per day are read
+    assert len(result[0]) <= len(np.unique(expected[0])) * (TIMESTEP.size + 1)
+    cum_steps, dates = read_cumulative_steps(u=u, before=now)
+    expected_cum_steps, expected_dates = records_to_cumulative_steps(activity_dt=activity_dt, step_counts=step_counts)
+    assert np.array_equal(cum_steps, expected_cum_steps)
+    assert np.array_equal(dates, expected_dates)
+    # Only some of the days
+    after = now - timedelta(days=10)
+    cum_steps, dates = read_cumulative_steps(u=u, before=now, after=after)
+    keep = activity_dt >= to_datetime64([after])[0]
+    expected_cum_steps, expected_dates = records_to_cumulative_steps(
+        activity_dt=activity_dt[keep], step_counts=step_counts[keep])
+    assert np.array_equal(cum_steps, expected_cum_steps)
+    assert np.array_equal(dates, expected_dates)
+    u.delete()
+
+
+def test_late_activity_is_folded():
+    rng = np.random.default_rng(SEED)
+    u, now = create_user_with_activity(rng, n_days=10)
+    today = now.date()
+    pseudo_counts = get_pseudo_counts(u=u, today=today)
+    # Activity received late for a day already added to the pseudo-counts
+    late_day = now - timedelta(days=7)
+    last_act = u.activity_set.filter(dt__lt=late_day.replace(hour=23, minute=30)).order_by("dt").last()
+    Activity.objects.create(
+        user=u,
+        dt=late_day.replace(hour=23, minute=30),
+        step_midnight=last_act.step_midnight + 5000)
+    result = get_pseudo_counts(u=u, today=today)
+    expected, n_days, last_date = compute_pseudo_counts(u=u, today=today)
+    assert not np.array_equal(result, pseudo_counts)
+    assert np.array_equal(result, expected)
+    store = PseudoCounts.objects.get(user=u)
+    assert store.n_days == n_days and store.last_date == last_date
+    assert store.last_activity_id == u.activity_set.latest("pk").pk
+    u.delete()
+
+
+def main():
+    test_user_snapshot_query_count()
+    test_steps_summed_in_database()
+    test_late_activity_is_folded()
+    print("All good!")
+
+
+if __name__ == "__main__":
+    main()
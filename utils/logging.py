@@ -37,9 +37,9 @@ def get(name: str, level=logging.INFO) -> logging.Logger:
         # Add ch to logger
         logger.addHandler(ch)
 
-        # Add file handler
+        # Add file handler (the file is only created when something is logged)
         if FILE_LOGGING:
-            logger.addHandler(logging.FileHandler(f"{LOG_DIR}/{name}.log"))
+            logger.addHandler(logging.FileHandler(f"{LOG_DIR}/{name}.log", delay=True))
 
     return logger
 